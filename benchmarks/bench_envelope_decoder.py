@@ -0,0 +1,73 @@
+"""Benchmark of the TCP envelope parsing: old re-scan loop vs EnvelopeDecoder.
+
+Run from the project root:
+
+`python benchmarks/bench_envelope_decoder.py`
+"""
+
+import sys
+import time
+
+import dfparser
+
+sys.path.append("./")
+
+from utils.transport.envelope import EnvelopeDecoder  # noqa: E402
+
+
+def legacy_loop(stream: bytes, chunk_size: int) -> int:
+    """Loop from the original `socket_handler` (1024 bytes reads, full re-parse)."""
+    count = 0
+    buffer = b""
+    for pos in range(0, len(stream), chunk_size):
+        buffer += stream[pos : pos + chunk_size]
+        messages, buffer = dfparser.get_messages_from_stream(buffer)
+        count += len(messages)
+    return count
+
+
+def decoder_loop(stream: bytes, chunk_size: int) -> int:
+    count = 0
+    decoder = EnvelopeDecoder()
+    for pos in range(0, len(stream), chunk_size):
+        count += len(decoder.feed(stream[pos : pos + chunk_size]))
+    return count
+
+
+def bench(name: str, stream: bytes, expected: int):
+    for func, chunk_size in (
+        (legacy_loop, 1024),
+        (decoder_loop, 1024),
+        (decoder_loop, 65536),
+    ):
+        start = time.perf_counter()
+        count = func(stream, chunk_size)
+        elapsed = time.perf_counter() - start
+        assert count == expected, (func.__name__, count, expected)
+        print(
+            f"{name:<28} {func.__name__:<13} chunk={chunk_size:<6}"
+            f" {elapsed * 1000:9.2f} ms  {len(stream) / elapsed / 1e6:8.1f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    command = dict(
+        type="command",
+        command_type="set_voltage_and_check",
+        block=1,
+        voltage=1000,
+        max_error=1.0,
+        timeout=20,
+    )
+
+    burst = b"".join(dfparser.create_message(command, b"") for _ in range(2000))
+    bench("burst of 2000 commands", burst, 2000)
+
+    large = dfparser.create_message(command, bytes(4 * 1024 * 1024))
+    bench("one 4 MiB envelope", large, 1)
+
+    mixed = b"".join(
+        dfparser.create_message(command, bytes(256 * 1024 if i % 10 == 0 else 0))
+        for i in range(100)
+    )
+    bench("100 commands, 10% x 256 KiB", mixed, 100)
@@ -0,0 +1,74 @@
+"""Benchmark of command validation: `jsonschema.validate` per call vs CommandParser.
+
+Run from the project root:
+
+`python benchmarks/bench_validation.py`
+"""
+
+import json
+import sys
+import time
+
+import jsonschema
+
+sys.path.append("./")
+
+from utils.commands import SCHEMA_PATH, CommandParser  # noqa: E402
+
+BURST = [
+    {
+        "type": "command",
+        "command_type": "set_voltage",
+        "block": 1,
+        "voltage": 1000.0 + i,
+        "request_id": i,
+    }
+    if i % 2
+    else {
+        "type": "command",
+        "command_type": "set_voltage_and_check",
+        "block": "1",
+        "voltage": 1000.0 + i,
+        "max_error": 1.0,
+        "timeout": 60,
+    }
+    for i in range(2000)
+]
+
+
+def legacy_loop(schema: dict) -> int:
+    """Loop from the original `__handle_input` (schema is re-checked on each call)."""
+    for meta in BURST:
+        jsonschema.validate(meta, schema)
+    return len(BURST)
+
+
+def parser_loop(parser: CommandParser) -> int:
+    for meta in BURST:
+        parser.parse(meta)
+    return len(BURST)
+
+
+def main():
+    with open(SCHEMA_PATH, "r") as schema_file:
+        schema = json.load(schema_file)
+
+    start = time.perf_counter()
+    parser = CommandParser()
+    print(f"compile schema {(time.perf_counter() - start) * 1000:9.2f} ms")
+
+    for name, func, arg in (
+        ("jsonschema.validate", legacy_loop, schema),
+        ("CommandParser.parse", parser_loop, parser),
+    ):
+        start = time.perf_counter()
+        count = func(arg)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<20} {count} commands {elapsed * 1000:9.2f} ms"
+            f"  {elapsed / count * 1e6:8.1f} us/command"
+        )
+
+
+if __name__ == "__main__":
+    main()
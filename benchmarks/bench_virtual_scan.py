@@ -0,0 +1,68 @@
+"""Full calibration scan in VIRTUAL_MODE on an accelerated clock.
+
+Runs the 0..19 kV scan of `calibration/gather.py` through `HVManager`
+with the fitted simulator and prints per-point results with the virtual
+and the real elapsed time. Requires `VIRTUAL_MODE = True`.
+
+Run from the project root:
+
+`python benchmarks/bench_virtual_scan.py [clock speed]`
+"""
+
+import asyncio
+import sys
+import time
+
+sys.path.append("./")
+
+from config import VIRTUAL_MODE  # noqa: E402
+from hv_manager import HVManager  # noqa: E402
+from utils.clock import ScaledClock  # noqa: E402
+
+SCAN = {
+    "type": "command",
+    "command_type": "run_scan",
+    "block": 1,
+    "start": 0,
+    "stop": 19000,
+    "step": 1000,
+    "dwell": 60,
+    "max_error": 0.5,
+    "timeout": 600,
+    "criterion": "statistical",
+}
+
+
+async def main(speed: float):
+    clock = ScaledClock(speed)
+    manager = HVManager(clock=clock)
+    await manager.start()
+    subscription = manager.output.subscribe()
+    try:
+        real_start, virtual_start = time.monotonic(), clock.time()
+        await manager.input.put(dict(meta=SCAN, data=b""))
+        while True:
+            meta = (await subscription.get()).meta
+            if meta.get("answer_type") != "run_scan":
+                continue
+            if meta["status"] != "point":
+                print(meta)
+                break
+            print(
+                f"{meta['setpoint']:8.0f} V  {meta['point_status']:<8}"
+                f" error {meta['error']:+8.3f} V  noise {meta['noise'] or 0:.4f} V"
+                f"  settled in {meta['settle_time'] or float('nan'):6.1f} s"
+            )
+        print(
+            f"virtual time {clock.time() - virtual_start:8.1f} s,"
+            f" real time {time.monotonic() - real_start:6.2f} s"
+        )
+    finally:
+        manager.output.unsubscribe(subscription)
+        await manager.stop()
+
+
+if __name__ == "__main__":
+    if not VIRTUAL_MODE:
+        sys.exit("set VIRTUAL_MODE = True to run the benchmark")
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 200))
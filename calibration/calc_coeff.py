@@ -1,55 +1,140 @@
-import csv
+"""Fit the HV scaling coefficients (`utils/scale.py`) from calibration sessions.
+
+Run from the project root:
+
+`python calibration/calc_coeff.py [calibration-data/29.11.2022 ...] [--per-session] [--plot]`
+
+Readings taken `--settle` sec after each setpoint are paired with the
+calibrator output of that setpoint and `HV = A * output + B` is fitted with
+a robust (Huber) regression over all sessions. The joint result is printed
+as lines for config_local.py.
+"""
+
+import argparse
 import sys
-from datetime import timedelta
-from itertools import chain
-from os import path
 
 import numpy as np
-import plotly.graph_objects as go
-from dateutil.parser import parse
 
 sys.path.append("./")
 
-from config import DIVIDER_FACTOR
+from calibration.sessions import (  # noqa: E402
+    Session,
+    assign_steps,
+    load_session,
+    session_dirs,
+)
 
-PATH = "./calibration-data/29.11.2022"
+# Huber loss threshold, in robust residual sigmas
+HUBER_K = 1.345
+MAX_ITERATIONS = 50
+
+
+def pairs(session: Session, settle: float) -> tuple[np.ndarray, np.ndarray]:
+    """Calibrator outputs and HV readings of the settled parts of the steps."""
+    step = assign_steps(session, settle)
+    mask = (step >= 0) & np.isfinite(session.voltages)
+    x = session.set_scaled[step[mask]]
+    y = session.voltages[mask]
+    finite = np.isfinite(x)
+    return x[finite], y[finite]
+
+
+def robust_fit(x: np.ndarray, y: np.ndarray) -> tuple[float, float, np.ndarray]:
+    """`y = a * x + b` by iteratively reweighted least squares (Huber weights).
+
+    Returns:
+        a, b and the final weights of the points.
+    """
+    design = np.column_stack([x, np.ones_like(x)])
+    weights = np.ones_like(x)
+    coeffs = np.zeros(2)
+    for _ in range(MAX_ITERATIONS):
+        sqrt_w = np.sqrt(weights)
+        new, *_ = np.linalg.lstsq(design * sqrt_w[:, None], y * sqrt_w, rcond=None)
+        residuals = y - design @ new
+        scale = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+        if scale == 0:
+            coeffs = new
+            break
+        ratio = np.abs(residuals) / (HUBER_K * scale)
+        weights = np.where(ratio <= 1, 1.0, 1.0 / np.maximum(ratio, 1e-12))
+        converged = np.allclose(new, coeffs, rtol=1e-10, atol=1e-9)
+        coeffs = new
+        if converged:
+            break
+    return float(coeffs[0]), float(coeffs[1]), weights
 
-output_voltages = list(
-    (parse(row["timestamp"]), float(row["voltage"]) * DIVIDER_FACTOR)
-    for row in csv.DictReader(open(path.join(PATH, "voltage.csv"), "r", newline=""))
-)
 
-input_voltages = list(
-    (parse(row["timestamp"]), float(row["voltage_scaled"]))
-    for row in csv.DictReader(
-        open(path.join(PATH, "voltage_sets.csv"), "r", newline="")
+def residual_stats(x, y, a: float, b: float) -> dict[str, float]:
+    residuals = y - (a * x + b)
+    return dict(
+        points=len(x),
+        rms=float(np.sqrt(np.mean(residuals**2))),
+        mad=float(1.4826 * np.median(np.abs(residuals - np.median(residuals)))),
+        max=float(np.max(np.abs(residuals))),
     )
-)
 
 
-def __group_voltages(input_, output):
-    for idx, input_step in enumerate(input_):
-        start_ts = input_step[0] + timedelta(seconds=30)
-        end_ts = (
-            input_[idx + 1][0]
-            if idx != len(input_) - 1
-            else start_ts + timedelta(hours=1)
-        )
-        out_v = filter(
-            lambda voltage: voltage[0] >= start_ts and voltage[0] < end_ts, output
-        )
-        yield [(input_step[1], v[1]) for v in out_v]
+def describe(name: str, x, y, a: float, b: float) -> str:
+    stats = residual_stats(x, y, a, b)
+    return (
+        f"# {name}: A = {a:.4f}, B = {b:.4f}, {stats['points']} points,"
+        f" residuals rms {stats['rms']:.3f} V, mad {stats['mad']:.3f} V,"
+        f" max {stats['max']:.3f} V"
+    )
+
+
+def plot(x, y, a: float, b: float):
+    import plotly.graph_objects as go
+
+    order = np.argsort(x)
+    fig = go.Figure()
+    fig.add_traces(go.Scatter(x=x[order], y=a * x[order] + b, mode="lines"))
+    fig.add_traces(go.Scatter(x=x, y=y, mode="markers"))
+    fig.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "sessions", nargs="*", help="session directories (all by default)"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=30,
+        help="readings earlier than this after a setpoint are dropped, sec",
+    )
+    parser.add_argument(
+        "--per-session", action="store_true", help="also fit every session alone"
+    )
+    parser.add_argument("--plot", action="store_true", help="show the joint fit")
+    args = parser.parse_args()
 
+    data = {
+        session.name: pairs(session, args.settle)
+        for session in map(load_session, session_dirs(args.sessions))
+    }
+    x = np.concatenate([x for x, _ in data.values()])
+    y = np.concatenate([y for _, y in data.values()])
+    if len(x) < 2:
+        sys.exit("not enough settled readings to fit")
 
-prepared_data = chain(*__group_voltages(input_voltages, output_voltages))
+    if args.per_session:
+        for name, (sx, sy) in data.items():
+            if len(sx) >= 2:
+                sa, sb, _ = robust_fit(sx, sy)
+                print(describe(name, sx, sy, sa, sb))
 
-x, y = zip(*prepared_data)
+    a, b, weights = robust_fit(x, y)
+    print(describe(f"{len(data)} sessions", x, y, a, b))
+    print(f"# {np.sum(weights < 1)} points downweighted as outliers")
+    print(f"HV_SCALING_COEFFICIENT_A = {a:.4f}")
+    print(f"HV_SCALING_COEFFICIENT_B = {b:.4f}")
 
-a, b = np.polyfit(x, y, 1)
+    if args.plot:
+        plot(x, y, a, b)
 
-print(a, b)
 
-fig = go.Figure()
-fig.add_traces(go.Scatter(x=x, y=[(a * p + b) for p in x], mode="lines+markers"))
-fig.add_traces(go.Scatter(x=x, y=y, mode="markers"))
-fig.show()
+if __name__ == "__main__":
+    main()
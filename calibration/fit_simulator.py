@@ -0,0 +1,105 @@
+"""Fit the VIRTUAL_MODE simulator parameters (utils/simulator.py) from calibration sessions.
+
+Run from the project root:
+
+`python calibration/fit_simulator.py [calibration-data/23.09.2022 ...]`
+
+The result is printed as lines for config_local.py.
+"""
+
+import sys
+
+import numpy as np
+
+sys.path.append("./")
+
+from calibration.sessions import load_session as read_session  # noqa: E402
+from calibration.sessions import session_dirs  # noqa: E402
+from config import VIRTUAL_INTEGRATION_TIME  # noqa: E402
+from utils.simulator import INTEGRATION_POINTS, step_response  # noqa: E402
+
+# readings later than this after a setpoint change belong to the steady part
+SETTLE_DELAY = 30
+# readings right after a setpoint change used to fit the dynamics
+FIT_READINGS = 3
+# steps below this voltage are too noisy for the relative drift
+MIN_DRIFT_VOLTAGE = 500
+
+SLEW_RATES = np.logspace(1, 4, 41)
+TAUS = np.logspace(-1.5, 1.5, 41)
+
+
+def load_session(dirname: str):
+    """Reading times/voltages and setpoint times (sec from the session start)."""
+    session = read_session(dirname)
+    origin = session.times[0]
+    return (
+        (session.times - origin) / 1e9,
+        np.asarray(session.voltages),
+        (session.set_times - origin) / 1e9,
+    )
+
+
+def model_reading(ts, t0, start, target, slew_rate, tau):
+    """Mean of the step response over the integration time before `ts`."""
+    points = ts - VIRTUAL_INTEGRATION_TIME * (
+        (np.arange(INTEGRATION_POINTS) + 0.5) / INTEGRATION_POINTS
+    )
+    return np.mean(
+        [step_response(t - t0, start, target, slew_rate, tau) for t in points]
+    )
+
+
+def analyze(sessions: list[str]):
+    noises, drifts, steps = [], [], []
+    for dirname in sessions:
+        times, voltages, set_times = load_session(dirname)
+        ends = np.append(set_times[1:], times[-1] + 1)
+        levels = []
+        for t0, t_end in zip(set_times, ends):
+            steady = (times >= t0 + SETTLE_DELAY) & (times < t_end)
+            if steady.sum() < 3:
+                levels.append(None)
+                continue
+            slope, intercept = np.polyfit(times[steady], voltages[steady], 1)
+            residuals = voltages[steady] - (slope * times[steady] + intercept)
+            level = float(np.median(voltages[steady]))
+            levels.append(level)
+            noises.append(np.std(residuals, ddof=2))
+            if abs(level) >= MIN_DRIFT_VOLTAGE:
+                drifts.append(slope / level * 3600)
+
+        for idx in range(1, len(set_times)):
+            start, target = levels[idx - 1], levels[idx]
+            if start is None or target is None or abs(target - start) < 1:
+                continue
+            after = np.flatnonzero(times > set_times[idx])[:FIT_READINGS]
+            steps.append((set_times[idx], start, target, times[after], voltages[after]))
+
+    best = (np.inf, 0.0, 0.0)
+    for slew_rate in SLEW_RATES:
+        for tau in TAUS:
+            cost = 0.0
+            for t0, start, target, ts, observed in steps:
+                model = [
+                    model_reading(t, t0, start, target, slew_rate, tau) for t in ts
+                ]
+                cost += np.sum(((observed - model) / (target - start)) ** 2)
+            if cost < best[0]:
+                best = (cost, slew_rate, tau)
+
+    return {
+        "VIRTUAL_CHANGE_SPEED": best[1],
+        "VIRTUAL_SETTLING_TAU": best[2],
+        "VIRTUAL_NOISE": float(np.median(noises)),
+        "VIRTUAL_DRIFT": float(np.median(drifts)) if drifts else 0.0,
+        "steps": len(steps),
+    }
+
+
+if __name__ == "__main__":
+    sessions = session_dirs(sys.argv[1:])
+    result = analyze(sessions)
+    print(f"# fitted from {len(sessions)} sessions, {result.pop('steps')} steps")
+    for name, value in result.items():
+        print(f"{name} = {value:.4g}")
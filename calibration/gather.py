@@ -1,103 +1,267 @@
+"""Record a calibration session for calc_coeff.py / fit_simulator.py.
+
+Run from the project root (the server must be stopped):
+
+`python calibration/gather.py [calibration-data/<date>] [--start 0 --stop 20000 --step 1000]`
+
+The calibrator steps through the setpoints, each step lasts until the
+voltage is steady (no significant trend, see
+:class:`utils.settling.SettlingDetector`) and `--samples` more readings
+are taken, but not longer than `--max-step-time`. The instruments are
+driven by the server drivers (:mod:`utils.instruments`), `VISA_LIBRARY`
+selects real instruments or pyvisa-sim.
+
+Readings are appended to the CSV files in chunks; after each step the
+progress is saved to `checkpoint.json`, so an interrupted session is
+resumed by running the same command again.
+"""
+
+import argparse
 import asyncio
+import csv
+import json
+import math
+import os
 import sys
+import time
 from datetime import datetime
+from os import path
 
+import pyvisa as visa
 from tqdm import tqdm
 
 sys.path.append("./")
 
-import csv
-
-import pyvisa as visa
-
-from config import (
+from config import (  # noqa: E402
     AGILENT_34401A_GPIB_ADDR,
     DIVIDER_FACTOR,
     FLUKE_5502E_GPIB_ADDR,
+    VISA_LIBRARY,
 )
-from utils.logger import init_logger
-from utils.scale import rescale_voltage
+from utils.instruments import Agilent34401A, Fluke5502E  # noqa: E402
+from utils.logger import init_logger  # noqa: E402
+from utils.scale import rescale_voltage  # noqa: E402
+from utils.settling import SettlingDetector  # noqa: E402
 
-__voltage = 0
+FIELDNAMES = ["timestamp", "voltage", "voltage_scaled"]
+CHECKPOINT = "checkpoint.json"
 
-PATH = "./calibration-data/29.11.2022"
 
+class ChunkedCsv:
+    """Append-only CSV file written in chunks of `chunk` rows.
 
-async def agilent_loop():
-    try:
-        resource_mgr = visa.ResourceManager()
-        agilent_gpib = resource_mgr.open_resource(AGILENT_34401A_GPIB_ADDR)
-
-        agilent_gpib.write("*RST")
-        await asyncio.sleep(1.0)
-        agilent_gpib.write("CONF:VOLT:DC 10,0.00001")
-        await asyncio.sleep(1)
-        agilent_gpib.write("DET:BAND 3")
-        await asyncio.sleep(1)
-        agilent_gpib.write("INP:IMP:AUTO ON")
-        await asyncio.sleep(1)
-        agilent_gpib.write("VOLT:NPLC 100")
-        await asyncio.sleep(1)
-
-        with open(f"{PATH}/voltage.csv", "w", newline="") as csvfile:
-            fieldnames = ["timestamp", "voltage", "voltage_scaled"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, dialect="unix")
-            writer.writeheader()
-            while True:
-                global __voltage
-                agilent_gpib.write("READ?")
-                await asyncio.sleep(4)
-                __voltage = float(agilent_gpib.read())
-                writer.writerow(
-                    {
-                        "timestamp": datetime.now().isoformat(),
-                        "voltage": __voltage,
-                    }
-                )
+    A partial last line (the run was killed in the middle of a write) is cut
+    off when the file is opened, each chunk is flushed and fsynced.
+    """
 
-    except visa.Error:
-        sys.exit()  # TODO: change to adequate exit
+    def __init__(self, filename: str, chunk: int):
+        self.filename = filename
+        self.chunk = chunk
+        self.__rows: list[dict] = []
+        self.__repair()
+        new = not path.exists(filename) or path.getsize(filename) == 0
+        self.__file = open(filename, "a", newline="")
+        self.__writer = csv.DictWriter(self.__file, FIELDNAMES, dialect="unix")
+        if new:
+            self.__writer.writeheader()
+            self.__sync()
 
+    def __repair(self):
+        if not path.exists(self.filename):
+            return
+        with open(self.filename, "rb+") as file:
+            data = file.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                file.truncate(end)
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def write(self, row: dict):
+        self.__rows.append(row)
+        if len(self.__rows) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if self.__rows:
+            self.__writer.writerows(self.__rows)
+            self.__rows.clear()
+            self.__sync()
+
+    def close(self):
+        self.flush()
+        self.__file.close()
 
-async def fluke_loop():
-    try:
-        resource_mgr = visa.ResourceManager()
-        fluke_gpib = resource_mgr.open_resource(FLUKE_5502E_GPIB_ADDR)
 
-        fluke_gpib.write("OPER")
-        await asyncio.sleep(2)
+def load_checkpoint(dirname: str, plan: list[float]) -> int:
+    """Number of finished steps of an interrupted session (0 for a new one)."""
+    filename = path.join(dirname, CHECKPOINT)
+    if not path.exists(filename):
+        return 0
+    with open(filename, "r", encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    if checkpoint["plan"] != plan:
+        sys.exit(
+            f"{filename} was written for other setpoints, "
+            "use the same --start/--stop/--step or another session directory"
+        )
+    return int(checkpoint["done"])
 
-        print("wait 30s to leave HV unit")
-        await asyncio.sleep(30)
+
+def save_checkpoint(dirname: str, plan: list[float], done: int):
+    filename = path.join(dirname, CHECKPOINT)
+    with open(filename + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(dict(plan=plan, done=done, updated=datetime.now().isoformat()), file)
+    os.replace(filename + ".tmp", filename)
+
+
+async def run_step(
+    agilent: Agilent34401A,
+    fluke: Fluke5502E,
+    readings: ChunkedCsv,
+    setpoint: float,
+    args: argparse.Namespace,
+    progress: tqdm,
+) -> tuple[bool, int]:
+    """Set `setpoint` and take readings until the step is done.
+
+    Returns:
+        whether the voltage got steady and the number of readings.
+    """
+    output = rescale_voltage(setpoint)
+    await fluke.set_output(output)
+    start = time.monotonic()
+    detector = SettlingDetector(
+        setpoint, math.inf, min_samples=args.min_samples, start=start
+    )
+    steady_readings = count = 0
+    while steady_readings < args.samples:
+        voltage = await agilent.measure()
+        now = time.monotonic()
+        readings.write(
+            dict(
+                timestamp=datetime.now().isoformat(),
+                voltage=voltage,
+                voltage_scaled=output,
+            )
+        )
+        count += 1
+        detector.add(voltage * DIVIDER_FACTOR, now)
+        if detector.steady:
+            steady_readings += 1
+        progress.set_description(
+            f"{setpoint:g} V: {voltage * DIVIDER_FACTOR:.2f} V,"
+            f" steady {steady_readings}/{args.samples}",
+            refresh=True,
+        )
+        if now - start > args.max_step_time:
+            return False, count
+    return True, count
+
+
+async def gather(args: argparse.Namespace):
+    count = math.floor(abs(args.stop - args.start) / args.step * (1 + 1e-9))
+    direction = 1 if args.stop >= args.start else -1
+    plan = [args.start + direction * idx * args.step for idx in range(count + 1)]
+
+    os.makedirs(args.session, exist_ok=True)
+    done = load_checkpoint(args.session, plan)
+    if done >= len(plan):
+        print(f"session {args.session} is already complete")
+        return
+    if done:
+        print(f"resume {args.session} from step {done + 1}/{len(plan)}")
+
+    resource_manager = visa.ResourceManager(VISA_LIBRARY)
+    agilent = Agilent34401A(resource_manager, AGILENT_34401A_GPIB_ADDR)
+    fluke = Fluke5502E(resource_manager, FLUKE_5502E_GPIB_ADDR)
+    readings = ChunkedCsv(path.join(args.session, "voltage.csv"), args.chunk)
+    sets = ChunkedCsv(path.join(args.session, "voltage_sets.csv"), 1)
+    try:
+        await agilent.open()
+        await fluke.open()
+        await agilent.configure()
+        await fluke.configure()
+
+        if not done and args.leave_delay > 0:
+            print(f"wait {args.leave_delay:g}s to leave HV unit")
+            await asyncio.sleep(args.leave_delay)
         print("start gathering data")
 
-        with open(f"{PATH}/voltage_sets.csv", "w", newline="") as csvfile:
-            fieldnames = ["timestamp", "voltage", "voltage_scaled"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, dialect="unix")
-            writer.writeheader()
-            with tqdm(list(range(0, 20000, 1000))) as t:
-                for voltage in t:
-                    voltage_scaled = rescale_voltage(voltage)
-                    writer.writerow(
-                        {
-                            "timestamp": datetime.now().isoformat(),
-                            "voltage": voltage,
-                            "voltage_scaled": voltage_scaled,
-                        }
+        with tqdm(plan, initial=done) as progress:
+            for index in range(done, len(plan)):
+                setpoint = plan[index]
+                sets.write(
+                    dict(
+                        timestamp=datetime.now().isoformat(),
+                        voltage=setpoint,
+                        voltage_scaled=rescale_voltage(setpoint),
                     )
-                    fluke_gpib.write(f"OUT {voltage_scaled} V")
-                    for _ in range(60 * 10 // 5):
-                        t.set_description(
-                            f"{voltage}:{__voltage * DIVIDER_FACTOR}", refresh=True
-                        )
-                        await asyncio.sleep(5)
-    except visa.Error:
-        sys.exit()  # TODO: change to adequate exit
+                )
+                steady, taken = await run_step(
+                    agilent, fluke, readings, setpoint, args, progress
+                )
+                if not steady:
+                    tqdm.write(f"{setpoint:g} V not steady after {taken} readings")
+                readings.flush()
+                save_checkpoint(args.session, plan, index + 1)
+                progress.update()
+    finally:
+        readings.close()
+        sets.close()
+        await agilent.close()
+        await fluke.close()
 
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "session",
+        nargs="?",
+        default=path.join(
+            "./calibration-data", datetime.now().strftime("%d.%m.%Y")
+        ),
+        help="session directory (today's date by default)",
+    )
+    parser.add_argument("--start", type=float, default=0, help="first setpoint, V")
+    parser.add_argument("--stop", type=float, default=19000, help="last setpoint, V")
+    parser.add_argument("--step", type=float, default=1000, help="setpoint step, V")
+    parser.add_argument(
+        "--min-samples",
+        type=int,
+        default=10,
+        help="readings in the steadiness test",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=30,
+        help="steady readings to take per step",
+    )
+    parser.add_argument(
+        "--max-step-time",
+        type=float,
+        default=600,
+        help="step time limit, sec",
+    )
+    parser.add_argument(
+        "--chunk", type=int, default=15, help="readings per disk write"
+    )
+    parser.add_argument(
+        "--leave-delay",
+        type=float,
+        default=30,
+        help="pause before the first step of a new session, sec",
+    )
+    args = parser.parse_args()
+    if args.step <= 0:
+        parser.error("--step must be positive")
+
     init_logger("gather")
-    loop = asyncio.new_event_loop()
-    agilent_coro = loop.create_task(agilent_loop())
-    loop.run_until_complete(fluke_loop())
-    agilent_coro.cancel()
+    asyncio.run(gather(args))
+
+
+if __name__ == "__main__":
+    main()
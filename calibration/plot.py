@@ -1,22 +1,13 @@
-import csv
 import sys
-from os import path
 
 import plotly.express as px
-from dateutil.parser import parse
 
 sys.path.append("./")
 
-from config import DIVIDER_FACTOR
+from calibration.sessions import load_session  # noqa: E402
 
-PATH = "./calibration-data/29.11.2022"
+PATH = sys.argv[1] if len(sys.argv) > 1 else "./calibration-data/29.11.2022"
 
-timestamp, voltage = zip(
-    *(
-        (parse(row["timestamp"]), float(row["voltage"]) * DIVIDER_FACTOR)
-        for row in csv.DictReader(open(path.join(PATH, "voltage.csv"), "r", newline=""))
-    )
-)
-
-fig = px.line(x=timestamp, y=voltage)
+session = load_session(PATH)
+fig = px.line(x=session.times.astype("datetime64[ns]"), y=session.voltages)
 fig.show()
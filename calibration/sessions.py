@@ -0,0 +1,170 @@
+"""Calibration sessions (`calibration-data/<date>/`) as numpy arrays.
+
+A session directory holds `voltage.csv` (voltmeter readings) and
+`voltage_sets.csv` (setpoints with the calibrator output `voltage_scaled`),
+both written by `calibration/gather.py`.
+
+A session is parsed once and cached as `.npy` columns in `<session>/.cache/`.
+The cache is keyed by the size and mtime of the CSV files and by
+`DIVIDER_FACTOR`, a stale cache is rebuilt automatically. Cached columns
+are memory mapped, so opening a session again takes milliseconds.
+"""
+
+import csv
+import glob
+import json
+import os
+import shutil
+from os import path
+from typing import NamedTuple
+
+import numpy as np
+
+from config import DIVIDER_FACTOR
+
+DATA_ROOT = "./calibration-data"
+CACHE_DIR = ".cache"
+# bump when the cached columns change
+CACHE_VERSION = 1
+
+SOURCES = ("voltage.csv", "voltage_sets.csv")
+COLUMNS = ("times", "voltages", "set_times", "setpoints", "set_scaled")
+
+
+class Session(NamedTuple):
+    """Readings and setpoints of one session.
+
+    Times are ns since the epoch (timestamps are local time, as written).
+    """
+
+    name: str
+    times: np.ndarray  # int64, ns
+    voltages: np.ndarray  # HV, V (voltmeter reading * DIVIDER_FACTOR)
+    set_times: np.ndarray  # int64, ns
+    setpoints: np.ndarray  # requested HV, V
+    set_scaled: np.ndarray  # calibrator output, V
+
+
+def _columns(filename: str, names: tuple[str, ...]) -> list[list[str]]:
+    with open(filename, "r", newline="") as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        indices = [header.index(name) for name in names]
+        rows = list(reader)
+    return [[row[idx] for row in rows] for idx in indices]
+
+
+def _nanoseconds(timestamps: list[str]) -> np.ndarray:
+    """ISO 8601 timestamps -> ns (parsed by numpy in one pass)."""
+    return np.array(timestamps, dtype="datetime64[ns]").astype(np.int64)
+
+
+def _floats(values: list[str]) -> np.ndarray:
+    return np.array([value or "nan" for value in values], dtype=float)
+
+
+def parse_session(dirname: str) -> dict[str, np.ndarray]:
+    """Parse the CSV files of a session into sorted columns."""
+    timestamps, voltages = _columns(
+        path.join(dirname, "voltage.csv"), ("timestamp", "voltage")
+    )
+    set_timestamps, setpoints, set_scaled = _columns(
+        path.join(dirname, "voltage_sets.csv"),
+        ("timestamp", "voltage", "voltage_scaled"),
+    )
+    times = _nanoseconds(timestamps)
+    order = np.argsort(times, kind="stable")
+    set_times = _nanoseconds(set_timestamps)
+    set_order = np.argsort(set_times, kind="stable")
+    return dict(
+        times=times[order],
+        voltages=_floats(voltages)[order] * DIVIDER_FACTOR,
+        set_times=set_times[set_order],
+        setpoints=_floats(setpoints)[set_order],
+        set_scaled=_floats(set_scaled)[set_order],
+    )
+
+
+def _cache_key(dirname: str) -> dict:
+    sources = {}
+    for filename in SOURCES:
+        stat = os.stat(path.join(dirname, filename))
+        sources[filename] = [stat.st_size, stat.st_mtime_ns]
+    return dict(version=CACHE_VERSION, divider=DIVIDER_FACTOR, sources=sources)
+
+
+def _read_cache(cache: str, key: dict) -> dict[str, np.ndarray] | None:
+    try:
+        with open(path.join(cache, "key.json"), "r", encoding="utf-8") as file:
+            if json.load(file) != key:
+                return None
+        return {
+            name: np.load(path.join(cache, f"{name}.npy"), mmap_mode="r")
+            for name in COLUMNS
+        }
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(cache: str, key: dict, columns: dict[str, np.ndarray]):
+    """Write the columns, the key goes last and marks the cache as complete."""
+    tmp = cache + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in COLUMNS:
+        np.save(path.join(tmp, f"{name}.npy"), columns[name])
+    with open(path.join(tmp, "key.json"), "w", encoding="utf-8") as file:
+        json.dump(key, file)
+    shutil.rmtree(cache, ignore_errors=True)
+    os.replace(tmp, cache)
+
+
+def load_session(dirname: str, use_cache: bool = True) -> Session:
+    """Load one session directory (from the cache if it is up to date)."""
+    name = path.basename(path.normpath(dirname))
+    cache = path.join(dirname, CACHE_DIR)
+    key = _cache_key(dirname)
+    columns = _read_cache(cache, key) if use_cache else None
+    if columns is None:
+        columns = parse_session(dirname)
+        if use_cache:
+            try:
+                _write_cache(cache, key, columns)
+            except OSError as exc:
+                print(f"# couldn't cache session {name}: {exc!r}")
+    return Session(name, *(columns[column] for column in COLUMNS))
+
+
+def session_dirs(patterns: list[str]) -> list[str]:
+    """Session directories matching `patterns` (all of `DATA_ROOT` by default)."""
+    if not patterns:
+        patterns = [path.join(DATA_ROOT, "*")]
+    dirs = sorted(
+        {
+            dirname
+            for pattern in patterns
+            for dirname in glob.glob(pattern)
+            if path.isfile(path.join(dirname, "voltage.csv"))
+        }
+    )
+    if not dirs:
+        raise FileNotFoundError(f"no calibration sessions match {patterns}")
+    return dirs
+
+
+def assign_steps(
+    session: Session, settle: float, last_step: float = 3600
+) -> np.ndarray:
+    """Index of the setpoint each reading belongs to, -1 for the settling window.
+
+    A reading belongs to the last setpoint before it if it was taken at least
+    `settle` sec after that setpoint; the readings after the last setpoint
+    are taken for `last_step` sec.
+    """
+    step = np.searchsorted(session.set_times, session.times, side="right") - 1
+    valid = step >= 0
+    since = np.full(len(session.times), -np.inf)
+    since[valid] = (session.times[valid] - session.set_times[step[valid]]) / 1e9
+    last = step == len(session.set_times) - 1
+    keep = valid & (since >= settle) & ~(last & (since >= settle + last_step))
+    return np.where(keep, step, -1)
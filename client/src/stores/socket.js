@@ -1,15 +1,99 @@
-import { ref } from "vue";
+import { ref, shallowRef } from "vue";
 import { defineStore } from "pinia";
 
+// Limits of the kept history (older entries are dropped)
+const MAX_MESSAGES = 1000;
+const MAX_POINTS = 5000;
+
+// Topics and decimation window requested from the server
+// (see the `subscribe` message in docs/API.md)
+export const SUBSCRIPTION = {
+  type: "subscribe",
+  topics: ["get_voltage", "answer", "error"],
+  window: 1,
+};
+
+// Recent history replayed by the server on connect
+// (see the `snapshot` message in docs/API.md)
+export const SNAPSHOT = {
+  type: "snapshot",
+  seconds: 3600,
+};
+
 export const useSocketStore = defineStore("counter", () => {
+  // command answers and errors
   const messages = ref([]);
+  // measurements by block: {time: [], voltage: [], min: [], max: []}
+  const voltages = shallowRef({});
+
+  function pushBounded(array, value, limit) {
+    array.push(value);
+    if (array.length > limit) {
+      array.splice(0, array.length - limit);
+    }
+  }
+
+  function putVoltage(time, message) {
+    const series = voltages.value[message.block] ?? {
+      time: [],
+      voltage: [],
+      min: [],
+      max: [],
+    };
+    pushBounded(series.time, time, MAX_POINTS);
+    pushBounded(series.voltage, message.mean ?? message.voltage, MAX_POINTS);
+    pushBounded(series.min, message.min ?? message.voltage, MAX_POINTS);
+    pushBounded(series.max, message.max ?? message.voltage, MAX_POINTS);
+    // new object so that the computed plot data is refreshed
+    voltages.value = { ...voltages.value, [message.block]: series };
+  }
+
+  function putSnapshot(snapshot) {
+    const updated = { ...voltages.value };
+    const answers = [];
+    for (const [block, history] of Object.entries(snapshot.blocks)) {
+      const live = updated[block] ?? {
+        time: [],
+        voltage: [],
+        min: [],
+        max: [],
+      };
+      // live readings received before the snapshot are newer than its end
+      const first = live.time.length ? live.time[0] / 1000 : Infinity;
+      let end = history.time.findIndex((time) => time >= first);
+      end = end === -1 ? history.time.length : end;
+      const start = Math.max(0, end + live.time.length - MAX_POINTS);
+      const time = history.time
+        .slice(start, end)
+        .map((seconds) => new Date(seconds * 1000));
+      const voltage = history.voltage.slice(start, end);
+      updated[block] = {
+        time: time.concat(live.time),
+        voltage: voltage.concat(live.voltage),
+        min: voltage.concat(live.min),
+        max: voltage.concat(live.max),
+      };
+      for (const answer of history.answers ?? []) {
+        answers.push({ time: new Date(answer.time * 1000), message: answer });
+      }
+    }
+    answers.sort((a, b) => a.time - b.time);
+    messages.value = answers.concat(messages.value).slice(-MAX_MESSAGES);
+    voltages.value = updated;
+  }
 
   function putMessage(message) {
-    messages.value.push({
-      time: new Date(),
-      message: message,
-    });
+    const time = new Date();
+    if (message.type === "reply" && message.reply_type === "snapshot") {
+      putSnapshot(message);
+      return;
+    }
+    if (message.type === "answer" && message.answer_type === "get_voltage") {
+      putVoltage(time, message);
+      return;
+    }
+    pushBounded(messages.value, { time: time, message: message }, MAX_MESSAGES);
   }
 
-  return { messages, putMessage };
+  return { messages, voltages, putMessage };
 });
@@ -9,12 +9,77 @@ LOG_LEVEL_FILE = INFO # уровень логирования для файла
 LOG_LEVEL_CLI = _DEBUG # уровень логирования для консоли
 
 VIRTUAL_MODE: bool = True
-VIRTUAL_CHANGE_SPEED: int = (
-    200  # скорость изменения напряжения в виртуальном режиме, В/сек
-)
+# Параметры симулятора виртуального режима (utils/simulator.py),
+# подбираются по calibration-data/ скриптом calibration/fit_simulator.py
+VIRTUAL_CHANGE_SPEED: float = 1059  # скорость нарастания напряжения, В/сек
+VIRTUAL_SETTLING_TAU: float = 1.995  # постоянная времени выхода на режим, сек
+VIRTUAL_NOISE: float = 0.005376  # СКО шума измерений, В
+VIRTUAL_DRIFT: float = -9.724e-6  # относительный дрейф выходного напряжения, 1/час
+VIRTUAL_INTEGRATION_TIME: float = 4.0  # время одного измерения вольтметра, сек
+VIRTUAL_SEED: int | None = None  # зерно генератора шума (None - случайное)
+# Относительная ошибка HV_SCALING_COEFFICIENT_A симулируемой стойки
+# (для проверки коррекции и подстройки коэффициентов)
+VIRTUAL_SCALING_ERROR: float = 0.0
+# Ускорение времени в виртуальном режиме (100 - час работы проходит за 36 сек)
+VIRTUAL_CLOCK_SPEED: float = 1.0
+
+# Сколько команд может ждать в очереди, пока выполняется текущая
+# 0 - режим совместимости: SERVER_BUSY_ERROR на любую команду во время выполнения
+COMMAND_QUEUE_SIZE: int = 16
+# Новая команда set_voltage* заменяет еще не начатые set_voltage* в очереди
+COMMAND_COALESCE_SET_VOLTAGE: bool = True
+# Критерий выставления напряжения по умолчанию:
+# "reading" - первое измерение (или `consecutive` подряд) в допуске,
+# "statistical" - среднее и разброс последних SETTLE_MIN_SAMPLES измерений
+SETTLE_CRITERION: str = "reading"
+SETTLE_WINDOW: int = 20  # число измерений для аппроксимации выхода на режим
+SETTLE_MIN_SAMPLES: int = 5  # число измерений для статистического критерия
+SETTLE_CONFIDENCE: float = 2.0  # доверительный множитель (в сигмах)
+# Коррекция выхода калибратора по измеренной ошибке в set_voltage_and_check
+# (по умолчанию для команд без поля `closed_loop`)
+CORRECTION_CLOSED_LOOP: bool = False
+CORRECTION_MAX_ITERATIONS: int = 5  # максимальное число коррекций
+CORRECTION_GAIN: float = 0.8  # доля ошибки, исправляемая за одну коррекцию
+# Подстройка коэффициентов HV_SCALING_COEFFICIENT_* по установившимся точкам
+# (рекурсивный МНК с забыванием, см. utils/recalibration.py)
+SCALING_ONLINE: bool = False
+SCALING_FORGETTING: float = 0.995  # множитель забывания на одну точку
+SCALING_PRIOR_STD: tuple[float, float] = (0.5, 2.0)  # начальная неопределенность A, B
+SCALING_MEASUREMENT_STD: float = 0.3  # погрешность установившегося уровня, В
+SCALING_GATE: float = 5.0  # точки с невязкой больше GATE сигм не учитываются
+# Файл состояния ({block} - имя блока); удаление сбрасывает оценку к config
+SCALING_STATE_PATH: str = "./scaling-{block}.json"
+# Максимальное число точек в команде run_scan
+SCAN_MAX_POINTS: int = 10000
 
 AGILENT_34401A_GPIB_ADDR: str = "GPIB::20::INSTR"
 FLUKE_5502E_GPIB_ADDR: str = "GPIB::4::INSTR"
+# Библиотека VISA для pyvisa.ResourceManager: "" - по умолчанию,
+# "./sim/instruments.yaml@sim" - симуляция приборов через pyvisa-sim
+VISA_LIBRARY: str = ""
+VISA_TIMEOUT: float = 10  # таймаут одного обращения к прибору, сек
+
+# Режим чтения Agilent 34401A:
+# "trigger" - INIT + *OPC, опрос *ESR? после расчетного времени измерения, FETC?
+# "read" - READ? и фиксированная пауза AGILENT_READ_DELAY (старое поведение)
+AGILENT_ACQUISITION: str = "trigger"
+AGILENT_NPLC: float = 100  # время интегрирования в периодах сети
+AGILENT_AUTOZERO: bool = True  # автоподстройка нуля (удваивает время измерения)
+AGILENT_LINE_FREQUENCY: float = 50  # частота сети, Гц
+AGILENT_POLL_INTERVAL: float = 0.05  # период опроса *ESR?, сек
+AGILENT_READ_DELAY: float = 4  # пауза после READ? в режиме "read", сек
+
+# Блоки (каналы HV) сервера: имя блока -> параметры, например
+# {
+#     1: dict(sensor="HV", agilent="GPIB::20::INSTR", fluke="GPIB::4::INSTR",
+#             divider=-4050.65),
+#     "gun": dict(sensor="GUN", agilent="GPIB::10::INSTR", fluke=None,
+#                 divider=2025.4026),
+# }
+# fluke=None - блок только с вольтметром; scaling=(A, B) - коэффициенты
+# перевода напряжения (по умолчанию HV_SCALING_COEFFICIENT_*).
+# None - один блок 1 из AGILENT_34401A_GPIB_ADDR, FLUKE_5502E_GPIB_ADDR и DIVIDER_FACTOR
+BLOCKS: dict | None = None
 
 # Коэффициент перевода напряжения с Fluke -> FuG35000
 HV_SCALING_COEFFICIENT_A: float = 3500.5048
@@ -24,20 +89,54 @@ DIVIDER_FACTOR: float = -4050.65
 
 TCP_INTERFACE_HOST: str = "0.0.0.0"
 TCP_INTERFACE_PORT: int = 5555
+# Размер блока чтения из TCP сокета, байт
+DF_READ_CHUNK_SIZE: int = 65536
+# Максимальный размер входящего DataForge сообщения, байт
+DF_MAX_MESSAGE_SIZE: int = 16 * 1024 * 1024
+
+# Максимальная длина очереди исходящих сообщений одного клиента
+HUB_QUEUE_SIZE: int = 1000
+# Поведение при переполнении: "drop_oldest" | "drop_newest" | "coalesce" | "disconnect"
+HUB_QUEUE_POLICY: str = "drop_oldest"
 
 WEB_INTERFACE_HOST: str = "0.0.0.0"
 WEB_INTERFACE_PORT: int = 8080
+# Максимальное число точек в ответе /history
+HISTORY_MAX_POINTS: int = 100000
+# Буфер последних измерений в памяти (сообщение snapshot, /latest, /history),
+# часов при измерениях не чаще, чем раз в RING_BUFFER_MIN_INTERVAL сек
+RING_BUFFER_HOURS: float = 6
+RING_BUFFER_MIN_INTERVAL: float = 0.5
+# Число последних ответов на команды в буфере
+RING_BUFFER_ANSWERS: int = 200
 
 # Корень проекта (используется для обрезки абсолютных путей в логах)
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 # Путь к локальной базе данных медленного контроля
 LOCAL_DB_ROOT: str = "./data"
+# Период группового сброса накопленных измерений на диск, сек
+DB_FLUSH_INTERVAL: float = 5.0
+# Политика fsync при записи БД: "never" | "rotate" (смена суток/закрытие) | "commit" (каждый сброс)
+DB_FSYNC_POLICY: str = "rotate"
+# Дублировать измерения в колоночный формат (см. db_columnar.py)
+DB_COLUMNAR: bool = False
+# Вести агрегаты измерений (count/min/max/mean/std, см. db_rollup.py)
+DB_ROLLUP: bool = False
+# Длительности интервалов агрегатов, сек
+DB_ROLLUP_TIERS: tuple[int, ...] = (60, 900, 3600)
 
 # Команда для синхронизации базы данных с удаленным хранилищем
 # None - программа сама не синхронизирует данные
-DB_SYNC_COMMAND: str|None = f"rclone copy {LOCAL_DB_ROOT} ./test-db"
+# {files_from} заменяется на путь к списку изменившихся файлов (см. db_sync.py),
+# такая команда запускается без оболочки; команда без {files_from} - через оболочку
+DB_SYNC_COMMAND: str|None = f"rclone copy {LOCAL_DB_ROOT} ./test-db --files-from {{files_from}}"
 DB_SYNC_INTERVAL: int = 3600 * 2  # Интервал синхронизации базы данных в секундах
+DB_SYNC_TIMEOUT: float = 1800  # Максимальная длительность одной синхронизации, сек
+DB_SYNC_RETRY_DELAY: float = 60  # Начальная задержка повтора после ошибки, сек (удваивается)
+DB_SYNC_SHUTDOWN_TIMEOUT: float = 120  # Ожидание синхронизации при завершении, сек
+# Манифест синхронизированных файлов (размер и mtime)
+DB_SYNC_MANIFEST: str = "./db-sync-manifest.json"
 
 # переписывание параметров из локального конфига (config_local.py)
 try:
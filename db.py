@@ -1,9 +1,181 @@
 import datetime
+import numbers
 import os
+import threading
+import time
+from collections import deque
 from logging import getLogger
 from pathlib import Path
+from typing import Iterable
 
-from config import LOCAL_DB_ROOT, LOGGER_NAME, VIRTUAL_MODE
+from config import (
+    DB_FLUSH_INTERVAL,
+    DB_FSYNC_POLICY,
+    LOCAL_DB_ROOT,
+    LOGGER_NAME,
+    VIRTUAL_MODE,
+)
+from utils.metrics import DB_WRITE_LATENCY
+
+FSYNC_POLICIES = ("never", "rotate", "commit")
+
+Record = tuple[datetime.datetime, float]
+
+
+def day_stem(date_obj: datetime.date) -> str:
+    """Формирует имя суточного файла (без расширения) для указанной даты."""
+    date_str = date_obj.strftime("%y-%m-%d")  # Формат гг-мм-дд
+    if VIRTUAL_MODE:
+        return f"{date_str}-virtual"
+    else:
+        return date_str
+
+
+class DayStorage:
+    """
+    Базовый класс формата хранения суточных файлов одного датчика.
+
+    Все методы вызываются только из потока записи :class:`DailyTsvWriter`.
+    Наследник реализует открытие файлов суток (с восстановлением после
+    аварийного завершения), дозапись группы записей и откат к метке.
+    """
+
+    def __init__(self, base_path: Path, sensor_name: str):
+        self.base_path = base_path
+        self.sensor_name = sensor_name
+        self.__day: datetime.date | None = None
+        # метка, к которой нужно откатить файлы суток перед следующей записью
+        self.__abort_mark = None
+
+    def ensure(self, day: datetime.date):
+        """Открывает файлы суток `day`, закрывая файлы предыдущих суток."""
+        if self.__day == day:
+            return
+        if self.__day is not None:
+            self.close(fsync=True)
+        if self.__abort_mark is not None:
+            abort_day, mark = self.__abort_mark
+            self._truncate(abort_day, mark)
+            self.__abort_mark = None
+        self._open(day)
+        self.__day = day
+
+    def abort(self, mark):
+        """Закрывает файлы без сброса и запоминает метку для отката."""
+        if self.__day is not None:
+            self.__abort_mark = (self.__day, mark)
+        try:
+            self._close(fsync=False, discard=True)
+        # pylint: disable-next=broad-except
+        except Exception:
+            pass
+        self.__day = None
+
+    def close(self, fsync: bool):
+        if self.__day is None:
+            return
+        self.__day = None
+        self._close(fsync)
+
+    def mark(self):
+        """Возвращает метку текущего конца данных (для :meth:`abort`)."""
+        raise NotImplementedError
+
+    def append(self, records: list[Record]):
+        """Дописывает группу записей одних суток."""
+        raise NotImplementedError
+
+    def flush(self, fsync: bool):
+        raise NotImplementedError
+
+    def _open(self, day: datetime.date):
+        raise NotImplementedError
+
+    def _close(self, fsync: bool, discard: bool = False):
+        """Закрывает файлы суток.
+
+        Args:
+            discard: закрытие после ошибки записи (:meth:`abort`),
+                несохраненные данные не записываются.
+        """
+        raise NotImplementedError
+
+    def _truncate(self, day: datetime.date, mark):
+        raise NotImplementedError
+
+
+class TsvStorage(DayStorage):
+    """Текстовый формат 'timestamp\tvalue' (файлы 'гг-мм-дд.tsv')."""
+
+    def __init__(self, base_path: Path, sensor_name: str):
+        super().__init__(base_path, sensor_name)
+        self.__file = None
+        self.__logger = getLogger(LOGGER_NAME)
+
+    def filepath(self, day: datetime.date) -> Path:
+        return self.base_path / f"{day_stem(day)}.tsv"
+
+    def mark(self):
+        return self.__file.tell()  # type: ignore
+
+    def append(self, records: list[Record]):
+        self.__file.write(  # type: ignore
+            "".join(f"{ts.time().isoformat()}\t{val}\n" for ts, val in records).encode()
+        )
+
+    def flush(self, fsync: bool):
+        self.__file.flush()  # type: ignore
+        if fsync:
+            os.fsync(self.__file.fileno())  # type: ignore
+
+    def _open(self, day: datetime.date):
+        filepath = self.filepath(day)
+        self.__recover(filepath)
+        self.__file = open(filepath, "ab")
+        if self.__file.tell() == 0:
+            self.__file.write(f"timestamp\t{self.sensor_name}\n".encode())
+
+    def _close(self, fsync: bool, discard: bool = False):
+        if self.__file is None:
+            return
+        try:
+            if fsync:
+                self.flush(fsync=True)
+            self.__file.close()
+        finally:
+            self.__file = None
+
+    def _truncate(self, day: datetime.date, mark):
+        with open(self.filepath(day), "r+b") as data_file:
+            data_file.truncate(mark)
+
+    def __recover(self, filepath: Path):
+        """Отрезает недописанную (после аварийного завершения) последнюю строку."""
+        try:
+            size = filepath.stat().st_size
+        except FileNotFoundError:
+            return
+        if size == 0:
+            return
+
+        with open(filepath, "r+b") as data_file:
+            data_file.seek(size - 1)
+            if data_file.read(1) == b"\n":
+                return
+
+            pos = size
+            while pos > 0:
+                block = min(4096, pos)
+                pos -= block
+                data_file.seek(pos)
+                newline = data_file.read(block).rfind(b"\n")
+                if newline != -1:
+                    pos += newline + 1
+                    break
+            self.__logger.warning(
+                "%s: dropping %d bytes of incomplete last line", filepath, size - pos
+            )
+            data_file.truncate(pos)
 
 
 class DailyTsvWriter:
@@ -13,22 +185,50 @@ class DailyTsvWriter:
     Автоматически создает новый файл при смене суток.
     Имя файла формируется как 'basename/гг-мм-дд.tsv'.
     В каждый новый файл записывается заголовок 'timestamp\tvalue'.
+
+    Запись производится фоновым потоком: :meth:`write` только кладет
+    значение в буфер, а поток раз в `flush_interval` секунд дописывает
+    накопленные строки одной операцией (group commit) в постоянно
+    открытый файл текущих суток. Это убирает файловые операции
+    (и задержки NFS/SFTP) из цикла событий.
+
+    Помимо TSV те же записи могут дублироваться в дополнительные
+    форматы хранения (`extra_storages`, наследники :class:`DayStorage`).
     """
 
-    def __init__(self, sensor_name: str):
+    def __init__(
+        self,
+        sensor_name: str,
+        flush_interval: float = DB_FLUSH_INTERVAL,
+        fsync_policy: str = DB_FSYNC_POLICY,
+        extra_storages: Iterable[type[DayStorage]] = (),
+    ):
         """
-        Инициализирует логгер.
+        Инициализирует логгер и запускает фоновый поток записи.
 
         Args:
-            basename: Базовый каталог для хранения файлов логов.
-                      Может быть строкой или объектом Path.
+            sensor_name: Имя датчика (подкаталог в LOCAL_DB_ROOT).
+            flush_interval: Период группового сброса буфера на диск, сек.
+            fsync_policy: Когда вызывать fsync:
+                "never" - полагаться на ОС,
+                "rotate" - при смене суток и закрытии,
+                "commit" - после каждого группового сброса.
+            extra_storages: Дополнительные форматы хранения.
         """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(
+                f"unknown fsync policy '{fsync_policy}', expected one of {FSYNC_POLICIES}"
+            )
+
         # Преобразуем basename в объект Path для удобства работы
         self.base_path = Path(os.path.join(LOCAL_DB_ROOT, sensor_name))
 
         self.__sensor_name = sensor_name
         self.__logger = getLogger(LOGGER_NAME)  # Инициализация логгера
 
+        self.__flush_interval = flush_interval
+        self.__fsync_policy = fsync_policy
+
         # Убедимся, что базовая директория существует при инициализации
         try:
             self.base_path.mkdir(parents=True, exist_ok=True)
@@ -36,37 +236,184 @@ class DailyTsvWriter:
             self.__logger.error(f"failed to create directory {self.base_path}: {e}")
             raise
 
+        self.__tsv = TsvStorage(self.base_path, sensor_name)
+        self.__storages: list[DayStorage] = [self.__tsv] + [
+            storage(self.base_path, sensor_name) for storage in extra_storages
+        ]
+
+        # deque.append/popleft потокобезопасны, поэтому write() не берет блокировок
+        self.__pending: deque[Record] = deque()
+        self.__wakeup = threading.Condition()
+        self.__flush_requested = False
+        self.__closed = False
+        # номера начатых, законченных и удачных групповых записей (для flush)
+        self.__commits_started = 0
+        self.__commits_finished = 0
+        self.__commits_done = 0
+        self.__stopped = False
+
+        self.__thread = threading.Thread(
+            target=self.__writer_loop, name=f"db-writer-{sensor_name}", daemon=True
+        )
+        self.__thread.start()
+
     def _get_filepath(self, date_obj: datetime.date) -> Path:
         """Формирует полный путь к файлу для указанной даты."""
-        date_str = date_obj.strftime("%y-%m-%d")  # Формат гг-мм-дд
-        if VIRTUAL_MODE:
-            return self.base_path / f"{date_str}-virtual.tsv"
-        else:
-            return self.base_path / f"{date_str}.tsv"
+        return self.__tsv.filepath(date_obj)
 
     def write(self, val: float):
         """
-        Записывает текущую временную метку и значение в соответствующий
-        дневной TSV файл.
+        Ставит текущую временную метку и значение в очередь на запись
+        в соответствующий дневной TSV файл.
+
+        Метод не выполняет файловых операций и не блокируется.
 
         Args:
             val: Значение типа float для записи.
+
+        Raises:
+            TypeError: значение не число (в очереди оно ломало бы каждую
+                групповую запись).
+            ValueError: writer закрыт.
+        """
+        start = time.perf_counter()
+        if self.__closed:
+            raise ValueError(f"write to closed writer '{self.__sensor_name}'")
+        if not isinstance(val, numbers.Real):
+            raise TypeError(f"value must be a real number, got {type(val).__name__}")
+        self.__pending.append((datetime.datetime.now(), val))
+        DB_WRITE_LATENCY.observe(time.perf_counter() - start, self.__sensor_name)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Принудительно сбрасывает буфер на диск и ждет завершения.
+
+        Ждет групповую запись, начатую после вызова: запись, которая уже
+        выполнялась, могла не захватить последние значения.
+
+        Returns:
+            True, если буфер был записан до истечения `timeout`; False, если
+            запись не удалась (значения остаются в очереди) или не успела.
+
+        Raises:
+            ValueError: writer закрыт (остаток буфера записывает :meth:`close`).
         """
-        now = datetime.datetime.now()
-        today = now.date()
+        with self.__wakeup:
+            if self.__closed:
+                raise ValueError(f"flush of closed writer '{self.__sensor_name}'")
+            target = self.__commits_started + 1
+            self.__flush_requested = True
+            self.__wakeup.notify()
+            self.__wakeup.wait_for(
+                lambda: self.__commits_finished >= target or self.__stopped,
+                timeout=timeout,
+            )
+            return self.__commits_done >= target
+
+    def close(self, timeout: float | None = None):
+        """Записывает остаток буфера, закрывает файл и останавливает поток."""
+        with self.__wakeup:
+            self.__closed = True
+            self.__wakeup.notify()
+        self.__thread.join(timeout)
+        if self.__thread.is_alive():
+            self.__logger.error(
+                "db writer '%s' did not stop in %s s, %d records pending",
+                self.__sensor_name,
+                timeout,
+                len(self.__pending),
+            )
 
-        current_filepath = self._get_filepath(today)
+    def __writer_loop(self):
+        while True:
+            with self.__wakeup:
+                if not (self.__closed or self.__flush_requested):
+                    self.__wakeup.wait(self.__flush_interval)
+                closing = self.__closed
+                self.__flush_requested = False
+                self.__commits_started += 1
+                commit = self.__commits_started
 
-        with open(current_filepath, "a") as data_file:
-            need_header = current_filepath.stat().st_size == 0
-            if need_header:
-                data_file.write(f"timestamp\t{self.__sensor_name}\n")
+            written = self.__commit()
+
+            with self.__wakeup:
+                self.__commits_finished = commit
+                if written:
+                    self.__commits_done = commit
+                self.__wakeup.notify_all()
+
+            if closing:
+                for storage in self.__storages:
+                    try:
+                        storage.close(fsync=self.__fsync_policy != "never")
+                    # pylint: disable-next=broad-except
+                    except Exception as exc:
+                        self.__logger.error(
+                            "db writer '%s' failed: %s", self.__sensor_name, exc
+                        )
+                if self.__pending:
+                    self.__logger.error(
+                        "db writer '%s' closed with %d unwritten records",
+                        self.__sensor_name,
+                        len(self.__pending),
+                    )
+                with self.__wakeup:
+                    self.__stopped = True
+                    self.__wakeup.notify_all()
+                return
+
+    def __commit(self) -> bool:
+        """Групповая запись накопленных значений (выполняется в потоке записи).
+
+        Returns:
+            False, если запись не удалась и значения остались в очереди.
+        """
+        count = len(self.__pending)
+        if count == 0:
+            return True
+
+        records = [self.__pending.popleft() for _ in range(count)]
+        idx = 0
+        marks = []
+        try:
+            while idx < count:
+                # Записи упорядочены по времени, поэтому группируем их по суткам
+                day = records[idx][0].date()
+                end = idx
+                while end < count and records[end][0].date() == day:
+                    end += 1
 
-            timestamp_str = now.time().isoformat()
-            line = f"{timestamp_str}\t{val}\n"
-            data_file.write(line)
+                marks = []
+                for storage in self.__storages:
+                    storage.ensure(day)
+                    marks.append((storage, storage.mark()))
+                for storage in self.__storages:
+                    storage.append(records[idx:end])
+                for storage in self.__storages:
+                    storage.flush(fsync=self.__fsync_policy == "commit")
+                idx = end
+        # pylint: disable-next=broad-except
+        except Exception as exc:
+            # Возвращаем незаписанную группу в начало очереди и повторим ее
+            # на следующем цикле. Перед повтором файлы обрезаются до меток,
+            # взятых до начала группы, поэтому записи не задублируются.
+            # Любая ошибка формата хранения не должна останавливать поток:
+            # иначе очередь растет без записи, а flush ждет до таймаута.
+            if isinstance(exc, OSError):
+                self.__logger.error("db writer '%s' failed: %s", self.__sensor_name, exc)
+            else:
+                self.__logger.exception(
+                    "db writer '%s' failed: %s", self.__sensor_name, exc
+                )
+            self.__pending.extendleft(reversed(records[idx:]))
+            for storage, mark in marks:
+                storage.abort(mark)
+            return False
+        return True
 
     def __enter__(self):
         """Позволяет использовать класс с оператором 'with'."""
         return self
 
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,327 @@
+"""Колоночный формат хранения БД медленного контроля.
+
+Сутки одного датчика хранятся в двух файлах одинаковой длины:
+
+- 'гг-мм-дд.t.col' - время измерения (секунды UNIX time, float64 little-endian);
+- 'гг-мм-дд.v.col' - значение (float64 little-endian).
+
+Каждый файл начинается с заголовка :data:`HEADER` (32 байта), за которым
+идут значения фиксированной ширины. Время в файле монотонно не убывает,
+поэтому колонка времени сама является индексом: поиск диапазона делается
+бинарным поиском (:func:`numpy.searchsorted`) по отображенному в память
+файлу без разбора текста.
+
+Запуск модуля как скрипта конвертирует существующие TSV файлы:
+
+`python db_columnar.py data/HV/*.tsv`
+"""
+
+import argparse
+import datetime
+import mmap
+import os
+import struct
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from config import LOCAL_DB_ROOT
+from db import DayStorage, Record, day_stem
+
+MAGIC = b"HVCL"
+VERSION = 1
+# magic, версия, номер колонки, имя датчика, начало суток (UNIX time)
+HEADER = struct.Struct("<4sHH16sd")
+COLUMN_TIME = 0
+COLUMN_VALUE = 1
+ITEM = np.dtype("<f8")
+
+
+def column_paths(base_path: Path, stem: str) -> tuple[Path, Path]:
+    """Пути к файлам колонок времени и значений для суток `stem`."""
+    return base_path / f"{stem}.t.col", base_path / f"{stem}.v.col"
+
+
+def _header(column: int, sensor_name: str, day: datetime.date) -> bytes:
+    day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+    return HEADER.pack(
+        MAGIC, VERSION, column, sensor_name.encode()[:16], day_start
+    )
+
+
+class ColumnarStorage(DayStorage):
+    """Формат хранения для :class:`db.DailyTsvWriter` (см. описание модуля)."""
+
+    def __init__(self, base_path: Path, sensor_name: str):
+        super().__init__(base_path, sensor_name)
+        self.__files = None
+        self.__count = 0
+        self.__last_ts = -np.inf
+
+    def mark(self):
+        return self.__count
+
+    def append(self, records: list[Record]):
+        times = np.fromiter(
+            (ts.timestamp() for ts, _ in records), dtype=ITEM, count=len(records)
+        )
+        # Перевод часов назад не должен ломать сортировку колонки времени
+        np.maximum.accumulate(np.maximum(times, self.__last_ts), out=times)
+        values = np.fromiter(
+            (val for _, val in records), dtype=ITEM, count=len(records)
+        )
+        time_file, value_file = self.__files  # type: ignore
+        time_file.write(times.tobytes())
+        value_file.write(values.tobytes())
+        self.__count += len(records)
+        self.__last_ts = times[-1]
+
+    def flush(self, fsync: bool):
+        for column_file in self.__files:  # type: ignore
+            column_file.flush()
+            if fsync:
+                os.fsync(column_file.fileno())
+
+    def _open(self, day: datetime.date):
+        paths = column_paths(self.base_path, day_stem(day))
+        self.__count = self.__recover(paths, day)
+        files = []
+        for path in paths:
+            files.append(open(path, "ab"))
+        self.__files = files
+
+        self.__last_ts = -np.inf
+        if self.__count:
+            with open(paths[0], "rb") as time_file:
+                time_file.seek(HEADER.size + (self.__count - 1) * ITEM.itemsize)
+                self.__last_ts = np.frombuffer(time_file.read(ITEM.itemsize), ITEM)[0]
+
+    def _close(self, fsync: bool, discard: bool = False):
+        if self.__files is None:
+            return
+        try:
+            if fsync:
+                self.flush(fsync=True)
+            for column_file in self.__files:
+                column_file.close()
+        finally:
+            self.__files = None
+
+    def _truncate(self, day: datetime.date, mark):
+        for path in column_paths(self.base_path, day_stem(day)):
+            with open(path, "r+b") as column_file:
+                column_file.truncate(HEADER.size + mark * ITEM.itemsize)
+
+    def __recover(self, paths: tuple[Path, Path], day: datetime.date) -> int:
+        """Выравнивает колонки по числу целых записей и пишет заголовки."""
+        sizes = [path.stat().st_size if path.exists() else 0 for path in paths]
+        count = min(max(0, size - HEADER.size) // ITEM.itemsize for size in sizes)
+        for column, (path, size) in enumerate(zip(paths, sizes)):
+            if size < HEADER.size:
+                with open(path, "wb") as column_file:
+                    column_file.write(_header(column, self.sensor_name, day))
+            elif size != HEADER.size + count * ITEM.itemsize:
+                with open(path, "r+b") as column_file:
+                    column_file.truncate(HEADER.size + count * ITEM.itemsize)
+        return count
+
+
+class ColumnFile:
+    """Отображенная в память колонка (только чтение)."""
+
+    def __init__(self, path: Path, column: int):
+        with open(path, "rb") as column_file:
+            self.__mmap = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, file_column, sensor, day_start = HEADER.unpack_from(
+            self.__mmap
+        )
+        if magic != MAGIC or version != VERSION or file_column != column:
+            self.__mmap.close()
+            raise ValueError(f"{path} is not a column file of type {column}")
+        self.sensor_name = sensor.rstrip(b"\0").decode()
+        self.day_start = day_start
+        count = (len(self.__mmap) - HEADER.size) // ITEM.itemsize
+        self.array = np.frombuffer(self.__mmap, ITEM, count, HEADER.size)
+
+    def close(self):
+        self.array = None
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # снаружи еще живут срезы колонки, mmap закроется вместе с ними
+            pass
+
+
+class ColumnarDay:
+    """
+    Чтение суток колоночного формата без копирования данных.
+
+    `times` и `values` - массивы numpy поверх mmap, их срезы не копируют
+    данные. Пример:
+
+    ```python
+    with ColumnarDay(Path("data/HV"), "25-02-14") as day:
+        times, values = day.slice(start_ts, stop_ts)
+    ```
+    """
+
+    def __init__(self, base_path: Path, stem: str):
+        time_path, value_path = column_paths(base_path, stem)
+        self.__times = ColumnFile(time_path, COLUMN_TIME)
+        self.__values = ColumnFile(value_path, COLUMN_VALUE)
+        # запись могла быть прочитана посередине дозаписи одной из колонок
+        count = min(len(self.__times.array), len(self.__values.array))  # type: ignore
+        self.times: np.ndarray = self.__times.array[:count]  # type: ignore
+        self.values: np.ndarray = self.__values.array[:count]  # type: ignore
+
+    def slice(self, start: float, stop: float) -> tuple[np.ndarray, np.ndarray]:
+        """Записи с `start <= time < stop` (UNIX time), поиск за O(log n)."""
+        begin, end = np.searchsorted(self.times, (start, stop), side="left")
+        return self.times[begin:end], self.values[begin:end]
+
+    def close(self):
+        self.times = self.values = None  # type: ignore
+        self.__times.close()
+        self.__values.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_tsv(tsv_path: Path) -> tuple[str, datetime.date, np.ndarray, np.ndarray]:
+    """Разбирает суточный TSV файл.
+
+    Дата берется из имени файла ('гг-мм-дд[-virtual].tsv'), имя датчика -
+    из заголовка. Недописанная последняя строка пропускается.
+
+    Returns:
+        (имя датчика, дата, время в UNIX time, значения)
+    """
+    day = datetime.datetime.strptime(Path(tsv_path).stem[:8], "%y-%m-%d").date()
+
+    with open(tsv_path, "r") as tsv_file:
+        sensor_name = tsv_file.readline().rstrip("\n").split("\t")[1]
+        lines = [line.rstrip("\n").split("\t") for line in tsv_file if line.endswith("\n")]
+
+    times = np.fromiter(
+        (
+            datetime.datetime.combine(day, datetime.time.fromisoformat(ts)).timestamp()
+            for ts, _ in lines
+        ),
+        dtype=ITEM,
+        count=len(lines),
+    )
+    np.maximum.accumulate(times, out=times)
+    values = np.array([float(val) for _, val in lines], dtype=ITEM)
+    return sensor_name, day, times, values
+
+
+def read_range(
+    sensor_name: str,
+    start: datetime.datetime,
+    stop: datetime.datetime,
+    root: str = LOCAL_DB_ROOT,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Читает записи датчика за интервал `[start, stop)` (может охватывать много суток).
+
+    Для суток без колоночных файлов данные читаются из TSV.
+
+    Returns:
+        (время в UNIX time, значения) - копии данных, файлы закрываются.
+    """
+    base_path = Path(root) / sensor_name
+    start_ts, stop_ts = start.timestamp(), stop.timestamp()
+    times, values = [], []
+    day = start.date()
+    while day <= stop.date():
+        stem = day_stem(day)
+        tsv_path = base_path / f"{stem}.tsv"
+        if column_paths(base_path, stem)[0].exists():
+            with ColumnarDay(base_path, stem) as columnar_day:
+                day_times, day_values = columnar_day.slice(start_ts, stop_ts)
+                times.append(day_times.copy())
+                values.append(day_values.copy())
+        elif tsv_path.exists():
+            _, _, day_times, day_values = read_tsv(tsv_path)
+            begin, end = np.searchsorted(day_times, (start_ts, stop_ts), side="left")
+            times.append(day_times[begin:end])
+            values.append(day_values[begin:end])
+        day += datetime.timedelta(days=1)
+    if not times:
+        return np.empty(0, ITEM), np.empty(0, ITEM)
+    return np.concatenate(times), np.concatenate(values)
+
+
+def count_range(
+    sensor_name: str,
+    start: datetime.datetime,
+    stop: datetime.datetime,
+    root: str = LOCAL_DB_ROOT,
+) -> int:
+    """Оценка числа записей датчика за интервал `[start, stop)` без разбора данных.
+
+    Для колоночных суток число точное (поиск по mmap), для TSV - число строк
+    файла, умноженное на долю суток внутри интервала.
+    """
+    base_path = Path(root) / sensor_name
+    start_ts, stop_ts = start.timestamp(), stop.timestamp()
+    total = 0
+    day = start.date()
+    while day <= stop.date():
+        stem = day_stem(day)
+        tsv_path = base_path / f"{stem}.tsv"
+        if column_paths(base_path, stem)[0].exists():
+            with ColumnarDay(base_path, stem) as columnar_day:
+                total += len(columnar_day.slice(start_ts, stop_ts)[0])
+        elif tsv_path.exists():
+            day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+            day_stop = datetime.datetime.combine(
+                day + datetime.timedelta(days=1), datetime.time()
+            ).timestamp()
+            overlap = min(stop_ts, day_stop) - max(start_ts, day_start)
+            with open(tsv_path, "rb") as tsv_file:
+                chunks = iter(partial(tsv_file.read, 1 << 20), b"")
+                lines = sum(chunk.count(b"\n") for chunk in chunks)
+            total += int((lines - 1) * max(overlap, 0) / (day_stop - day_start))
+        day += datetime.timedelta(days=1)
+    return total
+
+
+def convert_tsv(tsv_path: Path, out_dir: Path | None = None) -> int:
+    """Конвертирует суточный TSV файл в колоночный формат.
+
+    Существующие колоночные файлы этих суток перезаписываются.
+
+    Returns:
+        количество сконвертированных записей.
+    """
+    tsv_path = Path(tsv_path)
+    out_dir = Path(out_dir) if out_dir is not None else tsv_path.parent
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sensor_name, day, times, values = read_tsv(tsv_path)
+
+    for column, (path, array) in enumerate(
+        zip(column_paths(out_dir, tsv_path.stem), (times, values))
+    ):
+        with open(path, "wb") as column_file:
+            column_file.write(_header(column, sensor_name, day))
+            column_file.write(array.tobytes())
+    return len(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert daily TSV files of the slow control DB to columnar format"
+    )
+    parser.add_argument("files", nargs="+", type=Path, help="TSV files to convert")
+    parser.add_argument(
+        "--out", type=Path, default=None, help="output directory (default: next to TSV)"
+    )
+    args = parser.parse_args()
+
+    for tsv in args.files:
+        print(f"{tsv}: {convert_tsv(tsv, args.out)} records")
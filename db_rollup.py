@@ -0,0 +1,346 @@
+"""Агрегаты (rollup) измерений для долгосрочной истории.
+
+Для каждого уровня агрегации (`DB_ROLLUP_TIERS`, по умолчанию 1 мин,
+15 мин и 1 час) сутки датчика хранятся в файле 'гг-мм-дд.r<сек>.rollup':
+заголовок :data:`db_columnar.HEADER` (в поле колонки - длительность
+интервала в секундах), за которым идут строки :data:`ROW` фиксированной
+ширины - начало интервала (UNIX time), число измерений, минимум, максимум,
+среднее и стандартное отклонение (по всем измерениям интервала, ddof=0).
+Интервалы отсчитываются от начала суток.
+
+Агрегаты обновляются по мере записи измерений (:class:`RollupStorage`
+для :class:`db.DailyTsvWriter`), поэтому стабильность HV за месяц
+читается из нескольких тысяч строк вместо сотен тысяч строк TSV
+(:func:`read_rollup`). Незавершенный интервал перезаписывается на месте
+при каждом сбросе буфера, после перезапуска сервера он продолжается.
+
+Запуск модуля как скрипта пересчитывает агрегаты из TSV файлов
+(при остановленном сервере или для прошедших суток):
+
+`python db_rollup.py data/HV/*.tsv`
+"""
+
+import argparse
+import datetime
+import math
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from config import DB_ROLLUP_TIERS, LOCAL_DB_ROOT
+from db import DayStorage, Record, day_stem
+from db_columnar import HEADER, read_tsv
+
+MAGIC = b"HVRU"
+VERSION = 1
+ROW = np.dtype(
+    [
+        ("time", "<f8"),
+        ("count", "<i8"),
+        ("min", "<f8"),
+        ("max", "<f8"),
+        ("mean", "<f8"),
+        ("std", "<f8"),
+    ]
+)
+
+# незавершенный интервал: [номер интервала в сутках, число, min, max, среднее, M2]
+Bucket = list
+
+
+def rollup_path(base_path: Path, stem: str, tier: int) -> Path:
+    """Путь к файлу агрегатов уровня `tier` (сек) для суток `stem`."""
+    return base_path / f"{stem}.r{tier}.rollup"
+
+
+def _header(tier: int, sensor_name: str, day: datetime.date) -> bytes:
+    day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+    return HEADER.pack(MAGIC, VERSION, tier, sensor_name.encode()[:16], day_start)
+
+
+def _check_tiers(tiers: Iterable[int]) -> tuple[int, ...]:
+    tiers = tuple(int(tier) for tier in tiers)
+    for tier in tiers:
+        # длительность хранится в 16-битном поле заголовка
+        if not 0 < tier <= 0xFFFF:
+            raise ValueError(f"rollup tier must be in 1..65535 sec, got {tier}")
+    return tiers
+
+
+def _row(bucket: Bucket, day_start: float, tier: int) -> bytes:
+    index, count, low, high, mean, m2 = bucket
+    return np.array(
+        [(day_start + index * tier, count, low, high, mean, math.sqrt(m2 / count))],
+        ROW,
+    ).tobytes()
+
+
+class RollupStorage(DayStorage):
+    """Агрегаты для :class:`db.DailyTsvWriter` (см. описание модуля).
+
+    Строка незавершенного интервала пишется на место следующей строки файла
+    при каждом сбросе и при закрытии суток, завершенный интервал фиксирует ее.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        sensor_name: str,
+        tiers: Iterable[int] = DB_ROLLUP_TIERS,
+    ):
+        super().__init__(base_path, sensor_name)
+        self.tiers = _check_tiers(tiers)
+        self.__files = None
+        self.__day_start = 0.0
+        # число завершенных строк в файле каждого уровня
+        self.__rows = [0] * len(self.tiers)
+        self.__buckets: list[Optional[Bucket]] = [None] * len(self.tiers)
+        # незавершенные интервалы на момент метки отката: (сутки, интервалы)
+        self.__restore = None
+
+    def mark(self):
+        return tuple(self.__rows), [
+            list(bucket) if bucket is not None else None for bucket in self.__buckets
+        ]
+
+    def append(self, records: list[Record]):
+        for ts, val in records:
+            offset = ts.timestamp() - self.__day_start
+            for idx, tier in enumerate(self.tiers):
+                index = max(0, int(offset // tier))
+                bucket = self.__buckets[idx]
+                if bucket is not None and index > bucket[0]:
+                    self.__write(idx, bucket)
+                    self.__rows[idx] += 1
+                    bucket = None
+                if bucket is None:
+                    self.__buckets[idx] = [index, 1, val, val, val, 0.0]
+                    continue
+                # алгоритм Уэлфорда; при переводе часов назад - в тот же интервал
+                bucket[1] += 1
+                bucket[2] = min(bucket[2], val)
+                bucket[3] = max(bucket[3], val)
+                delta = val - bucket[4]
+                bucket[4] += delta / bucket[1]
+                bucket[5] += delta * (val - bucket[4])
+
+    def flush(self, fsync: bool):
+        for idx, bucket in enumerate(self.__buckets):
+            if bucket is not None:
+                self.__write(idx, bucket)
+        for rollup_file in self.__files:  # type: ignore
+            rollup_file.flush()
+            if fsync:
+                os.fsync(rollup_file.fileno())
+
+    def __write(self, idx: int, bucket: Bucket):
+        rollup_file = self.__files[idx]  # type: ignore
+        rollup_file.seek(HEADER.size + self.__rows[idx] * ROW.itemsize)
+        rollup_file.write(_row(bucket, self.__day_start, self.tiers[idx]))
+
+    def _open(self, day: datetime.date):
+        stem = day_stem(day)
+        self.__day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+        restore = None
+        if self.__restore is not None and self.__restore[0] == day:
+            restore = self.__restore[1]
+        self.__restore = None
+
+        self.__files = []
+        try:
+            for idx, tier in enumerate(self.tiers):
+                path = rollup_path(self.base_path, stem, tier)
+                rows = self.__recover(path, tier, day)
+                self.__files.append(open(path, "r+b"))
+                if restore is not None:
+                    self.__buckets[idx] = restore[idx]
+                    self.__rows[idx] = rows
+                elif rows:
+                    # последняя строка могла быть незавершенным интервалом,
+                    # продолжаем его и перезапишем строку на месте
+                    self.__rows[idx] = rows - 1
+                    self.__buckets[idx] = self.__load_bucket(idx)
+                else:
+                    self.__buckets[idx] = None
+                    self.__rows[idx] = 0
+        except OSError:
+            for rollup_file in self.__files:
+                rollup_file.close()
+            self.__files = None
+            raise
+
+    def __load_bucket(self, idx: int) -> Bucket:
+        """Интервал из строки файла уровня `idx`, следующей за завершенными."""
+        rollup_file = self.__files[idx]  # type: ignore
+        rollup_file.seek(HEADER.size + self.__rows[idx] * ROW.itemsize)
+        last = np.frombuffer(rollup_file.read(ROW.itemsize), ROW)[0]
+        count = int(last["count"])
+        return [
+            int(round((last["time"] - self.__day_start) / self.tiers[idx])),
+            count,
+            float(last["min"]),
+            float(last["max"]),
+            float(last["mean"]),
+            float(last["std"]) ** 2 * count,
+        ]
+
+    def _close(self, fsync: bool, discard: bool = False):
+        if self.__files is None:
+            return
+        try:
+            # после ошибки интервалы неудачной группы не пишутся,
+            # их состояние до группы восстанавливает _truncate
+            if not discard:
+                self.flush(fsync)
+        finally:
+            for rollup_file in self.__files:
+                rollup_file.close()
+            self.__files = None
+
+    def _truncate(self, day: datetime.date, mark):
+        rows, buckets = mark
+        for tier, count in zip(self.tiers, rows):
+            path = rollup_path(self.base_path, day_stem(day), tier)
+            with open(path, "r+b") as rollup_file:
+                rollup_file.truncate(HEADER.size + count * ROW.itemsize)
+        self.__restore = (day, buckets)
+
+    def __recover(self, path: Path, tier: int, day: datetime.date) -> int:
+        """Пишет заголовок нового файла и отрезает недописанную строку."""
+        size = path.stat().st_size if path.exists() else 0
+        if size < HEADER.size:
+            with open(path, "wb") as rollup_file:
+                rollup_file.write(_header(tier, self.sensor_name, day))
+            return 0
+        rows = (size - HEADER.size) // ROW.itemsize
+        if size != HEADER.size + rows * ROW.itemsize:
+            with open(path, "r+b") as rollup_file:
+                rollup_file.truncate(HEADER.size + rows * ROW.itemsize)
+        return rows
+
+
+def rollup(
+    times: np.ndarray, values: np.ndarray, day_start: float, tier: int
+) -> np.ndarray:
+    """Строки :data:`ROW` уровня `tier` для отсортированных по времени измерений."""
+    if not len(times):
+        return np.empty(0, ROW)
+    index = np.maximum(0, np.floor_divide(times - day_start, tier)).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    counts = np.diff(np.append(starts, len(times)))
+    means = np.add.reduceat(values, starts) / counts
+    deviations = values - np.repeat(means, counts)
+    rows = np.empty(len(starts), ROW)
+    rows["time"] = day_start + index[starts] * tier
+    rows["count"] = counts
+    rows["min"] = np.minimum.reduceat(values, starts)
+    rows["max"] = np.maximum.reduceat(values, starts)
+    rows["mean"] = means
+    rows["std"] = np.sqrt(np.add.reduceat(deviations**2, starts) / counts)
+    return rows
+
+
+def rebuild_tsv(
+    tsv_path: Path,
+    out_dir: Optional[Path] = None,
+    tiers: Iterable[int] = DB_ROLLUP_TIERS,
+) -> dict[int, int]:
+    """Пересчитывает агрегаты суточного TSV файла (файлы заменяются атомарно).
+
+    Returns:
+        число строк каждого уровня.
+    """
+    tsv_path = Path(tsv_path)
+    out_dir = Path(out_dir) if out_dir is not None else tsv_path.parent
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sensor_name, day, times, values = read_tsv(tsv_path)
+    day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+
+    result = {}
+    for tier in _check_tiers(tiers):
+        rows = rollup(times, values, day_start, tier)
+        path = rollup_path(out_dir, tsv_path.stem, tier)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as rollup_file:
+            rollup_file.write(_header(tier, sensor_name, day))
+            rollup_file.write(rows.tobytes())
+        os.replace(tmp_path, path)
+        result[tier] = len(rows)
+    return result
+
+
+def read_rollup(
+    sensor_name: str,
+    tier: int,
+    start: datetime.datetime,
+    stop: datetime.datetime,
+    root: str = LOCAL_DB_ROOT,
+) -> dict[str, np.ndarray]:
+    """Строки уровня `tier` с началом интервала в `[start, stop)`.
+
+    Returns:
+        колонки `time`, `count`, `min`, `max`, `mean`, `std`.
+    """
+    base_path = Path(root) / sensor_name
+    start_ts, stop_ts = start.timestamp(), stop.timestamp()
+    chunks = []
+    day = start.date()
+    while day <= stop.date():
+        path = rollup_path(base_path, day_stem(day), tier)
+        if path.exists():
+            count = (path.stat().st_size - HEADER.size) // ROW.itemsize
+            if count > 0:
+                rows = np.fromfile(path, ROW, count=count, offset=HEADER.size)
+                begin, end = np.searchsorted(rows["time"], (start_ts, stop_ts))
+                chunks.append(rows[begin:end])
+        day += datetime.timedelta(days=1)
+    rows = np.concatenate(chunks) if chunks else np.empty(0, ROW)
+    return {name: rows[name] for name in ROW.names}
+
+
+def count_rollup(
+    sensor_name: str,
+    tier: int,
+    start: datetime.datetime,
+    stop: datetime.datetime,
+    root: str = LOCAL_DB_ROOT,
+) -> int:
+    """Число строк :func:`read_rollup` без чтения файлов (поиск по mmap)."""
+    base_path = Path(root) / sensor_name
+    start_ts, stop_ts = start.timestamp(), stop.timestamp()
+    total = 0
+    day = start.date()
+    while day <= stop.date():
+        path = rollup_path(base_path, day_stem(day), tier)
+        if path.exists():
+            count = (path.stat().st_size - HEADER.size) // ROW.itemsize
+            if count > 0:
+                rows = np.memmap(path, ROW, "r", offset=HEADER.size, shape=(count,))
+                begin, end = np.searchsorted(rows["time"], (start_ts, stop_ts))
+                total += int(end - begin)
+        day += datetime.timedelta(days=1)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild rollup tiers of the slow control DB from daily TSV files"
+    )
+    parser.add_argument("files", nargs="+", type=Path, help="TSV files to process")
+    parser.add_argument(
+        "--out", type=Path, default=None, help="output directory (default: next to TSV)"
+    )
+    parser.add_argument(
+        "--tiers",
+        type=int,
+        nargs="+",
+        default=DB_ROLLUP_TIERS,
+        help="bucket durations, sec (default: DB_ROLLUP_TIERS)",
+    )
+    args = parser.parse_args()
+
+    for tsv in args.files:
+        counts = rebuild_tsv(tsv, args.out, args.tiers)
+        print(f"{tsv}: " + ", ".join(f"{t}s: {n} rows" for t, n in counts.items()))
@@ -0,0 +1,238 @@
+"""Синхронизация локальной БД медленного контроля с удаленным хранилищем."""
+
+import asyncio
+import datetime
+import json
+import os
+import shlex
+import signal
+import tempfile
+import time
+from logging import getLogger
+from pathlib import Path
+
+from config import (
+    DB_SYNC_MANIFEST,
+    DB_SYNC_RETRY_DELAY,
+    DB_SYNC_TIMEOUT,
+    LOCAL_DB_ROOT,
+    LOGGER_NAME,
+)
+
+_logger = getLogger(LOGGER_NAME)
+
+FILES_FROM = "{files_from}"
+# синтаксис оболочки, недоступный команде с {files_from} (она запускается без shell)
+SHELL_TOKENS = ("|", "&", ";", "<", ">", "$", "`", "(", ")")
+
+
+class DbSyncEngine:
+    """
+    Запуск команды синхронизации (rclone) без блокировки цикла событий.
+
+    Команда запускается как asyncio subprocess с таймаутом; при отмене
+    или таймауте процесс убивается. Движок хранит манифест (размер и mtime
+    файлов после последней успешной синхронизации) и запускает команду
+    только если в `LOCAL_DB_ROOT` есть изменившиеся файлы.
+
+    Если команда содержит `{files_from}`, вместо него подставляется путь
+    к списку изменившихся файлов (для `rclone copy --files-from`), и команда
+    запускается без оболочки: конвейеры, `&&`, перенаправления и переменные
+    окружения в ней недоступны (такая команда отклоняется при создании
+    движка), шаблоны файлов не раскрываются. Команда без `{files_from}`
+    запускается через оболочку, как раньше `os.system`; при таймауте
+    убивается вся ее группа процессов.
+
+    После каждого запуска доступны `last_duration` (сек),
+    `last_changed_bytes` (суммарный размер изменившихся файлов целиком,
+    rclone может передать меньше) и `last_status`.
+
+    Raises:
+        ValueError: команда с `{files_from}` использует синтаксис оболочки.
+    """
+
+    def __init__(
+        self,
+        cmd: str,
+        root: str = LOCAL_DB_ROOT,
+        timeout: float = DB_SYNC_TIMEOUT,
+        manifest_path: str = DB_SYNC_MANIFEST,
+    ):
+        self.__shell = FILES_FROM not in cmd
+        if not self.__shell:
+            # без posix кавычки остаются в токенах, аргументы в кавычках пропускаются
+            tokens = shlex.shlex(cmd, posix=False, punctuation_chars=True)
+            tokens.whitespace_split = True
+            shell_tokens = [
+                token
+                for token in tokens
+                if token[0] not in "'\"" and any(c in token for c in SHELL_TOKENS)
+            ]
+            if shell_tokens:
+                raise ValueError(
+                    f"sync command with {FILES_FROM} runs without a shell, "
+                    f"{shell_tokens} can't be used; wrap the command into a script"
+                )
+        self.__cmd = cmd
+        self.__root = Path(root)
+        self.__timeout = timeout
+        self.__manifest_path = Path(manifest_path)
+        self.__manifest: dict[str, list[int]] = self.__load_manifest()
+        self.__lock = asyncio.Lock()
+
+        self.last_sync: datetime.datetime | None = None
+        self.last_duration: float = 0.0
+        self.last_changed_bytes: int = 0
+        self.last_status: str = "never"
+
+    async def sync(self) -> bool:
+        """Отправляет изменившиеся файлы.
+
+        Returns:
+            True, если синхронизация прошла успешно или была не нужна.
+        """
+        async with self.__lock:
+            snapshot = await asyncio.to_thread(self.__scan)
+            changed = [
+                path
+                for path, stat in snapshot.items()
+                if self.__manifest.get(path) != stat
+            ]
+            if not changed:
+                _logger.debug("database is up to date, skip syncing")
+                self.last_status = "up-to-date"
+                return True
+
+            files_from = None
+            cmd = self.__cmd
+            if FILES_FROM in cmd:
+                with tempfile.NamedTemporaryFile(
+                    "w", suffix=".txt", delete=False
+                ) as list_file:
+                    list_file.write("\n".join(changed) + "\n")
+                    files_from = list_file.name
+                cmd = cmd.replace(FILES_FROM, files_from)
+
+            _logger.info("start database syncing (%d files): %s", len(changed), cmd)
+            start = time.monotonic()
+            try:
+                returncode = await self.__run(cmd)
+            finally:
+                if files_from:
+                    os.unlink(files_from)
+            self.last_duration = time.monotonic() - start
+
+            if returncode is None:
+                self.last_status = "timeout"
+                _logger.error("database syncing timed out after %.0f s", self.__timeout)
+                return False
+            if returncode != 0:
+                self.last_status = f"failed ({returncode})"
+                _logger.error(
+                    "database syncing failed with code %d in %.1f s",
+                    returncode,
+                    self.last_duration,
+                )
+                return False
+
+            self.last_changed_bytes = sum(snapshot[path][0] for path in changed)
+            self.last_sync = datetime.datetime.now()
+            self.last_status = "ok"
+            self.__manifest.update((path, snapshot[path]) for path in changed)
+            await asyncio.to_thread(self.__save_manifest)
+            _logger.info(
+                "database synced: %d files, %d bytes in %.1f s",
+                len(changed),
+                self.last_changed_bytes,
+                self.last_duration,
+            )
+            return True
+
+    async def run(self, interval: float):
+        """Периодическая синхронизация с экспоненциальной задержкой при ошибках."""
+        failures = 0
+        while True:
+            try:
+                ok = await self.sync()
+            except asyncio.CancelledError as exc:
+                raise exc
+            # pylint: disable-next=broad-except
+            except Exception as exc:
+                _logger.exception(exc)
+                ok = False
+
+            if ok:
+                failures = 0
+                await asyncio.sleep(interval)
+            else:
+                delay = min(interval, DB_SYNC_RETRY_DELAY * 2**failures)
+                failures += 1
+                _logger.info("retry database syncing in %.0f s", delay)
+                await asyncio.sleep(delay)
+
+    async def __run(self, cmd: str) -> int | None:
+        """Запускает команду, возвращает код завершения (None при таймауте)."""
+        if self.__shell:
+            # отдельная группа процессов: при таймауте убиваются и shell,
+            # и его дочерние процессы, державшие бы открытым вывод
+            proc = await asyncio.create_subprocess_shell(
+                cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=os.name != "nt",
+            )
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                *shlex.split(cmd, posix=os.name != "nt"),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        try:
+            output, _ = await asyncio.wait_for(proc.communicate(), self.__timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            self.__kill(proc)
+            await proc.wait()
+            if isinstance(exc, asyncio.TimeoutError):
+                return None
+            raise exc
+        if output:
+            _logger.debug("sync output:\n%s", output.decode(errors="replace"))
+        return proc.returncode
+
+    def __kill(self, proc: asyncio.subprocess.Process):
+        try:
+            if self.__shell and os.name != "nt":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            pass
+
+    def __scan(self) -> dict[str, list[int]]:
+        snapshot = {}
+        for dirpath, _, filenames in os.walk(self.__root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                rel_path = Path(path).relative_to(self.__root).as_posix()
+                snapshot[rel_path] = [stat.st_size, stat.st_mtime_ns]
+        return snapshot
+
+    def __load_manifest(self) -> dict[str, list[int]]:
+        try:
+            with open(self.__manifest_path, "r") as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as exc:
+            _logger.error("broken sync manifest %s: %s", self.__manifest_path, exc)
+            return {}
+
+    def __save_manifest(self):
+        tmp_path = self.__manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(self.__manifest, manifest_file)
+        os.replace(tmp_path, self.__manifest_path)
@@ -1,58 +1,139 @@
 """Модуль для работы с аппаратной частью стойки HV."""
 
 import asyncio
-import json
 import sys
+import time
 from logging import getLogger
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 
 import jsonschema
 
 from config import (
-    AGILENT_34401A_GPIB_ADDR as AGILENT_ADDR,
-)
-from config import (
-    DIVIDER_FACTOR,
+    CORRECTION_GAIN,
     LOGGER_NAME,
-    VIRTUAL_CHANGE_SPEED,
+    RING_BUFFER_ANSWERS,
+    RING_BUFFER_HOURS,
+    RING_BUFFER_MIN_INTERVAL,
+    SCALING_ONLINE,
+    SCALING_STATE_PATH,
     VIRTUAL_MODE,
-)
-from config import (
-    FLUKE_5502E_GPIB_ADDR as FLUKE_ADDR,
+    VIRTUAL_SCALING_ERROR,
+    VISA_LIBRARY,
 )
 from db import DailyTsvWriter
+from utils.blocks import BlockConfig, load_blocks
+from utils.clock import Clock, default_clock
+from utils.commands import (
+    Abort,
+    Command,
+    CommandParser,
+    RunScan,
+    ScanPoint,
+    SetVoltage,
+    SetVoltageAndCheck,
+)
+from utils.hub import Hub
+from utils.instruments import Agilent34401A, Fluke5502E
 from utils.manager import HardwareManager
+from utils.measurements import MeasurementStream, Predicate, tolerance
+from utils.metrics import COMMAND_DURATION, GPIB_LATENCY, SETTLE_TIME
+from utils.recalibration import ScalingEstimator
+from utils.ringbuffer import History
+from utils.scale import OUTPUT_MAX, OUTPUT_MIN, clamp_output
 from utils.scale import rescale_voltage as scale
+from utils.scheduler import CommandScheduler, QueueFullError
+from utils.settling import SettlingDetector, Stable, settle_error
+from utils.simulator import HvSimulator
 
-if VIRTUAL_MODE:
-    from random import random
-else:
+if not VIRTUAL_MODE:
     import pyvisa as visa
 
 _logger = getLogger(LOGGER_NAME)
 
 
 class HVManager(HardwareManager):
-    """Менеджер для управления стойкой HV."""
-
-    def __init__(self, db_writer: Optional[DailyTsvWriter] = None):
-        """Инициализация менеджера."""
-        super().__init__()
+    """Менеджер для управления одним блоком стойки HV."""
+
+    def __init__(
+        self,
+        db_writer: Optional[DailyTsvWriter] = None,
+        clock: Optional[Clock] = None,
+        block: Optional[BlockConfig] = None,
+        output: Optional[Hub] = None,
+    ):
+        """Инициализация менеджера.
+
+        Args:
+            db_writer: запись измерений в БД.
+            clock: часы для всех пауз и таймаутов менеджера
+                (по умолчанию :func:`utils.clock.default_clock`).
+            block: приборы блока (по умолчанию первый из :func:`utils.blocks.load_blocks`).
+            output: общий хаб для ответов нескольких блоков
+                (см. :class:`utils.blocks.BlockRegistry`).
+        """
+        super().__init__(output)
 
+        self.block = block if block is not None else load_blocks()[0]
+        self.__label = str(self.block.name)  # метка блока в метриках
         self.__db_writer = db_writer
-        self.__schema = json.load(open("./commands.schema.json"))
+        self.__clock = clock if clock is not None else default_clock()
+        self.__parser = CommandParser()
+        self.__handlers: dict[str, Callable[[Command], Awaitable]] = {}
+        if self.block.fluke is not None:
+            # блок без источника - только измерение напряжения
+            self.register_handler(SetVoltage.command_type, self.__set_voltage_cmd)
+            self.register_handler(
+                SetVoltageAndCheck.command_type, self.__set_voltage_and_check_cmd
+            )
+            self.register_handler(RunScan.command_type, self.__run_scan_cmd)
+
+        # подстройка коэффициентов перевода по установившимся точкам
+        self.scaling: Optional[ScalingEstimator] = None
+        if SCALING_ONLINE and self.block.fluke is not None:
+            self.scaling = ScalingEstimator(
+                *self.block.scaling,
+                state_path=SCALING_STATE_PATH.format(block=self.block.name),
+            )
+        # выход калибратора для последней уставки, В
+        self.__output_setpoint = 0.0
 
         if VIRTUAL_MODE:
-            self.__V_set = 0.0
-            self.__calc_next_coro = None
+            self.__simulator = HvSimulator(self.__clock)
         else:
-            self.__visa_mgr = visa.ResourceManager()
-            self.__agilent = None
-            self.__fluke = None
+            self.__visa_mgr = visa.ResourceManager(VISA_LIBRARY)
+            self.__agilent = Agilent34401A(
+                self.__visa_mgr,
+                self.block.agilent,
+                name=f"Agilent 34401A [{self.block.name}]",
+            )
+            self.__fluke = (
+                Fluke5502E(
+                    self.__visa_mgr,
+                    self.block.fluke,
+                    name=f"Fluke 5502E [{self.block.name}]",
+                )
+                if self.block.fluke is not None
+                else None
+            )
 
         self.V_last = 0.0
-
-        self.__cmd_coro = None
+        # новые измерения вольтметра для всех ожидающих (команды, проверки)
+        self.measurements = MeasurementStream(self.__clock)
+        # последние измерения и ответы для новых клиентов (сообщение snapshot)
+        self.history = History(
+            str(self.block.name),
+            self.block.sensor,
+            RING_BUFFER_HOURS,
+            RING_BUFFER_MIN_INTERVAL,
+            RING_BUFFER_ANSWERS,
+        )
+
+        self.__scheduler = CommandScheduler(
+            self.__process_single_command,
+            self.__on_command_cancel,
+            self.__on_command_error,
+        )
+        self.__scheduler_coro = None
 
         self.__handle_input_coro = None
         self.__monitor_coro = None
@@ -63,28 +144,14 @@ class HVManager(HardwareManager):
         else:
             _logger.debug("Initialize Agilent 34401A")
             try:
-                self.__agilent = self.__visa_mgr.open_resource(AGILENT_ADDR)
+                await self.__agilent.open()
             except visa.Error:
-                _logger.error("Couldn't connect to '%s', exiting now...", AGILENT_ADDR)
+                _logger.error(
+                    "Couldn't connect to '%s', exiting now...", self.block.agilent
+                )
                 sys.exit()  # TODO: change to adequate exit
 
-            _logger.debug("*RST")
-            self.__agilent.write("*RST")  # type: ignore
-            await asyncio.sleep(1.0)
-            _logger.debug("CONF:VOLT:DC 10,0.00001")
-            self.__agilent.write(  # type: ignore
-                "CONF:VOLT:DC 10,0.00001"
-            )
-            await asyncio.sleep(1)
-            _logger.debug("DET:BAND 3")
-            self.__agilent.write("DET:BAND 3")  # type: ignore
-            await asyncio.sleep(1)
-            _logger.debug("INP:IMP:AUTO ON")
-            self.__agilent.write("INP:IMP:AUTO ON")  # type: ignore
-            await asyncio.sleep(1)
-            _logger.debug("VOLT:NPLC 100")
-            self.__agilent.write("VOLT:NPLC 100")  # type: ignore
-            await asyncio.sleep(1)
+            await self.__agilent.configure()
 
             _logger.debug("Agilent 34401A initialization done")
 
@@ -92,132 +159,375 @@ class HVManager(HardwareManager):
         if VIRTUAL_MODE:
             _logger.debug("Virtual voltmeter stopped")
         else:
-            self.__agilent.read()  # type: ignore
+            await self.__agilent.close()
             _logger.debug("Agilent 34401A stopped")
 
     async def __init_fluke_5200e(self):
-        if VIRTUAL_MODE:
-            _logger.debug("Initialize PS Calibrator in virtual mode")
-
-            async def calc_next_voltage():
-                while True:
-                    await asyncio.sleep(1)
-                    sign = 1 if self.__V_set > self.V_last else -1
-                    delta = abs(self.V_last - self.__V_set)
-                    self.V_last += sign * min(VIRTUAL_CHANGE_SPEED, delta) + (
-                        random() - 0.5
-                    )
-
-            self.__calc_next_coro = asyncio.create_task(calc_next_voltage())
+        if self.block.fluke is None:
+            _logger.debug("Block %s has no PS Calibrator", self.block.name)
+        elif VIRTUAL_MODE:
+            _logger.debug(
+                "Initialize PS Calibrator in virtual mode (clock speed x%g)",
+                self.__clock.speed,
+            )
         else:
             _logger.debug("Initialize Fluke 5502E")
             try:
-                self.__fluke = self.__visa_mgr.open_resource(FLUKE_ADDR)
+                await self.__fluke.open()  # type: ignore
             except visa.Error:
-                _logger.error("Couldn't connect to '%s', exiting now...", FLUKE_ADDR)
+                _logger.error(
+                    "Couldn't connect to '%s', exiting now...", self.block.fluke
+                )
                 sys.exit()  # TODO: change to adequate exit
 
-            _logger.debug("OPER")
-            self.__fluke.write("OPER")  # type: ignore
-            await asyncio.sleep(2)
+            await self.__fluke.configure()  # type: ignore
 
             _logger.debug("Fluke 5502E initialization done")
 
     async def __stop_fluke_5200e(self):
+        if self.block.fluke is None:
+            return
         if VIRTUAL_MODE:
-            if self.__calc_next_coro:
-                self.__calc_next_coro.cancel()
-                self.__calc_next_coro = None
             _logger.debug("Virtual PS Calibrator stopped")
         else:
             # TODO: добавить вычитку(чтобы вольтметр не пищал при перезапуске)
+            await self.__fluke.close()  # type: ignore
             _logger.debug("Fluke 5502E stopped")
 
+    @property
+    def __coefficients(self) -> tuple[float, float]:
+        """Текущие коэффициенты перевода (A, B)."""
+        if self.scaling is not None:
+            return self.scaling.coefficients
+        return self.block.scaling
+
     async def __set_voltage(self, voltage: float):
+        await self.__set_output(scale(voltage, *self.__coefficients))
+
+    async def __set_output(self, output: float):
+        """Выставляет выход калибратора, В."""
+        self.__output_setpoint = output
+        start = time.perf_counter()
         if VIRTUAL_MODE:
-            self.__V_set = voltage
-            await asyncio.sleep(2)
+            # стойка с коэффициентами из config (с ошибкой VIRTUAL_SCALING_ERROR),
+            # при нулевом входе FuG напряжения нет
+            a, b = self.block.scaling
+            voltage = a * (1 + VIRTUAL_SCALING_ERROR) * output + b
+            self.__simulator.set_voltage(voltage if output > OUTPUT_MIN else 0.0)
         else:
-            self.__fluke.write(f"OUT {scale(voltage)} V")  # type: ignore
-            await asyncio.sleep(2)
+            await self.__fluke.set_output(output)  # type: ignore
+        GPIB_LATENCY.observe(time.perf_counter() - start, self.__label, "set_voltage")
+        await self.__clock.sleep(2)
 
     async def __get_voltage(self) -> float:
+        start = time.perf_counter()
         if VIRTUAL_MODE:
-            await asyncio.sleep(4)
-            return self.V_last
+            voltage = await self.__simulator.read()
+        else:
+            voltage = await self.__agilent.measure() * self.block.divider
+        GPIB_LATENCY.observe(time.perf_counter() - start, self.__label, "get_voltage")
+        return voltage
+
+    def register_handler(
+        self, command_type: str, handler: Callable[[Command], Awaitable]
+    ):
+        """Регистрирует обработчик команды.
+
+        Args:
+            command_type: тип команды (см. :func:`utils.commands.register_command`).
+            handler: корутина, выполняющая команду и публикующая ответ.
+        """
+        self.__handlers[command_type] = handler
+
+    def __answer(self, command: Command, **fields):
+        """Публикует ответ на команду (с `request_id`, если он был задан)."""
+        answer = dict(
+            type="answer",
+            answer_type=command.command_type,
+            block=str(self.block.name),
+        )
+        answer.update(fields)
+        if command.request_id is not None:
+            answer["request_id"] = command.request_id
+        self.history.add_answer(answer)
+        self.output.publish(dict(meta=answer, data=b""))
+
+    def __error(self, code: int, text_code: str, description: str, meta=None):
+        """Публикует сообщение об ошибке (с `request_id` команды `meta`, если он был задан)."""
+        reply = dict(
+            type="reply",
+            reply_type="error",
+            error_code=code,
+            error_text_code=text_code,
+            description=description,
+        )
+        if isinstance(meta, Command):
+            meta = meta.meta
+        if isinstance(meta, dict) and "request_id" in meta:
+            reply["request_id"] = meta["request_id"]
+        self.output.publish(dict(meta=reply, data=b""))
+
+    def __on_command_cancel(self, command: Command, status: str):
+        _logger.debug("command %s %s", command, status)
+        self.__answer(command, status=status)
+
+    def __on_command_error(self, command: Command, exc: Exception):
+        if isinstance(exc, jsonschema.ValidationError):
+            self.__error(9, "INCORRECT_MESSAGE_PARAMS", exc.message, command)
+            return
+        self.__error(5, "ALGORITM_ERROR", repr(exc), command)
+        _logger.exception(exc)
+
+    async def __set_voltage_cmd(self, command: SetVoltage):
+        _logger.debug("setting %s", command.voltage)
+        await self.__set_voltage(command.voltage)
+        self.__answer(command, status="ok")
+
+    async def __set_voltage_and_wait(
+        self, point: SetVoltageAndCheck | ScanPoint
+    ) -> tuple[str, SettlingDetector]:
+        """Выставляет напряжение и ждет его установления.
+
+        Установление проверяется по новым измерениям: по критерию "reading" -
+        допуск из :func:`utils.measurements.tolerance`, по "statistical" -
+        :class:`utils.settling.SettlingDetector` (он же всегда оценивает шум
+        и время установления для ответа). Для "statistical" допуск уровня -
+        меньший из `max_error` и `max_rel_error` от напряжения, а детектор
+        должен подтвердить установление `consecutive` измерений подряд.
+
+        Returns:
+            "ok" или "timeout" и детектор установления.
+        """
+        _logger.debug("setting %s", point.voltage)
+        detector = SettlingDetector(
+            point.voltage,
+            settle_error(point.voltage, point.max_error, point.max_rel_error),
+            start=self.__clock.time(),
+        )
+        in_tolerance: Predicate
+        if point.criterion == "statistical":
+            in_tolerance = Stable(detector, point.consecutive)
         else:
-            self.__agilent.write("READ?")  # type: ignore
-            await asyncio.sleep(4)
-            voltage = float(self.__agilent.read())  # type: ignore
-            return voltage * DIVIDER_FACTOR
+            in_tolerance = tolerance(
+                point.voltage, point.max_error, point.max_rel_error, point.consecutive
+            )
 
-    async def __wait_voltage(self, voltage, max_error):
-        while True:
-            if abs(self.V_last - voltage) <= max_error:
-                return
-            await asyncio.sleep(1)
-
-    async def __process_single_command(self, meta: dict):
-        if meta["command_type"] == "set_voltage":
-            voltage = float(meta["voltage"])
-            _logger.debug("setting %s", voltage)
-            await self.__set_voltage(voltage)
-            self.output.publish(
-                dict(
-                    meta=dict(
-                        type="answer", answer_type="set_voltage", block="1", status="ok"
-                    ),
-                    data=b"",
-                )
+        def settled(value: float) -> bool:
+            detector.add(value, self.__clock.time())
+            return in_tolerance(value)
+
+        await self.__set_voltage(point.voltage)
+        try:
+            await self.measurements.wait_for(settled, point.timeout)
+            SETTLE_TIME.observe(
+                self.__clock.time() - detector.start, self.__label, point.criterion
             )
-        elif meta["command_type"] == "set_voltage_and_check":
-            voltage = float(meta["voltage"])
-            max_error = float(meta["max_error"])
-            timeout_ = float(meta["timeout"])
-            _logger.debug("setting %s", voltage)
-            await self.__set_voltage(voltage)
+            await self.__recalibrate(detector)
+            return "ok", detector
+        except asyncio.exceptions.TimeoutError:
+            return "timeout", detector
+
+    async def __recalibrate(self, detector: SettlingDetector):
+        """Добавляет установившуюся точку в оценку коэффициентов перевода.
+
+        Учитываются только точки, где напряжение установилось по
+        статистическому критерию (`stable` в
+        :class:`utils.settling.SettlingDetector`: переходный процесс
+        закончился и уровень в допуске), с выходом калибратора внутри
+        диапазона (без ограничения в :func:`utils.scale.rescale_voltage`).
+        """
+        output = self.__output_setpoint
+        if self.scaling is None or not detector.stable:
+            return
+        if not OUTPUT_MIN < output < OUTPUT_MAX:
+            return
+        noise = (detector.noise or 0.0) / detector.min_samples**0.5
+        if self.scaling.update(output, detector.level, noise):  # type: ignore
+            _logger.debug("scaling updated: %s", self.scaling.state())
+        # запись файла состояния не должна блокировать цикл событий
+        await asyncio.to_thread(self.scaling.save, self.scaling.snapshot())
+
+    def __settling_fields(self, detector: SettlingDetector) -> dict:
+        fields = dict(
+            noise=detector.noise,
+            settle_time=detector.settle_time,
+            predicted_settle_time=detector.predicted_settle_time,
+        )
+        if self.scaling is not None:
+            fields["scaling"] = self.scaling.state()
+        return fields
+
+    async def __set_voltage_closed_loop(
+        self, command: SetVoltageAndCheck
+    ) -> tuple[str, SettlingDetector, list[dict]]:
+        """Выставляет напряжение с коррекцией выхода калибратора.
+
+        После открытого выставления (как в :meth:`__set_voltage_and_wait`)
+        ждет, пока напряжение войдет в допуск или перестанет меняться
+        (`steady`). Во втором случае выход калибратора исправляется на
+        `CORRECTION_GAIN` измеренной ошибки (пересчитанной через текущий
+        коэффициент A) с ограничением диапазоном калибратора. Коррекций
+        не больше `max_corrections`, дальше (или если выход уперся
+        в границу) команда просто ждет допуска до общего `timeout`.
+
+        Returns:
+            "ok" или "timeout", детектор последней итерации и список
+            коррекций (выход калибратора до коррекции, уровень и ошибка).
+        """
+        start = self.__clock.time()
+        deadline = start + command.timeout
+        max_error = settle_error(
+            command.voltage, command.max_error, command.max_rel_error
+        )
+        reading_tolerance = tolerance(
+            command.voltage,
+            command.max_error,
+            command.max_rel_error,
+            command.consecutive,
+        )
+        corrections: list[dict] = []
+        correcting = command.max_corrections > 0
+
+        await self.__set_voltage(command.voltage)
+        while True:
+            detector = SettlingDetector(command.voltage, max_error, start=start)
+            statistical = command.criterion == "statistical"
+            in_tolerance: Predicate = reading_tolerance
+            if statistical:
+                in_tolerance = Stable(detector, command.consecutive)
+            settled = False
+
+            def done(value: float) -> bool:
+                nonlocal settled
+                detector.add(value, self.__clock.time())
+                settled = in_tolerance(value)
+                # уровень в допуске: коррекция не нужна, ждем `consecutive`
+                if statistical and detector.stable:
+                    return settled
+                return settled or (correcting and detector.steady)
+
             try:
-                await asyncio.wait_for(
-                    self.__wait_voltage(voltage, max_error), timeout=timeout_
-                )
-                self.output.publish(
-                    dict(
-                        meta=dict(
-                            type="answer",
-                            answer_type="set_voltage_and_check",
-                            block="1",
-                            status="ok",
-                            voltage=self.V_last,
-                            error=self.V_last - voltage,
-                        ),
-                        data=b"",
-                    )
+                await self.measurements.wait_for(
+                    done, max(0.0, deadline - self.__clock.time())
                 )
             except asyncio.exceptions.TimeoutError:
-                self.output.publish(
-                    dict(
-                        meta=dict(
-                            type="answer",
-                            answer_type="set_voltage_and_check",
-                            block="1",
-                            status="timeout",
-                            voltage=self.V_last,
-                            error=self.V_last - voltage,
-                        ),
-                        data=b"",
-                    )
+                return "timeout", detector, corrections
+
+            await self.__recalibrate(detector)
+            if settled:
+                SETTLE_TIME.observe(
+                    self.__clock.time() - start, self.__label, "closed_loop"
+                )
+                return "ok", detector, corrections
+
+            level = detector.level
+            error = level - command.voltage  # type: ignore
+            step = CORRECTION_GAIN * error / self.__coefficients[0]
+            output = clamp_output(self.__output_setpoint - step)
+            corrections.append(
+                dict(
+                    output=self.__output_setpoint,
+                    voltage=level,
+                    error=error,
+                    time=self.__clock.time() - start,
                 )
+            )
+            _logger.debug(
+                "correction %d: error %.3f V, output %.6f -> %.6f V",
+                len(corrections),
+                error,
+                self.__output_setpoint,
+                output,
+            )
+            if output == self.__output_setpoint:
+                # выход уперся в границу диапазона калибратора
+                correcting = False
+                continue
+            correcting = len(corrections) < command.max_corrections
+            await self.__set_output(output)
+
+    async def __set_voltage_and_check_cmd(self, command: SetVoltageAndCheck):
+        fields = {}
+        if command.closed_loop:
+            status, detector, corrections = await self.__set_voltage_closed_loop(
+                command
+            )
+            fields["corrections"] = corrections
         else:
-            _logger.debug(meta)
+            status, detector = await self.__set_voltage_and_wait(command)
+        self.__answer(
+            command,
+            status=status,
+            voltage=self.V_last,
+            error=self.V_last - command.voltage,
+            **self.__settling_fields(detector),
+            **fields,
+        )
+
+    async def __run_scan_cmd(self, command: RunScan):
+        """Проходит точки скана, публикуя результат каждой точки.
+
+        К следующей точке сервер переходит сразу после выставления
+        напряжения и выдержки `dwell` (выдержка пропускается, если точка
+        не выставилась за `timeout`).
+        """
+        total = len(command.points)
+        timeouts = 0
+        done = 0
+        for index, point in enumerate(command.points):
+            start = self.__clock.time()
+            status, detector = await self.__set_voltage_and_wait(point)
+            if status == "ok" and point.dwell > 0:
+                await self.__clock.sleep(point.dwell)
+            done += 1
+            self.__answer(
+                command,
+                status="point",
+                index=index,
+                points=total,
+                point_status=status,
+                setpoint=point.voltage,
+                voltage=self.V_last,
+                error=self.V_last - point.voltage,
+                duration=self.__clock.time() - start,
+                **self.__settling_fields(detector),
+            )
+            if status == "timeout":
+                timeouts += 1
+                if command.stop_on_timeout:
+                    break
+        self.__answer(
+            command,
+            status="timeout" if timeouts and command.stop_on_timeout else "ok",
+            points=done,
+            timeouts=timeouts,
+        )
+
+    async def __process_single_command(self, command: Command):
+        handler = self.__handlers.get(command.command_type)
+        if handler is None:
+            raise jsonschema.ValidationError(
+                f"command '{command.command_type}' is not supported"
+                f" by block '{self.block.name}'"
+            )
+        start = time.perf_counter()
+        try:
+            await handler(command)
+        finally:
+            COMMAND_DURATION.observe(
+                time.perf_counter() - start, self.__label, command.command_type
+            )
 
     async def __handle_input(self):
         """Обработка сообщений из входящего потока.
 
         В этом методе происходит базовая обработка.
-        - SERVER_BUSY_ERROR (приход новой команды во время обработки)
+        - SERVER_BUSY_ERROR (очередь команд переполнена)
         - INCORRECT_MESSAGE_PARAMS (некорректная команда)
-        - ALGORITM_ERROR (Exception при выполнении команды)
-        Обработка команд производится в методе :meth:`__process_single_command`
+        - команда `abort` (отмена выполняемой команды и очистка очереди)
+        Корректные команды превращаются в объекты :class:`utils.commands.Command`
+        и ставятся в очередь :class:`utils.scheduler.CommandScheduler`,
+        выполняются они обработчиками из :meth:`register_handler`
         """
         while True:
             try:
@@ -225,58 +535,34 @@ class HVManager(HardwareManager):
                 _logger.debug(message)
                 meta = message["meta"]
                 try:
-                    jsonschema.validate(meta, self.__schema)
-                    if self.__cmd_coro is None or self.__cmd_coro.done():
-                        temp_coro = self.__cmd_coro
-                        self.__cmd_coro = asyncio.create_task(
-                            self.__process_single_command(meta)
-                        )
-                        if temp_coro is not None:
-                            exc = temp_coro.exception()
-                            if exc:
-                                raise exc
-                    else:
-                        self.output.publish(
-                            dict(
-                                meta=dict(
-                                    type="reply",
-                                    reply_type="error",
-                                    error_code=8,
-                                    error_text_code="SERVER_BUSY_ERROR",
-                                    description="HV server is busy",
-                                ),
-                                data=b"",
-                            )
-                        )
+                    command = self.__parser.parse(meta)
                 except jsonschema.ValidationError as err:
-                    self.output.publish(
-                        dict(
-                            meta=dict(
-                                type="reply",
-                                reply_type="error",
-                                error_code=9,
-                                error_text_code="INCORRECT_MESSAGE_PARAMS",
-                                description=err.message,
-                            ),
-                            data=b"",
-                        )
+                    self.__error(9, "INCORRECT_MESSAGE_PARAMS", err.message, meta)
+                    continue
+
+                if isinstance(command, Abort):
+                    self.__answer(command, status="ok", aborted=self.__scheduler.abort())
+                    continue
+
+                if command.command_type not in self.__handlers:
+                    self.__error(
+                        9,
+                        "INCORRECT_MESSAGE_PARAMS",
+                        f"command '{command.command_type}' is not supported"
+                        f" by block '{self.block.name}'",
+                        command,
                     )
+                    continue
+
+                try:
+                    self.__scheduler.submit(command)
+                except QueueFullError as err:
+                    self.__error(8, "SERVER_BUSY_ERROR", str(err), command)
             except asyncio.CancelledError as exc:
                 raise exc
             # pylint: disable-next=broad-except
             except Exception as exc:
-                self.output.publish(
-                    dict(
-                        meta=dict(
-                            type="reply",
-                            reply_type="error",
-                            error_code=5,
-                            error_text_code="ALGORITM_ERROR",
-                            description=repr(exc),
-                        ),
-                        data=b"",
-                    )
-                )
+                self.__error(5, "ALGORITM_ERROR", repr(exc))
                 _logger.exception(exc)
 
     async def __monitor_voltage(self):
@@ -286,6 +572,8 @@ class HVManager(HardwareManager):
                     voltage = await self.__get_voltage()
                     _logger.debug("curr: %f", voltage)
                     self.V_last = voltage
+                    self.measurements.publish(voltage)
+                    self.history.add_reading(voltage)
                     if self.__db_writer is not None:
                         self.__db_writer.write(float("{:.2f}".format(voltage)))
                     self.output.publish(
@@ -293,7 +581,7 @@ class HVManager(HardwareManager):
                             meta=dict(
                                 type="answer",
                                 answer_type="get_voltage",
-                                block=1,
+                                block=self.block.name,
                                 voltage=voltage,
                             ),
                             data=b"",
@@ -303,23 +591,16 @@ class HVManager(HardwareManager):
                 raise exc
             # pylint: disable-next=broad-except
             except Exception as exc:
-                self.output.publish(
-                    dict(
-                        meta=dict(
-                            type="reply",
-                            reply_type="error",
-                            error_code=5,
-                            error_text_code="ALGORITM_ERROR",
-                            description=repr(exc),
-                        ),
-                        data=b"",
-                    )
-                )
+                self.__error(5, "ALGORITM_ERROR", repr(exc))
                 _logger.exception(exc)
 
+    def histories(self) -> list[History]:
+        return [self.history]
+
     async def start(self):
         await self.__init__agilent_34401a()
         await self.__init_fluke_5200e()
+        self.__scheduler_coro = asyncio.create_task(self.__scheduler.run())
         self.__handle_input_coro = asyncio.create_task(self.__handle_input())
         self.__monitor_coro = asyncio.create_task(self.__monitor_voltage())
 
@@ -327,6 +608,9 @@ class HVManager(HardwareManager):
         if self.__handle_input_coro:
             self.__handle_input_coro.cancel()
             self.__handle_input_coro = None
+        if self.__scheduler_coro:
+            self.__scheduler_coro.cancel()
+            self.__scheduler_coro = None
         if self.__monitor_coro:
             self.__monitor_coro.cancel()
             self.__monitor_coro = None
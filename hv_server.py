@@ -1,48 +1,53 @@
 """Скрипт запуска сервера стойки HV."""
 
 import asyncio
-import os
 from functools import partial
-from logging import Logger, getLogger
-from typing import Optional
+from logging import getLogger
 
 from config import (
+    DB_COLUMNAR,
+    DB_ROLLUP,
     DB_SYNC_COMMAND,
     DB_SYNC_INTERVAL,
+    DB_SYNC_SHUTDOWN_TIMEOUT,
     LOGGER_NAME,
     TCP_INTERFACE_HOST,
     TCP_INTERFACE_PORT,
 )
 from db import DailyTsvWriter
+from db_columnar import ColumnarStorage
+from db_rollup import RollupStorage
+from db_sync import DbSyncEngine
 from hv_manager import HVManager
+from utils.blocks import BlockRegistry, load_blocks
 from utils.logger import init_logger
 from utils.transport.socket import socket_handler
 from utils.transport.websocket import init_web
 
 
-async def sync_db_loop(cmd: str, interval: float, logger: Optional[Logger] = None):
-    while True:
-        if logger:
-            logger.info(f"start database syncing ({cmd})")
-        os.system(cmd)
-        if logger:
-            logger.info("database synced")
-        await asyncio.sleep(interval)
-
-
 if __name__ == "__main__":
     init_logger(LOGGER_NAME)
     _logger = getLogger(LOGGER_NAME)
 
-    __db_writer = DailyTsvWriter("HV")
-
-    manager = HVManager(__db_writer)
+    manager = BlockRegistry()
+    __db_writers = []
+    __extra_storages = [ColumnarStorage] if DB_COLUMNAR else []
+    if DB_ROLLUP:
+        __extra_storages.append(RollupStorage)
+    for block in load_blocks():
+        __db_writer = DailyTsvWriter(block.sensor, extra_storages=__extra_storages)
+        __db_writers.append(__db_writer)
+        manager.register(
+            block.name, HVManager(__db_writer, block=block, output=manager.output)
+        )
 
     loop = asyncio.new_event_loop()
 
+    __db_sync = None
     __sync_db_loop = None
     if DB_SYNC_COMMAND:
-        __sync_db_loop = loop.create_task(sync_db_loop(DB_SYNC_COMMAND, DB_SYNC_INTERVAL, _logger))
+        __db_sync = DbSyncEngine(DB_SYNC_COMMAND)
+        __sync_db_loop = loop.create_task(__db_sync.run(DB_SYNC_INTERVAL))
 
     loop.run_until_complete(manager.start())
 
@@ -61,12 +66,24 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         _logger.info("Programm stoped by user input")
 
+    loop.run_until_complete(manager.stop())
+
+    # Запись остатка буфера БД на диск перед синхронизацией
+    for __db_writer in __db_writers:
+        __db_writer.close()
+
     # Синхронизация базы данных перед завершением программы
-    if DB_SYNC_COMMAND:
-        __sync_db_loop.cancel()
-        os.system(DB_SYNC_COMMAND)
+    if __db_sync:
+        __sync_db_loop.cancel()  # type: ignore
+        try:
+            loop.run_until_complete(
+                asyncio.wait_for(__db_sync.sync(), DB_SYNC_SHUTDOWN_TIMEOUT)
+            )
+        except asyncio.TimeoutError:
+            _logger.error(
+                "database syncing did not finish in %.0f s", DB_SYNC_SHUTDOWN_TIMEOUT
+            )
 
-    loop.run_until_complete(manager.stop())
     server.close()
     loop.run_until_complete(server.wait_closed())
     if ws_server:
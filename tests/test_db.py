@@ -0,0 +1,94 @@
+"""DailyTsvWriter: group commit, rollback of a failed group, torn line recovery."""
+
+import datetime
+
+import pytest
+
+import db
+from db import DailyTsvWriter, DayStorage
+
+
+class RecordingStorage(DayStorage):
+    """Extra storage keeping the appended groups, the first `failures` appends raise."""
+
+    failures = 0
+    groups: list[list[float]] = []
+
+    def mark(self):
+        return None
+
+    def append(self, records):
+        if RecordingStorage.failures:
+            RecordingStorage.failures -= 1
+            raise ValueError("broken storage")
+        RecordingStorage.groups.append([value for _, value in records])
+
+    def flush(self, fsync):
+        pass
+
+    def _open(self, day):
+        pass
+
+    def _close(self, fsync, discard=False):
+        pass
+
+    def _truncate(self, day, mark):
+        pass
+
+
+@pytest.fixture
+def db_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "LOCAL_DB_ROOT", str(tmp_path))
+    RecordingStorage.failures = 0
+    RecordingStorage.groups = []
+    return tmp_path
+
+
+def tsv_values(writer: DailyTsvWriter) -> list[float]:
+    path = writer._get_filepath(datetime.date.today())
+    lines = path.read_text().splitlines()
+    assert lines[0] == "timestamp\tHV"
+    return [float(line.split("\t")[1]) for line in lines[1:]]
+
+
+def test_values_are_written_in_one_group(db_root):
+    writer = DailyTsvWriter("HV", flush_interval=60, extra_storages=[RecordingStorage])
+    for value in range(100):
+        writer.write(float(value))
+    assert writer.flush(5)
+    assert tsv_values(writer) == [float(value) for value in range(100)]
+    assert RecordingStorage.groups == [[float(value) for value in range(100)]]
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.flush()
+
+
+def test_failed_group_is_rolled_back_and_written_once(db_root):
+    RecordingStorage.failures = 1
+    writer = DailyTsvWriter("HV", flush_interval=60, extra_storages=[RecordingStorage])
+    writer.write(1.0)
+    writer.write(2.0)
+    # TSV got the group before the extra storage failed
+    assert not writer.flush(5)
+    writer.write(3.0)
+    assert writer.flush(5)
+    writer.close()
+    assert tsv_values(writer) == [1.0, 2.0, 3.0]
+    assert RecordingStorage.groups == [[1.0, 2.0, 3.0]]
+
+
+def test_non_number_is_rejected(db_root):
+    with DailyTsvWriter("HV", flush_interval=60) as writer:
+        with pytest.raises(TypeError):
+            writer.write("1.0")  # type: ignore
+
+
+def test_torn_last_line_is_dropped(db_root):
+    writer = DailyTsvWriter("HV", flush_interval=60)
+    path = writer._get_filepath(datetime.date.today())
+    writer.close()
+    path.write_text("timestamp\tHV\n10:00:00\t1.0\n10:00:01\t2.")
+    with DailyTsvWriter("HV", flush_interval=60) as writer:
+        writer.write(3.0)
+        assert writer.flush(5)
+    assert tsv_values(writer) == [1.0, 3.0]
@@ -0,0 +1,112 @@
+"""RollupStorage: resume after restart and rollback of a failed group."""
+
+import datetime
+
+import pytest
+
+import db
+import db_rollup
+from db import DailyTsvWriter, DayStorage
+from db_rollup import RollupStorage, read_rollup
+
+TIERS = (60, 3600)
+
+
+class TieredRollup(RollupStorage):
+    def __init__(self, base_path, sensor_name):
+        super().__init__(base_path, sensor_name, TIERS)
+
+
+class FailingStorage(DayStorage):
+    """Extra storage whose first `failures` appends raise."""
+
+    failures = 0
+
+    def mark(self):
+        return None
+
+    def append(self, records):
+        if FailingStorage.failures:
+            FailingStorage.failures -= 1
+            raise ValueError("broken storage")
+
+    def flush(self, fsync):
+        pass
+
+    def _open(self, day):
+        pass
+
+    def _close(self, fsync, discard=False):
+        pass
+
+    def _truncate(self, day, mark):
+        pass
+
+
+@pytest.fixture
+def db_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "LOCAL_DB_ROOT", str(tmp_path))
+    FailingStorage.failures = 0
+    return tmp_path
+
+
+def hour_row(root) -> dict:
+    today = datetime.date.today()
+    rows = read_rollup(
+        "HV",
+        3600,
+        datetime.datetime.combine(today, datetime.time()),
+        datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time()),
+        root=str(root),
+    )
+    return {name: column[-1] for name, column in rows.items()}
+
+
+def minute_rows(root) -> dict:
+    now = datetime.datetime.now()
+    hour = datetime.timedelta(hours=1)
+    return read_rollup("HV", 60, now - hour, now + hour, root=str(root))
+
+
+def test_failed_group_is_not_counted_twice(db_root):
+    FailingStorage.failures = 1
+    writer = DailyTsvWriter(
+        "HV", flush_interval=60, extra_storages=[TieredRollup, FailingStorage]
+    )
+    for value in (1.0, 2.0, 3.0):
+        writer.write(value)
+    assert not writer.flush(5)
+    # the intervals of the failed group are not written on abort
+    assert minute_rows(db_root)["count"].sum() == 0
+    assert writer.flush(5)
+    writer.close()
+    totals = minute_rows(db_root)
+    assert totals["count"].sum() == 3
+    assert (totals["mean"] * totals["count"]).sum() == pytest.approx(6.0)
+
+
+def test_interval_is_resumed_after_restart(db_root):
+    with DailyTsvWriter("HV", flush_interval=60, extra_storages=[TieredRollup]) as writer:
+        writer.write(1.0)
+        writer.write(3.0)
+    first = hour_row(db_root)
+    with DailyTsvWriter("HV", flush_interval=60, extra_storages=[TieredRollup]) as writer:
+        writer.write(5.0)
+    second = hour_row(db_root)
+    if second["time"] != first["time"]:
+        pytest.skip("the hour changed between the writers")
+    assert second["count"] == 3
+    assert second["mean"] == pytest.approx(3.0)
+    assert second["min"] == 1.0 and second["max"] == 5.0
+    assert second["std"] == pytest.approx((8 / 3) ** 0.5)
+
+
+def test_rebuild_matches_online_rollup(db_root):
+    with DailyTsvWriter("HV", flush_interval=60, extra_storages=[TieredRollup]) as writer:
+        for value in (1.0, 2.0, 4.0):
+            writer.write(value)
+    online = hour_row(db_root)
+    db_rollup.rebuild_tsv(writer._get_filepath(datetime.date.today()), tiers=TIERS)
+    rebuilt = hour_row(db_root)
+    for name in ("time", "count", "min", "max", "mean"):
+        assert rebuilt[name] == pytest.approx(online[name])
@@ -0,0 +1,41 @@
+"""Time bucket aggregation and LTTB decimation."""
+
+import numpy as np
+import pytest
+
+from utils.downsample import bucket, lttb
+
+
+def test_bucket_aggregates_and_drops_empty_buckets():
+    times = np.array([0.0, 1.0, 2.0, 7.0, 8.0, 12.0])
+    values = np.array([1.0, 3.0, 2.0, 5.0, 7.0, 100.0])
+    columns = bucket(times, values, 0.0, 10.0, 5)
+    # the sample after `stop` is cut off, bucket [4, 6) is empty
+    np.testing.assert_array_equal(columns["time"], [0.0, 2.0, 6.0, 8.0])
+    np.testing.assert_array_equal(columns["min"], [1.0, 2.0, 5.0, 7.0])
+    np.testing.assert_array_equal(columns["max"], [3.0, 2.0, 5.0, 7.0])
+    np.testing.assert_array_equal(columns["mean"], [2.0, 2.0, 5.0, 7.0])
+    np.testing.assert_array_equal(columns["count"], [2, 1, 1, 1])
+
+
+def test_bucket_of_empty_range():
+    columns = bucket(np.array([20.0]), np.array([1.0]), 0.0, 10.0, 5)
+    assert all(len(column) == 0 for column in columns.values())
+
+
+def test_lttb_keeps_ends_and_peak():
+    times = np.arange(1000, dtype=float)
+    values = np.zeros(1000)
+    values[437] = 10.0
+    columns = lttb(times, values, 50)
+    assert len(columns["time"]) == 50
+    assert columns["time"][0] == 0.0 and columns["time"][-1] == 999.0
+    assert np.all(np.diff(columns["time"]) > 0)
+    assert 437.0 in columns["time"]
+    assert columns["value"].max() == pytest.approx(10.0)
+
+
+def test_lttb_returns_short_series_as_is():
+    times, values = np.arange(10.0), np.arange(10.0)
+    columns = lttb(times, values, 100)
+    assert columns["time"] is times and columns["value"] is values
@@ -0,0 +1,36 @@
+"""EnvelopeDecoder: envelopes split across reads, garbage and oversized frames."""
+
+import dfparser
+import pytest
+
+from utils.transport.envelope import EnvelopeDecoder, EnvelopeTooLargeError
+
+
+def envelope(name: str, data: bytes = b"") -> bytes:
+    return dfparser.create_message(dict(name=name), data)
+
+
+def test_envelope_split_byte_by_byte():
+    stream = envelope("a", b"\x01\x02") + envelope("b")
+    decoder = EnvelopeDecoder()
+    messages = []
+    for idx in range(len(stream)):
+        messages += decoder.feed(stream[idx : idx + 1])
+    assert [message["meta"]["name"] for message in messages] == ["a", "b"]
+    assert messages[0]["data"] == b"\x01\x02"
+    assert len(decoder) == 0
+
+
+def test_garbage_between_envelopes_is_skipped():
+    decoder = EnvelopeDecoder()
+    stream = b"noise#x" + envelope("a") + b"#!garbage!#\r\n" + envelope("b")
+    messages = decoder.feed(stream)
+    assert [message["meta"]["name"] for message in messages] == ["a", "b"]
+
+
+def test_oversized_envelope_is_rejected_by_header():
+    frame = envelope("a", b"\0" * 1000)
+    decoder = EnvelopeDecoder(max_message_size=100)
+    with pytest.raises(EnvelopeTooLargeError):
+        # the header alone is enough to reject the envelope
+        decoder.feed(frame[:40])
@@ -0,0 +1,57 @@
+"""Row counts of /history checked before the range is loaded."""
+
+import datetime
+
+import db
+from db import DailyTsvWriter, day_stem
+from db_columnar import convert_tsv, count_range, read_range
+from db_rollup import RollupStorage, count_rollup, read_rollup
+
+TIERS = (60, 3600)
+DAY = datetime.date(2025, 2, 14)
+
+
+class TieredRollup(RollupStorage):
+    def __init__(self, base_path, sensor_name):
+        super().__init__(base_path, sensor_name, TIERS)
+
+
+def at(hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime.combine(DAY, datetime.time(hour, minute))
+
+
+def write_day(root) -> str:
+    """TSV file of `DAY` with a reading every minute."""
+    path = root / "HV" / f"{day_stem(DAY)}.tsv"
+    path.parent.mkdir()
+    lines = [f"{datetime.time(m // 60, m % 60).isoformat()}\t{m}\n" for m in range(1440)]
+    path.write_text("timestamp\tHV\n" + "".join(lines))
+    return path
+
+
+def test_tsv_count_is_scaled_by_day_fraction(tmp_path):
+    write_day(tmp_path)
+    count = count_range("HV", at(6), at(12), root=str(tmp_path))
+    assert count == len(read_range("HV", at(6), at(12), root=str(tmp_path))[0]) == 360
+
+
+def test_columnar_count_is_exact(tmp_path):
+    convert_tsv(write_day(tmp_path))
+    start, stop = at(6, 7), at(6, 30)
+    assert count_range("HV", start, stop, root=str(tmp_path)) == 23
+    days = datetime.timedelta(days=3)
+    assert count_range("HV", at(0), at(0) + days, root=str(tmp_path)) == 1440
+
+
+def test_rollup_count_matches_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "LOCAL_DB_ROOT", str(tmp_path))
+    with DailyTsvWriter("HV", flush_interval=60, extra_storages=[TieredRollup]) as writer:
+        for value in range(10):
+            writer.write(float(value))
+    now = datetime.datetime.now()
+    hour = datetime.timedelta(hours=1)
+    for tier in TIERS:
+        rows = read_rollup("HV", tier, now - hour, now + hour, root=str(tmp_path))
+        count = count_rollup("HV", tier, now - hour, now + hour, root=str(tmp_path))
+        assert count == len(rows["time"]) > 0
+    assert count_rollup("HV", 60, now + hour, now + 2 * hour, root=str(tmp_path)) == 0
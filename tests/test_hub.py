@@ -0,0 +1,97 @@
+"""Subscription overflow policies."""
+
+import asyncio
+
+import pytest
+
+from utils.hub import Hub, Message, SlowConsumerError, Subscription
+
+
+def measurement(block: str, voltage: float) -> Message:
+    return Message(
+        dict(type="answer", answer_type="get_voltage", block=block, voltage=voltage)
+    )
+
+
+def answer(name: str) -> Message:
+    return Message(dict(type="answer", answer_type="set_voltage", name=name))
+
+
+def drain(subscription: Subscription) -> list[dict]:
+    async def main():
+        return [(await subscription.get()).meta for _ in range(subscription.qsize())]
+
+    return asyncio.run(main())
+
+
+def test_drop_oldest_keeps_newest():
+    subscription = Subscription(maxsize=2, policy="drop_oldest")
+    for name in "abc":
+        subscription.put_nowait(answer(name))
+    assert [meta["name"] for meta in drain(subscription)] == ["b", "c"]
+    assert subscription.dropped == 1
+    assert subscription.high_water == 2
+
+
+def test_drop_newest_keeps_oldest():
+    subscription = Subscription(maxsize=2, policy="drop_newest")
+    for name in "abc":
+        subscription.put_nowait(answer(name))
+    assert [meta["name"] for meta in drain(subscription)] == ["a", "b"]
+    assert subscription.dropped == 1
+
+
+def test_coalesce_replaces_pending_measurement_of_block_in_place():
+    subscription = Subscription(maxsize=3, policy="coalesce")
+    subscription.put_nowait(measurement("HV1", 1.0))
+    subscription.put_nowait(answer("a"))
+    subscription.put_nowait(measurement("HV2", 2.0))
+    subscription.put_nowait(measurement("HV1", 1.5))
+    assert drain(subscription) == [
+        measurement("HV1", 1.5).meta,
+        answer("a").meta,
+        measurement("HV2", 2.0).meta,
+    ]
+    assert subscription.dropped == 1
+
+
+def test_coalesce_falls_back_to_drop_oldest():
+    subscription = Subscription(maxsize=2, policy="coalesce")
+    subscription.put_nowait(measurement("HV1", 1.0))
+    subscription.put_nowait(answer("a"))
+    # no pending measurement of HV2, answers are never coalesced
+    subscription.put_nowait(measurement("HV2", 2.0))
+    subscription.put_nowait(answer("b"))
+    assert drain(subscription) == [measurement("HV2", 2.0).meta, answer("b").meta]
+    assert subscription.dropped == 2
+
+
+def test_coalesce_only_on_overflow():
+    subscription = Subscription(maxsize=3, policy="coalesce")
+    subscription.put_nowait(measurement("HV1", 1.0))
+    subscription.put_nowait(measurement("HV1", 2.0))
+    assert [meta["voltage"] for meta in drain(subscription)] == [1.0, 2.0]
+    assert subscription.dropped == 0
+
+
+def test_disconnect_raises_after_overflow():
+    subscription = Subscription(maxsize=1, policy="disconnect")
+    subscription.put_nowait(answer("a"))
+    subscription.put_nowait(answer("b"))
+    subscription.put_nowait(answer("c"))
+    assert subscription.dropped == 2
+    with pytest.raises(SlowConsumerError):
+        asyncio.run(subscription.get())
+
+
+def test_hub_routes_by_topic():
+    hub = Hub()
+    measurements = hub.subscribe(topics=["get_voltage"])
+    everything = hub.subscribe()
+    hub.publish(dict(meta=measurement("HV1", 1.0).meta, data=b""))
+    hub.publish(answer("a"))
+    assert measurements.qsize() == 1
+    assert everything.qsize() == 2
+    hub.unsubscribe(everything)
+    hub.publish(answer("b"))
+    assert everything.qsize() == 2
@@ -0,0 +1,214 @@
+"""GPIB drivers against the pyvisa-sim definition of the rack."""
+
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+import pyvisa
+
+from utils import instruments
+from utils.instruments import Agilent34401A, Fluke5502E, VisaInstrument
+
+SIM = str(Path(__file__).parents[1] / "sim" / "instruments.yaml") + "@sim"
+AGILENT = "GPIB::20::INSTR"
+FLUKE = "GPIB::4::INSTR"
+READING = -0.246874
+
+
+class Recorder:
+    """ResourceManager whose resources log the commands sent to them.
+
+    `query` goes through `write` and `read`, reads are logged as "<read>".
+    """
+
+    def __init__(self, resource_manager):
+        self.resource_manager = resource_manager
+        self.log: list[str] = []
+
+    def open_resource(self, address):
+        resource = self.resource_manager.open_resource(address)
+        log = self.log
+        write, read = resource.write, resource.read
+
+        def logged_write(command):
+            log.append(command)
+            return write(command)
+
+        def logged_read():
+            log.append("<read>")
+            return read()
+
+        resource.write, resource.read = logged_write, logged_read
+        return resource
+
+
+@pytest.fixture
+def resource_manager():
+    resource_manager = pyvisa.ResourceManager(SIM)
+    yield resource_manager
+    resource_manager.close()
+
+
+@pytest.fixture
+def no_pauses(monkeypatch):
+    """Skip the settle pauses of `configure`."""
+    sleep = asyncio.sleep
+    monkeypatch.setattr(instruments.asyncio, "sleep", lambda delay: sleep(0))
+
+
+def test_agilent_measures_simulated_reading(resource_manager, no_pauses):
+    async def main():
+        voltmeter = Agilent34401A(resource_manager, AGILENT, nplc=0.02)
+        await voltmeter.open()
+        assert (await voltmeter.query("*IDN?")).startswith("HEWLETT-PACKARD,34401A")
+        await voltmeter.configure()
+        assert (await voltmeter.query("VOLT:NPLC?")).strip() == "0.02"
+        value = await voltmeter.measure()
+        await voltmeter.close()
+        return value
+
+    assert asyncio.run(main()) == pytest.approx(READING)
+
+
+def test_fluke_set_output_sends_out_command(resource_manager, no_pauses):
+    recorder = Recorder(resource_manager)
+
+    async def main():
+        calibrator = Fluke5502E(recorder, FLUKE)
+        await calibrator.open()
+        await calibrator.configure()
+        await calibrator.set_output(5.5)
+        output = await calibrator.query("OUT?")
+        await calibrator.close()
+        return output.strip()
+
+    assert asyncio.run(main()) == "5.5,V"
+    assert recorder.log[:3] == ["OPER", "OUT 5.5 V", "OUT?"]
+
+
+def test_call_timeout_does_not_block_loop(resource_manager):
+    async def main():
+        instrument = VisaInstrument(resource_manager, AGILENT, "slow")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await instrument._call(time.sleep, 0.5, timeout=0.1)
+        elapsed = time.monotonic() - start
+        task.cancel()
+        await instrument.close()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(main())
+    assert elapsed < 0.4
+    assert ticks >= 5
+
+
+def test_calls_of_one_instrument_do_not_overlap(resource_manager):
+    spans = []
+
+    def transaction():
+        start = time.monotonic()
+        time.sleep(0.05)
+        spans.append((start, time.monotonic()))
+
+    async def main():
+        instrument = VisaInstrument(resource_manager, AGILENT, "serial")
+        await asyncio.gather(instrument._call(transaction), instrument._call(transaction))
+        await instrument.close()
+
+    asyncio.run(main())
+    (_, first_end), (second_start, _) = sorted(spans)
+    assert second_start >= first_end
+
+
+BUSY_AGILENT = "GPIB::21::INSTR"
+
+
+def test_conversion_time_from_nplc_and_autozero():
+    def conversion_time(**kwargs):
+        return Agilent34401A(None, AGILENT, **kwargs).conversion_time
+
+    overhead = instruments.TRIGGER_OVERHEAD
+    assert conversion_time(nplc=10, autozero=False) == pytest.approx(0.2 + overhead)
+    assert conversion_time(nplc=10, autozero=True) == pytest.approx(0.4 + overhead)
+    assert conversion_time(
+        nplc=1, autozero=False, line_frequency=60
+    ) == pytest.approx(1 / 60 + overhead)
+
+
+def test_triggered_reading_polls_opc_then_fetches(resource_manager):
+    recorder = Recorder(resource_manager)
+
+    async def main():
+        voltmeter = Agilent34401A(recorder, AGILENT, nplc=0.02, autozero=False)
+        await voltmeter.open()
+        value = await voltmeter.measure()
+        await voltmeter.close()
+        return value
+
+    assert asyncio.run(main()) == pytest.approx(READING)
+    assert recorder.log == ["*CLS", "INIT", "*OPC", "*ESR?", "<read>", "FETC?", "<read>"]
+
+
+def test_triggered_reading_times_out_without_opc(resource_manager):
+    recorder = Recorder(resource_manager)
+
+    async def main():
+        voltmeter = Agilent34401A(
+            recorder, BUSY_AGILENT, nplc=0.02, autozero=False, poll_interval=0.05
+        )
+        await voltmeter.open()
+        start = time.monotonic()
+        with pytest.raises(TimeoutError, match="not ready"):
+            await voltmeter.measure()
+        elapsed = time.monotonic() - start
+        await voltmeter.close()
+        return voltmeter.conversion_time, elapsed
+
+    conversion_time, elapsed = asyncio.run(main())
+    deadline = 2 * conversion_time + 1.0
+    assert deadline <= elapsed < deadline + 0.5
+    assert recorder.log.count("*ESR?") > 1
+    assert "FETC?" not in recorder.log
+
+
+def test_read_mode_reads_after_pause(resource_manager, monkeypatch):
+    monkeypatch.setattr(instruments, "AGILENT_READ_DELAY", 0.01)
+    recorder = Recorder(resource_manager)
+
+    async def main():
+        voltmeter = Agilent34401A(recorder, AGILENT, acquisition="read")
+        await voltmeter.open()
+        value = await voltmeter.measure()
+        await voltmeter.close()
+        return value
+
+    assert asyncio.run(main()) == pytest.approx(READING)
+    assert recorder.log == ["READ?", "<read>"]
+
+
+def test_close_drains_pending_read(resource_manager, monkeypatch):
+    monkeypatch.setattr(instruments, "AGILENT_READ_DELAY", 10)
+    recorder = Recorder(resource_manager)
+
+    async def main():
+        voltmeter = Agilent34401A(recorder, AGILENT, acquisition="read")
+        await voltmeter.open()
+        measure = asyncio.create_task(voltmeter.measure())
+        await asyncio.sleep(0.05)
+        measure.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await measure
+        await voltmeter.close()
+
+    asyncio.run(main())
+    assert recorder.log == ["READ?", "<read>"]
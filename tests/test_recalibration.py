@@ -0,0 +1,51 @@
+"""ScalingEstimator: bounded covariance under poorly exciting updates."""
+
+import json
+import random
+
+from utils.recalibration import ScalingEstimator
+
+A, B = 3500.5, 1.26
+PRIOR_STD = (5.0, 20.0)
+
+
+def test_same_setpoint_updates_do_not_wind_up():
+    random.seed(1)
+    estimator = ScalingEstimator(A, B, forgetting=0.99, prior_std=PRIOR_STD)
+    for _ in range(10000):
+        voltage = A * 5.0 + B + random.gauss(0, 0.05)
+        assert estimator.update(5.0, voltage, 0.01)
+    a_std, b_std = estimator.uncertainty
+    assert a_std <= PRIOR_STD[0] * (1 + 1e-9)
+    assert b_std <= PRIOR_STD[1] * (1 + 1e-9)
+    # the gate still works after thousands of updates
+    assert not estimator.update(5.0, A * 5.0 + B + 5000.0)
+    assert abs(estimator.a * 5.0 + estimator.b - (A * 5.0 + B)) < 0.1
+
+
+def test_broken_state_is_ignored(tmp_path):
+    state_path = tmp_path / "scaling.json"
+    state_path.write_text(
+        json.dumps(dict(a=1.0, b=2.0, cov=[[-1.0, 0.0], [0.0, 1.0]])),
+        encoding="utf-8",
+    )
+    estimator = ScalingEstimator(A, B, prior_std=PRIOR_STD, state_path=str(state_path))
+    assert estimator.coefficients == (A, B)
+    assert estimator.uncertainty == PRIOR_STD
+
+
+def test_state_is_saved_explicitly_and_newest_wins(tmp_path):
+    state_path = tmp_path / "scaling.json"
+    estimator = ScalingEstimator(A, B, prior_std=PRIOR_STD, state_path=str(state_path))
+    assert estimator.update(5.0, A * 5.0 + B + 1.0)
+    # update only changes the state in memory
+    assert not state_path.exists()
+    old = estimator.snapshot()
+    assert estimator.update(5.0, A * 5.0 + B + 1.0)
+    estimator.save()
+    # a snapshot older than the written one is skipped
+    estimator.save(old)
+    restored = ScalingEstimator(A, B, prior_std=PRIOR_STD, state_path=str(state_path))
+    assert restored.updates == 2
+    assert restored.coefficients == estimator.coefficients
+    assert restored.uncertainty == estimator.uncertainty
@@ -0,0 +1,140 @@
+"""CommandScheduler: priorities, coalescing of set_voltage and abort."""
+
+import asyncio
+
+import pytest
+
+from utils.commands import SetVoltage
+from utils.scheduler import CommandScheduler, QueueFullError
+
+
+def set_voltage(voltage: float, priority: int = 0) -> SetVoltage:
+    return SetVoltage(
+        dict(block="HV", command_type="set_voltage", voltage=voltage, priority=priority)
+    )
+
+
+class Recorder:
+    """Scheduler callbacks; commands block until `release` is set."""
+
+    def __init__(self):
+        self.executed = []
+        self.cancelled = []
+        self.errors = []
+        self.release = asyncio.Event()
+
+    async def execute(self, command):
+        await self.release.wait()
+        self.executed.append(command)
+
+    def on_cancel(self, command, status):
+        self.cancelled.append((command, status))
+
+    def on_error(self, command, exc):
+        self.errors.append((command, exc))
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_priority_then_fifo_order():
+    async def main():
+        recorder = Recorder()
+        scheduler = CommandScheduler(
+            recorder.execute, recorder.on_cancel, recorder.on_error, 3, coalesce=False
+        )
+        first, low, high, low2 = (
+            set_voltage(1),
+            set_voltage(2),
+            set_voltage(3, priority=1),
+            set_voltage(4),
+        )
+        task = asyncio.create_task(scheduler.run())
+        scheduler.submit(first)
+        await settle()
+        for command in (low, high, low2):
+            scheduler.submit(command)
+        with pytest.raises(QueueFullError):
+            scheduler.submit(set_voltage(5))
+        recorder.release.set()
+        await settle()
+        task.cancel()
+        return recorder.executed, [first, high, low, low2]
+
+    executed, expected = asyncio.run(main())
+    assert executed == expected
+
+
+def test_coalesce_supersedes_queued_set_voltage():
+    async def main():
+        recorder = Recorder()
+        scheduler = CommandScheduler(
+            recorder.execute, recorder.on_cancel, recorder.on_error, coalesce=True
+        )
+        task = asyncio.create_task(scheduler.run())
+        running, old, new = set_voltage(1), set_voltage(2), set_voltage(3)
+        scheduler.submit(running)
+        await settle()
+        scheduler.submit(old)
+        scheduler.submit(new)
+        recorder.release.set()
+        await settle()
+        task.cancel()
+        return recorder, [running, new], [(old, "superseded")]
+
+    recorder, executed, cancelled = asyncio.run(main())
+    # the running command is never superseded
+    assert recorder.executed == executed
+    assert recorder.cancelled == cancelled
+
+
+def test_abort_cancels_running_and_queued():
+    async def main():
+        recorder = Recorder()
+        scheduler = CommandScheduler(
+            recorder.execute, recorder.on_cancel, recorder.on_error, coalesce=False
+        )
+        task = asyncio.create_task(scheduler.run())
+        running, queued = set_voltage(1), set_voltage(2)
+        scheduler.submit(running)
+        await settle()
+        scheduler.submit(queued)
+        assert scheduler.abort() == 2
+        await settle()
+        assert scheduler.running is None
+        # the scheduler keeps running after abort
+        after = set_voltage(3)
+        scheduler.submit(after)
+        recorder.release.set()
+        await settle()
+        task.cancel()
+        return recorder, [(queued, "aborted"), (running, "aborted")], [after]
+
+    recorder, cancelled, executed = asyncio.run(main())
+    assert recorder.cancelled == cancelled
+    assert recorder.executed == executed
+
+
+def test_failed_command_is_reported():
+    async def main():
+        errors = []
+
+        async def execute(command):
+            raise ValueError("broken")
+
+        scheduler = CommandScheduler(
+            execute,
+            lambda *_: None,
+            lambda command, exc: errors.append(exc),
+            coalesce=False,
+        )
+        task = asyncio.create_task(scheduler.run())
+        scheduler.submit(set_voltage(1))
+        await settle()
+        task.cancel()
+        return errors
+
+    errors = asyncio.run(main())
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
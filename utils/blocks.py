@@ -0,0 +1,135 @@
+"""Several HV blocks (channels) behind one hardware manager interface."""
+
+import asyncio
+from logging import getLogger
+from typing import NamedTuple, Optional
+
+import config
+from config import LOGGER_NAME
+from utils.manager import HardwareManager
+from utils.ringbuffer import History
+
+_logger = getLogger(LOGGER_NAME)
+
+
+class BlockConfig(NamedTuple):
+    """Hardware of one HV block.
+
+    Attributes:
+        name: block name (`block` field of the commands and answers).
+        sensor: DB sensor name.
+        agilent: VISA address of the Agilent 34401A voltmeter.
+        fluke: VISA address of the Fluke 5502E calibrator, None for
+            blocks without a controlled supply (voltmeter only).
+        divider: divider factor (voltmeter reading -> HV volts).
+        scaling: (A, B) coefficients of :func:`utils.scale.rescale_voltage`.
+    """
+
+    name: int | str
+    sensor: str
+    agilent: str
+    fluke: Optional[str]
+    divider: float
+    scaling: tuple[float, float]
+
+
+def load_blocks() -> list[BlockConfig]:
+    """Blocks from `config.BLOCKS`.
+
+    Without `BLOCKS` a single block `1` is made of the legacy
+    `AGILENT_34401A_GPIB_ADDR`, `FLUKE_5502E_GPIB_ADDR` and `DIVIDER_FACTOR`.
+    """
+    scaling = (config.HV_SCALING_COEFFICIENT_A, config.HV_SCALING_COEFFICIENT_B)
+    if not config.BLOCKS:
+        return [
+            BlockConfig(
+                1,
+                "HV",
+                config.AGILENT_34401A_GPIB_ADDR,
+                config.FLUKE_5502E_GPIB_ADDR,
+                config.DIVIDER_FACTOR,
+                scaling,
+            )
+        ]
+    return [
+        BlockConfig(
+            name,
+            params["sensor"],
+            params["agilent"],
+            params.get("fluke"),
+            params["divider"],
+            tuple(params.get("scaling", scaling)),  # type: ignore
+        )
+        for name, params in config.BLOCKS.items()
+    ]
+
+
+class BlockRegistry(HardwareManager):
+    """Routes commands to the block managers by the `block` field.
+
+    All block managers publish into the registry output, so transports
+    work with the registry exactly as with a single manager.
+
+    Example:
+    ```python
+    registry = BlockRegistry()
+    for block in load_blocks():
+        registry.register(block.name, HVManager(block=block, output=registry.output))
+    ```
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.blocks: dict[str, HardwareManager] = {}
+        self.__route_coro = None
+
+    def register(self, block: int | str, manager: HardwareManager):
+        if str(block) in self.blocks:
+            raise ValueError(f"block '{block}' is already registered")
+        if manager.output is not self.output:
+            raise ValueError("block manager must publish into the registry output")
+        self.blocks[str(block)] = manager
+
+    def __reject(self, meta, description: str):
+        reply = dict(
+            type="reply",
+            reply_type="error",
+            error_code=9,
+            error_text_code="INCORRECT_MESSAGE_PARAMS",
+            description=description,
+        )
+        if isinstance(meta, dict) and "request_id" in meta:
+            reply["request_id"] = meta["request_id"]
+        self.output.publish(dict(meta=reply, data=b""))
+
+    def histories(self) -> list[History]:
+        return [
+            history
+            for manager in self.blocks.values()
+            for history in manager.histories()
+        ]
+
+    async def __route_input(self):
+        while True:
+            message = await self.input.get()
+            meta = message["meta"]
+            block = meta.get("block") if isinstance(meta, dict) else None
+            manager = self.blocks.get(str(block)) if block is not None else None
+            if manager is None:
+                self.__reject(
+                    meta,
+                    f"unknown block {block!r}, expected one of {list(self.blocks)}",
+                )
+                continue
+            manager.input.put_nowait(message)
+
+    async def start(self):
+        await asyncio.gather(*(manager.start() for manager in self.blocks.values()))
+        self.__route_coro = asyncio.create_task(self.__route_input())
+        _logger.info("blocks started: %s", ", ".join(self.blocks))
+
+    async def stop(self):
+        if self.__route_coro:
+            self.__route_coro.cancel()
+            self.__route_coro = None
+        await asyncio.gather(*(manager.stop() for manager in self.blocks.values()))
@@ -0,0 +1,65 @@
+"""Clocks for the hardware managers (real and accelerated time)."""
+
+import asyncio
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from config import VIRTUAL_CLOCK_SPEED, VIRTUAL_MODE
+
+T = TypeVar("T")
+
+
+class Clock:
+    """Real time clock.
+
+    Managers take all time readings, sleeps and timeouts from their clock,
+    so the same code runs on an accelerated :class:`ScaledClock`.
+    """
+
+    speed = 1.0
+
+    def time(self) -> float:
+        """Monotonic time, sec."""
+        return time.monotonic()
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+    async def wait_for(self, aw: Awaitable[T], timeout: Optional[float]) -> T:
+        """:func:`asyncio.wait_for` with `timeout` in clock seconds."""
+        return await asyncio.wait_for(aw, timeout)
+
+
+class ScaledClock(Clock):
+    """Clock running `speed` times faster than real time.
+
+    Example:
+    ```python
+    clock = ScaledClock(100)
+    await clock.sleep(60)  # returns after 0.6 s
+    ```
+    """
+
+    def __init__(self, speed: float):
+        if speed <= 0:
+            raise ValueError(f"clock speed must be positive, got {speed}")
+        self.speed = speed
+        self.__real_origin = time.monotonic()
+
+    def time(self) -> float:
+        return self.__real_origin + (time.monotonic() - self.__real_origin) * self.speed
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay / self.speed)
+
+    async def wait_for(self, aw: Awaitable[T], timeout: Optional[float]) -> T:
+        return await asyncio.wait_for(
+            aw, None if timeout is None else timeout / self.speed
+        )
+
+
+def default_clock() -> Clock:
+    """Clock from the config (accelerated only in VIRTUAL_MODE)."""
+    if VIRTUAL_MODE and VIRTUAL_CLOCK_SPEED != 1:
+        return ScaledClock(VIRTUAL_CLOCK_SPEED)
+    return Clock()
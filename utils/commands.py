@@ -0,0 +1,220 @@
+"""Typed commands and their validation against `commands.schema.json`."""
+
+import json
+import math
+from typing import NamedTuple, Optional
+
+import jsonschema
+
+from config import (
+    CORRECTION_CLOSED_LOOP,
+    CORRECTION_MAX_ITERATIONS,
+    SCAN_MAX_POINTS,
+    SETTLE_CRITERION,
+)
+
+SCHEMA_PATH = "./commands.schema.json"
+
+
+class Command:
+    """Base class of validated commands.
+
+    Subclasses set `command_type` (the name of the schema definition)
+    and parse their own fields from the validated meta.
+    """
+
+    __slots__ = ("meta", "block", "request_id", "priority")
+    command_type: str = ""
+
+    def __init__(self, meta: dict):
+        self.meta = meta
+        self.block = meta["block"]
+        self.request_id = meta.get("request_id")
+        self.priority = meta.get("priority", 0)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.meta!r})"
+
+
+COMMANDS: dict[str, type[Command]] = {}
+
+
+def register_command(cls: type[Command]) -> type[Command]:
+    """Class decorator adding the command to :data:`COMMANDS`."""
+    COMMANDS[cls.command_type] = cls
+    return cls
+
+
+@register_command
+class SetVoltage(Command):
+    __slots__ = ("voltage",)
+    command_type = "set_voltage"
+
+    def __init__(self, meta: dict):
+        super().__init__(meta)
+        self.voltage = float(meta["voltage"])
+
+
+@register_command
+class SetVoltageAndCheck(Command):
+    __slots__ = (
+        "voltage",
+        "max_error",
+        "max_rel_error",
+        "consecutive",
+        "criterion",
+        "timeout",
+        "closed_loop",
+        "max_corrections",
+    )
+    command_type = "set_voltage_and_check"
+
+    def __init__(self, meta: dict):
+        super().__init__(meta)
+        self.voltage = float(meta["voltage"])
+        self.max_error = float(meta["max_error"])
+        self.max_rel_error = (
+            float(meta["max_rel_error"]) if "max_rel_error" in meta else None
+        )
+        self.consecutive = int(meta.get("consecutive", 1))
+        self.criterion = str(meta.get("criterion", SETTLE_CRITERION))
+        self.timeout = float(meta["timeout"])
+        self.closed_loop = bool(meta.get("closed_loop", CORRECTION_CLOSED_LOOP))
+        self.max_corrections = int(
+            meta.get("max_corrections", CORRECTION_MAX_ITERATIONS)
+        )
+
+
+class ScanPoint(NamedTuple):
+    voltage: float
+    dwell: float
+    max_error: float
+    timeout: float
+    max_rel_error: Optional[float] = None
+    consecutive: int = 1
+    criterion: str = SETTLE_CRITERION
+
+
+@register_command
+class RunScan(Command):
+    """Sequence of setpoints executed by the server.
+
+    Points come either from `points` (each point may override the command
+    level `dwell`, `max_error`, `max_rel_error`, `consecutive`, `criterion`
+    and `timeout`)
+    or from `start`/`stop`/`step` (`stop` is included if it lies on the grid).
+    """
+
+    __slots__ = ("points", "stop_on_timeout")
+    command_type = "run_scan"
+
+    def __init__(self, meta: dict):
+        super().__init__(meta)
+        self.stop_on_timeout = bool(meta.get("stop_on_timeout", False))
+        defaults = {
+            key: meta[key]
+            for key in (
+                "dwell",
+                "max_error",
+                "max_rel_error",
+                "consecutive",
+                "criterion",
+                "timeout",
+            )
+            if key in meta
+        }
+        defaults.setdefault("dwell", 0.0)
+
+        if "points" in meta:
+            points = [{**defaults, **point} for point in meta["points"]]
+        else:
+            start, stop, step = meta["start"], meta["stop"], meta["step"]
+            count = math.floor(abs(stop - start) / step * (1 + 1e-9)) + 1
+            if count > SCAN_MAX_POINTS:
+                raise jsonschema.ValidationError(
+                    f"scan has {count} points, maximum is {SCAN_MAX_POINTS}"
+                )
+            sign = 1 if stop >= start else -1
+            points = [
+                {**defaults, "voltage": start + sign * step * i} for i in range(count)
+            ]
+
+        if len(points) > SCAN_MAX_POINTS:
+            raise jsonschema.ValidationError(
+                f"scan has {len(points)} points, maximum is {SCAN_MAX_POINTS}"
+            )
+        for index, point in enumerate(points):
+            for key in ("max_error", "timeout"):
+                if key not in point:
+                    raise jsonschema.ValidationError(
+                        f"'{key}' is not set for point {index}"
+                    )
+        self.points = [
+            ScanPoint(
+                float(point["voltage"]),
+                float(point["dwell"]),
+                float(point["max_error"]),
+                float(point["timeout"]),
+                float(point["max_rel_error"]) if "max_rel_error" in point else None,
+                int(point.get("consecutive", 1)),
+                str(point.get("criterion", SETTLE_CRITERION)),
+            )
+            for point in points
+        ]
+
+
+@register_command
+class Abort(Command):
+    __slots__ = ()
+    command_type = "abort"
+
+
+class CommandParser:
+    """Validates command metas and converts them to :class:`Command` objects.
+
+    The schema is compiled once into one validator per `command_type`
+    (`envelope` definition + the definition named after the command).
+    Metas with unknown or missing `command_type` are checked against the
+    whole schema to get a meaningful error.
+    """
+
+    def __init__(self, schema_path: str = SCHEMA_PATH):
+        with open(schema_path, "r") as schema_file:
+            schema = json.load(schema_file)
+        validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+
+        definitions = schema["definitions"]
+        self.__full = validator_cls(schema)
+        self.__validators = {
+            command_type: validator_cls(
+                {
+                    "$schema": schema["$schema"],
+                    "definitions": definitions,
+                    "allOf": [
+                        {"$ref": "#/definitions/envelope"},
+                        {"$ref": f"#/definitions/{command_type}"},
+                    ],
+                }
+            )
+            for command_type in COMMANDS
+            if command_type in definitions
+        }
+
+    def parse(self, meta) -> Command:
+        """Validate `meta` and build the command.
+
+        Raises:
+            jsonschema.ValidationError: `meta` doesn't match the schema.
+        """
+        command_type = meta.get("command_type") if isinstance(meta, dict) else None
+        validator = (
+            self.__validators.get(command_type) if isinstance(command_type, str) else None
+        )
+        if validator is None:
+            self.__full.validate(meta)
+            raise jsonschema.ValidationError(
+                f"command '{command_type}' is not supported"
+            )
+        validator.validate(meta)
+        return COMMANDS[command_type](meta)  # type: ignore
@@ -0,0 +1,64 @@
+"""Server side decimation of the measurement stream for slow clients."""
+
+import time
+from typing import Optional
+
+
+class Decimator:
+    """Aggregates `get_voltage` answers of each block over `window` seconds.
+
+    One answer per block and window is produced: `voltage` is the last
+    reading (as in a plain answer), `min`, `max`, `mean` and `count`
+    describe all readings of the window.
+
+    Example:
+    ```python
+    decimator = Decimator(5.0)
+    decimator.add(meta)  # for each get_voltage answer
+    if decimator.deadline is not None and time.monotonic() >= decimator.deadline:
+        answers = decimator.flush()
+    ```
+    """
+
+    def __init__(self, window: float):
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window}")
+        self.window = window
+        # end of the current window (`time.monotonic()`), None - nothing to send
+        self.deadline: Optional[float] = None
+        # block -> [count, min, max, sum, last]
+        self.__blocks: dict = {}
+
+    def add(self, meta: dict):
+        voltage = meta["voltage"]
+        block = meta.get("block")
+        acc = self.__blocks.get(block)
+        if acc is None:
+            self.__blocks[block] = [1, voltage, voltage, voltage, voltage]
+        else:
+            acc[0] += 1
+            acc[1] = min(acc[1], voltage)
+            acc[2] = max(acc[2], voltage)
+            acc[3] += voltage
+            acc[4] = voltage
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.window
+
+    def flush(self) -> list[dict]:
+        """Aggregated answers of the finished window."""
+        answers = [
+            dict(
+                type="answer",
+                answer_type="get_voltage",
+                block=block,
+                voltage=last,
+                min=low,
+                max=high,
+                mean=total / count,
+                count=count,
+            )
+            for block, (count, low, high, total, last) in self.__blocks.items()
+        ]
+        self.__blocks.clear()
+        self.deadline = None
+        return answers
@@ -0,0 +1,73 @@
+"""Server-side reduction of time series for plotting."""
+
+import numpy as np
+
+
+def bucket(
+    times: np.ndarray, values: np.ndarray, start: float, stop: float, n_buckets: int
+) -> dict[str, np.ndarray]:
+    """Aggregate samples into equal time buckets over `[start, stop)`.
+
+    Empty buckets are dropped.
+
+    Returns:
+        columns `time` (bucket start), `min`, `max`, `mean` and `count`.
+    """
+    edges = np.linspace(start, stop, n_buckets + 1)
+    bounds = np.searchsorted(times, edges, side="left")
+    counts = np.diff(bounds)
+    filled = counts > 0
+    if not filled.any():
+        empty = np.empty(0)
+        return dict(time=empty, min=empty, max=empty, mean=empty, count=empty)
+
+    # reduceat reduces up to the next start index, so only filled buckets are
+    # used and samples after `stop` are cut off
+    starts = bounds[:-1][filled]
+    values = values[: bounds[-1]]
+    return dict(
+        time=edges[:-1][filled],
+        min=np.minimum.reduceat(values, starts),
+        max=np.maximum.reduceat(values, starts),
+        mean=np.add.reduceat(values, starts) / counts[filled],
+        count=counts[filled],
+    )
+
+
+def lttb(
+    times: np.ndarray, values: np.ndarray, n_points: int
+) -> dict[str, np.ndarray]:
+    """Largest-Triangle-Three-Buckets decimation to `n_points` samples.
+
+    First and last samples are always kept, the rest keep the visual shape
+    of the curve (peaks and steps) much better than plain striding.
+
+    Returns:
+        columns `time` and `value`.
+    """
+    size = len(times)
+    if n_points >= size or n_points < 3:
+        return dict(time=times, value=values)
+
+    selected = np.empty(n_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, size - 1
+    edges = np.linspace(1, size - 1, n_points - 1).astype(np.intp)
+
+    prev = 0
+    for idx in range(n_points - 2):
+        begin, end = edges[idx], edges[idx + 1]
+        # average of the next bucket is the third vertex of the triangle
+        next_begin, next_end = end, edges[idx + 2] if idx + 2 < len(edges) else size
+        next_t = times[next_begin:next_end].mean()
+        next_v = values[next_begin:next_end].mean()
+
+        bucket_t = times[begin:end]
+        bucket_v = values[begin:end]
+        area = np.abs(
+            (times[prev] - next_t) * (bucket_v - values[prev])
+            - (times[prev] - bucket_t) * (next_v - values[prev])
+        )
+        prev = begin + int(area.argmax())
+        selected[idx + 1] = prev
+
+    return dict(time=times[selected], value=values[selected])
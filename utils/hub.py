@@ -1,9 +1,232 @@
+"""Publish/subscribe hub with bounded subscriber queues."""
+
+import asyncio
+import itertools
+import json
+from collections import deque
+from typing import Iterable, Optional
+
+import dfparser
+
+from config import HUB_QUEUE_POLICY, HUB_QUEUE_SIZE
+
+POLICIES = ("drop_oldest", "drop_newest", "coalesce", "disconnect")
+
+_subscription_ids = itertools.count(1)
+
+
+class Message:
+    """Immutable hub message `{'meta': dict, 'data': bytes}`.
+
+    The encoded forms are built on first request and cached, so a message
+    published to many subscribers is serialized once per transport.
+    `meta` must not be modified after the message is published.
+    Item access (`message["meta"]`) is kept for compatibility with dicts.
+    """
+
+    __slots__ = ("meta", "data", "_dataforge", "_json")
+
+    def __init__(self, meta: dict, data: bytes = b""):
+        object.__setattr__(self, "meta", meta)
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "_dataforge", None)
+        object.__setattr__(self, "_json", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __getitem__(self, key: str):
+        if key == "meta":
+            return self.meta
+        if key == "data":
+            return self.data
+        raise KeyError(key)
+
+    def dataforge(self) -> bytes:
+        """DataForge envelope (for the TCP transport)."""
+        if self._dataforge is None:
+            object.__setattr__(
+                self, "_dataforge", dfparser.create_message(self.meta, self.data)
+            )
+        return self._dataforge  # type: ignore
+
+    def json(self) -> str:
+        """JSON encoded meta (for the WebSocket transport)."""
+        if self._json is None:
+            object.__setattr__(self, "_json", json.dumps(self.meta))
+        return self._json  # type: ignore
+
+
+class SlowConsumerError(Exception):
+    """Subscriber was disconnected because its queue overflowed."""
+
+
+class Subscription:
+    """Bounded message queue of a single hub subscriber.
+
+    When the queue is full a new message is handled according to `policy`:
+
+    - `drop_oldest` - the oldest pending message is dropped;
+    - `drop_newest` - the new message is dropped;
+    - `coalesce` - a new measurement (`get_voltage` answer) replaces the
+      latest pending measurement of the same `block` in place; other messages
+      and measurements of blocks without a pending one fall back to
+      `drop_oldest`. Answers to other commands are never coalesced;
+    - `disconnect` - the queue is cleared and :meth:`get` raises
+      :class:`SlowConsumerError`, the transport should close the connection.
+
+    `dropped` and `high_water` count lost messages and the maximal queue depth,
+    `id` tells the subscribers apart in the metrics, `topics` are set by
+    :meth:`Hub.set_topics`.
+    """
+
+    def __init__(self, maxsize: int = HUB_QUEUE_SIZE, policy: str = HUB_QUEUE_POLICY):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy '{policy}', expected one of {POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.id = next(_subscription_ids)
+        self.topics: frozenset[str] = frozenset()
+
+        self.dropped = 0
+        self.high_water = 0
+        self.disconnected = False
+
+        # queue of keys, the messages are kept in `__pending` so that
+        # coalescing can replace a message without moving it in the queue
+        self.__keys: deque = deque()
+        self.__pending: dict = {}
+        # block -> key of its latest pending measurement (for `coalesce`)
+        self.__measurements: dict = {}
+        self.__unique = itertools.count()
+        self.__ready = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self.__keys)
+
+    def put_nowait(self, message: Message):
+        if self.disconnected:
+            return
+
+        meta = message.meta
+        measurement = topic_of(meta) == "get_voltage"
+
+        if len(self.__keys) >= self.maxsize:
+            if self.policy == "coalesce" and measurement:
+                pending_key = self.__measurements.get(meta.get("block"))
+                if pending_key is not None:
+                    self.__pending[pending_key] = message
+                    self.dropped += 1
+                    return
+            if self.policy == "drop_newest":
+                self.dropped += 1
+                return
+            if self.policy == "disconnect":
+                self.dropped += len(self.__keys) + 1
+                self.__keys.clear()
+                self.__pending.clear()
+                self.__measurements.clear()
+                self.disconnected = True
+                self.__ready.set()
+                return
+            self.__pop()
+            self.dropped += 1
+
+        key = next(self.__unique)
+        self.__keys.append(key)
+        self.__pending[key] = message
+        if measurement:
+            self.__measurements[meta.get("block")] = key
+        self.high_water = max(self.high_water, len(self.__keys))
+        self.__ready.set()
+
+    async def get(self) -> Message:
+        while not self.__keys:
+            if self.disconnected:
+                raise SlowConsumerError(
+                    f"subscriber queue overflowed ({self.maxsize} messages)"
+                )
+            self.__ready.clear()
+            await self.__ready.wait()
+        return self.__pop()
+
+    def __pop(self) -> Message:
+        key = self.__keys.popleft()
+        message = self.__pending.pop(key)
+        block = message.meta.get("block")
+        if self.__measurements.get(block) == key:
+            del self.__measurements[block]
+        return message
+
+
+TOPICS = ("get_voltage", "answer", "error", "other")
+
+
+def topic_of(meta: dict) -> str:
+    """Topic of a message.
+
+    `get_voltage` - measurements, `answer` - answers to commands,
+    `error` - error replies, `other` - everything else.
+    """
+    kind = meta.get("type")
+    if kind == "answer":
+        return "get_voltage" if meta.get("answer_type") == "get_voltage" else "answer"
+    if kind == "reply" and meta.get("reply_type") == "error":
+        return "error"
+    return "other"
+
+
 class Hub:
-    """Simple pubsub hub"""
+    """Simple pubsub hub.
+
+    Subscribers choose topics (see :func:`topic_of`), a message is only
+    wrapped and queued for the subscribers of its topic, so a message
+    nobody subscribed to costs one dict lookup.
+    """
 
     def __init__(self):
-        self.subscriptions = set()
+        self.subscriptions: set[Subscription] = set()
+        self.__routes: dict[str, set[Subscription]] = {topic: set() for topic in TOPICS}
+
+    def subscribe(
+        self,
+        maxsize: int = HUB_QUEUE_SIZE,
+        policy: str = HUB_QUEUE_POLICY,
+        topics: Optional[Iterable[str]] = None,
+    ) -> Subscription:
+        """New subscription to `topics` (all topics by default)."""
+        subscription = Subscription(maxsize, policy)
+        self.subscriptions.add(subscription)
+        self.set_topics(subscription, topics)
+        return subscription
+
+    def set_topics(self, subscription: Subscription, topics: Optional[Iterable[str]]):
+        """Change the topics of a subscription (None - all topics)."""
+        topics = TOPICS if topics is None else tuple(topics)
+        unknown = set(topics) - set(TOPICS)
+        if unknown:
+            raise ValueError(f"unknown topics {sorted(unknown)}, expected {TOPICS}")
+        for topic, subscribers in self.__routes.items():
+            if topic in topics:
+                subscribers.add(subscription)
+            else:
+                subscribers.discard(subscription)
+        subscription.topics = frozenset(topics)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        for subscribers in self.__routes.values():
+            subscribers.discard(subscription)
+
+    def publish(self, message: Message | dict):
+        """Send the message to the subscribers of its topic.
 
-    def publish(self, message):
-        for queue in self.subscriptions:
+        Plain `{'meta': dict, 'data': bytes}` dicts are wrapped into :class:`Message`.
+        """
+        subscribers = self.__routes[topic_of(message["meta"])]
+        if not subscribers:
+            return
+        if not isinstance(message, Message):
+            message = Message(message["meta"], message["data"])
+        for queue in subscribers:
             queue.put_nowait(message)
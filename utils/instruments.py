@@ -0,0 +1,242 @@
+"""Async GPIB instrument drivers.
+
+Every driver owns one worker thread; all pyvisa calls of the instrument
+run there one after another, so a slow GPIB transaction never blocks
+the event loop and the calls of one instrument never interleave.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable, Optional, TypeVar
+
+from config import (
+    AGILENT_ACQUISITION,
+    AGILENT_AUTOZERO,
+    AGILENT_LINE_FREQUENCY,
+    AGILENT_NPLC,
+    AGILENT_POLL_INTERVAL,
+    AGILENT_READ_DELAY,
+    LOGGER_NAME,
+    VISA_TIMEOUT,
+)
+
+_logger = getLogger(LOGGER_NAME)
+
+T = TypeVar("T")
+
+ACQUISITIONS = ("trigger", "read")
+
+# *ESR? bits
+ESR_OPC = 0x01
+# time between the trigger and the start of the integration (auto trigger delay)
+TRIGGER_OVERHEAD = 0.05
+
+
+class VisaInstrument:
+    """Instrument served by a dedicated worker thread.
+
+    Each call has a timeout (`VISA_TIMEOUT` by default, also used as the
+    VISA I/O timeout). A call that times out keeps running in the worker,
+    later calls wait for it.
+
+    Args:
+        resource_manager: pyvisa ResourceManager (any backend, e.g. pyvisa-sim).
+        address: VISA resource name.
+        name: instrument name for the logs and the worker thread.
+    """
+
+    def __init__(
+        self,
+        resource_manager,
+        address: str,
+        name: str,
+        timeout: float = VISA_TIMEOUT,
+    ):
+        self.address = address
+        self.name = name
+        self.timeout = timeout
+        self.__resource_manager = resource_manager
+        self.__resource = None
+        self.__executor = ThreadPoolExecutor(1, thread_name_prefix=name)
+
+    async def _call(
+        self, func: Callable[..., T], *args, timeout: Optional[float] = None
+    ) -> T:
+        """Run `func(*args)` in the worker thread."""
+        future = asyncio.get_running_loop().run_in_executor(
+            self.__executor, func, *args
+        )
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as exc:
+            raise TimeoutError(
+                f"{self.name} ({self.address}) didn't answer in {timeout:g} s"
+            ) from exc
+
+    async def open(self):
+        """Open the resource.
+
+        Raises:
+            pyvisa.Error: the instrument is not available.
+        """
+
+        def open_resource():
+            resource = self.__resource_manager.open_resource(self.address)
+            resource.timeout = self.timeout * 1000  # ms
+            return resource
+
+        self.__resource = await self._call(open_resource)
+
+    async def write(self, command: str, timeout: Optional[float] = None):
+        _logger.debug("%s <- %s", self.name, command)
+        await self._call(self.__resource.write, command, timeout=timeout)  # type: ignore
+
+    async def read(self, timeout: Optional[float] = None) -> str:
+        return await self._call(self.__resource.read, timeout=timeout)  # type: ignore
+
+    async def query(self, command: str, timeout: Optional[float] = None) -> str:
+        return await self._call(
+            self.__resource.query, command, timeout=timeout  # type: ignore
+        )
+
+    async def close(self):
+        """Close the resource and stop the worker thread."""
+        if self.__resource is not None:
+            try:
+                await self._call(self.__resource.close)
+            finally:
+                self.__resource = None
+        self.__executor.shutdown(wait=False)
+
+
+class Agilent34401A(VisaInstrument):
+    """Agilent 34401A voltmeter.
+
+    In the `trigger` acquisition mode each reading is armed with `INIT`
+    followed by `*OPC`. The driver sleeps for most of the conversion time
+    derived from NPLC (doubled with autozero), then polls the OPC bit of
+    `*ESR?` and fetches the reading with `FETC?` as soon as it is ready.
+
+    The `read` mode reproduces the old behaviour: `READ?` and a fixed pause.
+    """
+
+    def __init__(
+        self,
+        resource_manager,
+        address: str,
+        acquisition: str = AGILENT_ACQUISITION,
+        nplc: float = AGILENT_NPLC,
+        autozero: bool = AGILENT_AUTOZERO,
+        line_frequency: float = AGILENT_LINE_FREQUENCY,
+        poll_interval: float = AGILENT_POLL_INTERVAL,
+        name: str = "Agilent 34401A",
+        timeout: float = VISA_TIMEOUT,
+    ):
+        if acquisition not in ACQUISITIONS:
+            raise ValueError(
+                f"unknown acquisition '{acquisition}', expected one of {ACQUISITIONS}"
+            )
+        super().__init__(resource_manager, address, name, timeout)
+        self.acquisition = acquisition
+        self.nplc = nplc
+        self.autozero = autozero
+        self.line_frequency = line_frequency
+        self.poll_interval = poll_interval
+        # READ? was sent but its answer is not read yet
+        self.__pending_read = False
+
+    @property
+    def conversion_time(self) -> float:
+        """Expected duration of one reading, sec."""
+        integration = self.nplc / self.line_frequency
+        if self.autozero:
+            integration *= 2
+        return integration + TRIGGER_OVERHEAD
+
+    async def configure(self):
+        """Reset and configure DC voltage measurements."""
+        for command in (
+            "*RST",
+            "CONF:VOLT:DC 10,0.00001",
+            "DET:BAND 3",
+            "INP:IMP:AUTO ON",
+            f"VOLT:NPLC {self.nplc:g}",
+            f"ZERO:AUTO {'ON' if self.autozero else 'OFF'}",
+        ):
+            await self.write(command)
+            await asyncio.sleep(1)
+        if self.acquisition == "trigger":
+            await self.write("TRIG:SOUR IMM")
+            await self.write("*CLS")
+        _logger.debug(
+            "%s configured, expected conversion time %.3f s",
+            self.name,
+            self.conversion_time,
+        )
+
+    async def measure(self) -> float:
+        """Take one reading, V (at the voltmeter input)."""
+        if self.acquisition == "read":
+            return await self.__measure_legacy()
+        return await self.__measure_triggered()
+
+    async def __measure_legacy(self) -> float:
+        await self.write("READ?")
+        self.__pending_read = True
+        await asyncio.sleep(AGILENT_READ_DELAY)
+        value = float(await self.read())
+        self.__pending_read = False
+        return value
+
+    async def __measure_triggered(self) -> float:
+        conversion_time = self.conversion_time
+        await self.write("*CLS")
+        await self.write("INIT")
+        await self.write("*OPC")
+        start = time.monotonic()
+        deadline = start + 2 * conversion_time + 1.0
+
+        # nothing to poll for until the integration is almost over
+        await asyncio.sleep(max(0.0, 0.9 * conversion_time - self.poll_interval))
+        while not int(await self.query("*ESR?")) & ESR_OPC:
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"{self.name} reading not ready in {deadline - start:.1f} s"
+                )
+            await asyncio.sleep(self.poll_interval)
+        _logger.debug("reading ready in %.3f s", time.monotonic() - start)
+        return float(await self.query("FETC?"))
+
+    async def close(self):
+        """Read out a pending answer (the voltmeter beeps on restart otherwise)."""
+        try:
+            if self.__pending_read:
+                await self.read()
+                self.__pending_read = False
+        finally:
+            await super().close()
+
+
+class Fluke5502E(VisaInstrument):
+    """Fluke 5502E calibrator driving the FuG supply input."""
+
+    def __init__(
+        self,
+        resource_manager,
+        address: str,
+        name: str = "Fluke 5502E",
+        timeout: float = VISA_TIMEOUT,
+    ):
+        super().__init__(resource_manager, address, name, timeout)
+
+    async def configure(self):
+        """Switch the output on."""
+        await self.write("OPER")
+        await asyncio.sleep(2)
+
+    async def set_output(self, voltage: float):
+        """Set the calibrator output, V."""
+        await self.write(f"OUT {voltage} V")
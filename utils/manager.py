@@ -1,16 +1,23 @@
 """Hardware manager abstract class."""
 
 import asyncio
+from typing import Optional
 
 from utils.hub import Hub
+from utils.ringbuffer import History
 
 
 class HardwareManager:
-    """Class for hardware logic class."""
+    """Class for hardware logic class.
 
-    def __init__(self):
+    Args:
+        output: hub to publish into (shared by several managers),
+            a new hub by default.
+    """
+
+    def __init__(self, output: Optional[Hub] = None):
         self._input = asyncio.Queue()
-        self._output = Hub()
+        self._output = output if output is not None else Hub()
 
     @property
     def input(self):
@@ -24,10 +31,15 @@ class HardwareManager:
     def output(self):
         """Output messages Hub.
 
-        The hub record must has type {'meta': dict, 'data': bytes}.
+        The hub record must has type {'meta': dict, 'data': bytes}
+        (or :class:`utils.hub.Message`).
         """
         return self._output
 
+    def histories(self) -> list[History]:
+        """In-memory histories of the managed blocks (none by default)."""
+        return []
+
     async def start(self):
         """Called on server starts.
 
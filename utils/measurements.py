@@ -0,0 +1,141 @@
+"""Broadcast of voltmeter readings and predicates for waiting on them."""
+
+import asyncio
+from typing import Callable, Optional
+
+from utils.clock import Clock
+
+
+class Predicate:
+    """Condition on a reading, composable with `&` and `|`.
+
+    Predicates may keep state between readings (see :class:`Consecutive`),
+    so a new predicate should be built for each wait.
+    """
+
+    def __call__(self, value: float) -> bool:
+        raise NotImplementedError(f"define __call__ in {self.__class__.__name__}")
+
+    def __and__(self, other: "Predicate") -> "Predicate":
+        return AllOf(self, other)
+
+    def __or__(self, other: "Predicate") -> "Predicate":
+        return AnyOf(self, other)
+
+
+class AbsError(Predicate):
+    """|value - target| <= max_error."""
+
+    def __init__(self, target: float, max_error: float):
+        self.target = target
+        self.max_error = max_error
+
+    def __call__(self, value: float) -> bool:
+        return abs(value - self.target) <= self.max_error
+
+
+class RelError(Predicate):
+    """|value - target| <= max_rel_error * |target|."""
+
+    def __init__(self, target: float, max_rel_error: float):
+        self.target = target
+        self.max_rel_error = max_rel_error
+
+    def __call__(self, value: float) -> bool:
+        return abs(value - self.target) <= self.max_rel_error * abs(self.target)
+
+
+class AllOf(Predicate):
+    def __init__(self, *predicates: Predicate):
+        self.predicates = predicates
+
+    def __call__(self, value: float) -> bool:
+        # evaluate all predicates, stateful ones must see every reading
+        results = [predicate(value) for predicate in self.predicates]
+        return all(results)
+
+
+class AnyOf(Predicate):
+    def __init__(self, *predicates: Predicate):
+        self.predicates = predicates
+
+    def __call__(self, value: float) -> bool:
+        results = [predicate(value) for predicate in self.predicates]
+        return any(results)
+
+
+class Consecutive(Predicate):
+    """`predicate` holds for `count` readings in a row."""
+
+    def __init__(self, predicate: Predicate, count: int):
+        self.predicate = predicate
+        self.count = count
+        self.streak = 0
+
+    def __call__(self, value: float) -> bool:
+        self.streak = self.streak + 1 if self.predicate(value) else 0
+        return self.streak >= self.count
+
+
+def tolerance(
+    target: float,
+    max_error: float,
+    max_rel_error: Optional[float] = None,
+    consecutive: int = 1,
+) -> Predicate:
+    """Predicate of the `set_voltage_and_check` tolerance fields."""
+    predicate: Predicate = AbsError(target, max_error)
+    if max_rel_error is not None:
+        predicate = predicate & RelError(target, max_rel_error)
+    if consecutive > 1:
+        predicate = Consecutive(predicate, consecutive)
+    return predicate
+
+
+class MeasurementStream:
+    """Broadcast of new readings to any number of waiters.
+
+    The producer calls :meth:`publish` for every reading; all tasks
+    waiting in :meth:`next` or :meth:`wait_for` wake up immediately.
+    Each reading is delivered as a future shared by all waiters, there is
+    no polling and no per-waiter queue.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None):
+        self.clock = clock if clock is not None else Clock()
+        self.last: Optional[float] = None
+        self.last_time: Optional[float] = None  # clock time of `last`
+        self.count = 0
+        self.__next: Optional[asyncio.Future] = None
+
+    def publish(self, value: float):
+        self.last = value
+        self.last_time = self.clock.time()
+        self.count += 1
+        future, self.__next = self.__next, None
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    async def next(self) -> float:
+        """Wait for the next reading."""
+        if self.__next is None:
+            self.__next = asyncio.get_running_loop().create_future()
+        # shield: a cancelled waiter must not cancel the future of the others
+        return await asyncio.shield(self.__next)
+
+    async def wait_for(
+        self, predicate: Callable[[float], bool], timeout: Optional[float] = None
+    ) -> float:
+        """Wait for the first new reading satisfying `predicate`.
+
+        Raises:
+            asyncio.TimeoutError: no such reading in `timeout` clock seconds.
+        """
+
+        async def wait():
+            while True:
+                value = await self.next()
+                if predicate(value):
+                    return value
+
+        return await self.clock.wait_for(wait(), timeout)
@@ -0,0 +1,204 @@
+"""Prometheus text format metrics without external dependencies.
+
+Observing a histogram is a bisect over the bucket bounds and a few
+additions, so the hot paths (GPIB calls, DB writes) can always be
+instrumented. Gauges are callbacks evaluated only when `/metrics` is
+scraped.
+
+Example:
+```python
+LATENCY = REGISTRY.histogram("hv_latency_seconds", "Latency", ("block",))
+start = time.perf_counter()
+...
+LATENCY.observe(time.perf_counter() - start, "1")
+```
+"""
+
+import asyncio
+import bisect
+import math
+import time
+from typing import Callable, Iterable, Optional
+
+# bucket bounds, sec
+FAST_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.0)
+GPIB_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# samples of a gauge callback: (label values, value)
+Samples = Iterable[tuple[tuple[str, ...], float]]
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, one series per label values."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = GPIB_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts..., +Inf count, sum]
+        self.__series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.__series.get(labels)
+        if series is None:
+            series = self.__series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def expose(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self.__series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = _labels(self.labels, labels, f'le="{_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_value(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Gauge read from `callback` at scrape time.
+
+    `callback` returns `(label values, value)` pairs.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        callback: Callable[[], Samples],
+        labels: tuple[str, ...] = (),
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.callback = callback
+
+    def expose(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.callback():
+            yield f"{self.name}{_labels(self.labels, labels)} {_value(value)}"
+
+
+class Registry:
+    """Set of metrics exposed together."""
+
+    def __init__(self):
+        self.metrics: dict[str, Histogram | Gauge] = {}
+
+    def __add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric '{metric.name}' is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = GPIB_BUCKETS,
+    ) -> Histogram:
+        return self.__add(Histogram(name, description, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        callback: Callable[[], Samples],
+        labels: tuple[str, ...] = (),
+    ) -> Gauge:
+        """Register a gauge (replaces a gauge with the same name)."""
+        self.metrics.pop(name, None)
+        return self.__add(Gauge(name, description, callback, labels))
+
+    def expose(self) -> str:
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+GPIB_LATENCY = REGISTRY.histogram(
+    "hv_gpib_latency_seconds",
+    "Duration of the instrument transactions",
+    ("block", "operation"),
+)
+COMMAND_DURATION = REGISTRY.histogram(
+    "hv_command_duration_seconds",
+    "Execution time of the commands",
+    ("block", "command_type"),
+    SLOW_BUCKETS,
+)
+SETTLE_TIME = REGISTRY.histogram(
+    "hv_settle_time_seconds",
+    "Time from setting the voltage until it settled (clock seconds)",
+    ("block", "criterion"),
+    SLOW_BUCKETS,
+)
+DB_WRITE_LATENCY = REGISTRY.histogram(
+    "hv_db_write_latency_seconds",
+    "Duration of DailyTsvWriter.write",
+    ("sensor",),
+    FAST_BUCKETS,
+)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a periodic sleep.
+
+    Args:
+        interval: sleep period, sec.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.__task: Optional[asyncio.Task] = None
+
+    async def __run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
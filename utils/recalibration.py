@@ -0,0 +1,218 @@
+"""Online estimation of the HV scaling coefficients."""
+
+import json
+import math
+import os
+import threading
+from logging import getLogger
+from typing import Optional
+
+from config import (
+    LOGGER_NAME,
+    SCALING_FORGETTING,
+    SCALING_GATE,
+    SCALING_MEASUREMENT_STD,
+    SCALING_PRIOR_STD,
+)
+
+_logger = getLogger(LOGGER_NAME)
+
+
+class ScalingEstimator:
+    """Recursive least squares fit of `HV = A * output + B` with forgetting.
+
+    Each settled point (calibrator output, measured HV) updates the
+    coefficients and their covariance; the covariance is inflated by
+    `1 / forgetting` per point, so old points are gradually forgotten and
+    the estimate follows the drift between calibrations. Points with a
+    residual larger than `gate` sigmas are rejected (e.g. the supply tripped).
+
+    Inflating the covariance in all directions winds it up when the points
+    do not excite both coefficients (e.g. all at one setpoint), so the
+    covariance is scaled down whenever a variance exceeds its prior value;
+    a degenerate covariance is reset to the prior.
+
+    The state is read back from `state_path` on start, the config
+    coefficients are only the initial estimate. `update` changes the state
+    in memory only; :meth:`save` writes a :meth:`snapshot` to the file and
+    blocks, so on the event loop it runs in a thread.
+
+    Args:
+        a, b: initial coefficients.
+        forgetting: weight of the previous points per new point.
+        prior_std: initial standard deviations of A and B.
+        measurement_std: standard deviation of a settled HV level, V.
+        gate: rejection threshold, sigmas of the predicted residual.
+        state_path: JSON state file, None - do not persist.
+    """
+
+    def __init__(
+        self,
+        a: float,
+        b: float,
+        forgetting: float = SCALING_FORGETTING,
+        prior_std: tuple[float, float] = SCALING_PRIOR_STD,
+        measurement_std: float = SCALING_MEASUREMENT_STD,
+        gate: float = SCALING_GATE,
+        state_path: Optional[str] = None,
+    ):
+        if not 0 < forgetting <= 1:
+            raise ValueError(f"forgetting must be in (0, 1], got {forgetting}")
+        self.forgetting = forgetting
+        self.measurement_std = measurement_std
+        self.gate = gate
+        self.state_path = state_path
+
+        self.a, self.b = a, b
+        self.__prior_cov = [[prior_std[0] ** 2, 0.0], [0.0, prior_std[1] ** 2]]
+        self.__cov = [list(row) for row in self.__prior_cov]
+        self.updates = 0
+        self.rejected = 0
+        # saves may run in threads: the file gets the newest snapshot
+        self.__save_lock = threading.Lock()
+        self.__saved = -1
+        self.__load()
+
+    @property
+    def coefficients(self) -> tuple[float, float]:
+        return self.a, self.b
+
+    @property
+    def uncertainty(self) -> tuple[float, float]:
+        """Standard deviations of A and B."""
+        return math.sqrt(self.__cov[0][0]), math.sqrt(self.__cov[1][1])
+
+    def predict_std(self, output: float) -> float:
+        """Standard deviation of the predicted HV at calibrator `output`, V."""
+        (paa, pab), (_, pbb) = self.__cov
+        return math.sqrt(output * output * paa + 2 * output * pab + pbb)
+
+    def update(self, output: float, voltage: float, noise: float = 0.0) -> bool:
+        """Add a settled point.
+
+        Args:
+            output: calibrator output, V.
+            voltage: settled HV level, V.
+            noise: standard deviation of `voltage` on top of `measurement_std`.
+
+        Returns:
+            False if the point was rejected by the gate.
+        """
+        (paa, pab), (_, pbb) = self.__cov
+        # P @ x for x = (output, 1)
+        pxa, pxb = paa * output + pab, pab * output + pbb
+        variance = self.measurement_std**2 + noise**2
+        innovation_var = output * pxa + pxb + variance
+        if not math.isfinite(innovation_var) or innovation_var <= 0:
+            _logger.error("scaling covariance is degenerate, reset to the prior")
+            self.__cov = [list(row) for row in self.__prior_cov]
+            (paa, pab), (_, pbb) = self.__cov
+            pxa, pxb = paa * output + pab, pab * output + pbb
+            innovation_var = output * pxa + pxb + variance
+        residual = voltage - (self.a * output + self.b)
+        if abs(residual) > self.gate * math.sqrt(innovation_var):
+            self.rejected += 1
+            _logger.warning(
+                "scaling point (%g V -> %g V) rejected, residual %.3g V",
+                output,
+                voltage,
+                residual,
+            )
+            return False
+
+        gain_a, gain_b = pxa / innovation_var, pxb / innovation_var
+        self.a += gain_a * residual
+        self.b += gain_b * residual
+        # P = (P - K x^T P) / forgetting
+        self.__cov = [
+            [(paa - gain_a * pxa), (pab - gain_a * pxb)],
+            [(pab - gain_b * pxa), (pbb - gain_b * pxb)],
+        ]
+        self.__cov = [[v / self.forgetting for v in row] for row in self.__cov]
+        self.__bound_covariance()
+        self.updates += 1
+        return True
+
+    def __bound_covariance(self):
+        """Scale the covariance down so that no variance exceeds the prior."""
+        scale = min(
+            1.0,
+            self.__prior_cov[0][0] / self.__cov[0][0],
+            self.__prior_cov[1][1] / self.__cov[1][1],
+        )
+        if scale < 1.0:
+            self.__cov = [[v * scale for v in row] for row in self.__cov]
+
+    def state(self) -> dict:
+        a_std, b_std = self.uncertainty
+        return dict(
+            a=self.a,
+            b=self.b,
+            a_std=a_std,
+            b_std=b_std,
+            updates=self.updates,
+            rejected=self.rejected,
+        )
+
+    def __load(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+            a, b = float(state["a"]), float(state["b"])
+            cov = [[float(v) for v in row] for row in state["cov"]]
+            (paa, pab), (_, pbb) = cov
+            if not (math.isfinite(a) and math.isfinite(b)):
+                raise ValueError(f"coefficients {a}, {b} are not finite")
+            if not (paa > 0 and pbb > 0 and pab * pab < paa * pbb):
+                raise ValueError(f"covariance {cov} is not positive definite")
+            self.a, self.b = a, b
+            self.__cov = cov
+            self.__bound_covariance()
+            self.updates = int(state.get("updates", 0))
+            self.rejected = int(state.get("rejected", 0))
+            _logger.info(
+                "scaling state loaded from %s: A = %.4f, B = %.4f (%d updates)",
+                self.state_path,
+                self.a,
+                self.b,
+                self.updates,
+            )
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            _logger.error("ignore broken scaling state %s: %r", self.state_path, exc)
+
+    def snapshot(self) -> dict:
+        """Copy of the persisted state, to be passed to :meth:`save`."""
+        return dict(
+            a=self.a,
+            b=self.b,
+            cov=[list(row) for row in self.__cov],
+            updates=self.updates,
+            rejected=self.rejected,
+        )
+
+    def save(self, snapshot: Optional[dict] = None):
+        """Write `snapshot` (default - the current state) to `state_path`.
+
+        Blocking file I/O, safe to call from several threads: a snapshot
+        older than the one already written is skipped.
+        """
+        if self.state_path is None:
+            return
+        if snapshot is None:
+            snapshot = self.snapshot()
+        points = snapshot["updates"] + snapshot["rejected"]
+        tmp_path = self.state_path + ".tmp"
+        with self.__save_lock:
+            if points <= self.__saved:
+                return
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    json.dump(snapshot, file)
+                os.replace(tmp_path, self.state_path)
+                self.__saved = points
+            except OSError as exc:
+                _logger.error(
+                    "couldn't save scaling state %s: %r", self.state_path, exc
+                )
@@ -0,0 +1,186 @@
+"""In-memory history of the recent readings and command answers.
+
+The readings are kept in preallocated numpy arrays used as a ring, so
+appending a reading never allocates and a snapshot of the last hours is
+two slice copies. A newly connected client gets the recent history as one
+`snapshot` reply instead of reading the daily files (see
+:func:`snapshot_reply`).
+"""
+
+import math
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+class SampleRing:
+    """Fixed-size ring of `(time, value)` pairs, the oldest pairs are overwritten.
+
+    Times are UNIX time, sec; they never decrease (a reading taken after the
+    clock was turned back gets the time of the previous reading), so the
+    ring can be searched by time.
+
+    Args:
+        capacity: number of pairs kept.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.__times = np.empty(capacity, dtype=np.float64)
+        self.__values = np.empty(capacity, dtype=np.float64)
+        # index of the next pair, total number of appended pairs
+        self.__head = 0
+        self.__count = 0
+
+    def __len__(self) -> int:
+        return min(self.__count, self.capacity)
+
+    def append(self, timestamp: float, value: float):
+        if self.__count:
+            timestamp = max(timestamp, self.__times[self.__head - 1])
+        self.__times[self.__head] = timestamp
+        self.__values[self.__head] = value
+        self.__head = (self.__head + 1) % self.capacity
+        self.__count += 1
+
+    @property
+    def oldest(self) -> Optional[float]:
+        """Time of the oldest pair kept (None - the ring is empty)."""
+        if not self.__count:
+            return None
+        return float(self.__times[self.__head if self.__count > self.capacity else 0])
+
+    def latest(self) -> Optional[tuple[float, float]]:
+        """The last pair (None - the ring is empty)."""
+        if not self.__count:
+            return None
+        last = self.__head - 1
+        return float(self.__times[last]), float(self.__values[last])
+
+    def snapshot(
+        self, since: float = -math.inf, until: float = math.inf
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Copies of the times and values in `[since, until)`, oldest first."""
+        if self.__count > self.capacity:
+            times = np.concatenate(
+                (self.__times[self.__head :], self.__times[: self.__head])
+            )
+            values = np.concatenate(
+                (self.__values[self.__head :], self.__values[: self.__head])
+            )
+        else:
+            times = self.__times[: self.__count]
+            values = self.__values[: self.__count]
+        start, stop = np.searchsorted(times, (since, until), side="left")
+        return times[start:stop].copy(), values[start:stop].copy()
+
+
+class History:
+    """Recent readings and command answers of one block.
+
+    Args:
+        block: block name.
+        sensor: DB sensor name of the block readings.
+        hours: readings kept at least for `hours` if they come not more
+            often than every `min_interval` sec.
+        min_interval: shortest expected period of the readings, sec.
+        answers: number of the command answers kept.
+    """
+
+    def __init__(
+        self,
+        block: str,
+        sensor: str,
+        hours: float,
+        min_interval: float,
+        answers: int,
+    ):
+        self.block = block
+        self.sensor = sensor
+        self.samples = SampleRing(math.ceil(hours * 3600 / min_interval))
+        self.answers: deque[dict] = deque(maxlen=answers)
+
+    def add_reading(self, voltage: float, timestamp: Optional[float] = None):
+        self.samples.append(time.time() if timestamp is None else timestamp, voltage)
+
+    def add_answer(self, meta: dict, timestamp: Optional[float] = None):
+        answer = dict(meta)
+        answer.setdefault("time", time.time() if timestamp is None else timestamp)
+        self.answers.append(answer)
+
+    def latest(self) -> Optional[dict]:
+        """The last reading as `{"time": ..., "voltage": ...}`."""
+        latest = self.samples.latest()
+        if latest is None:
+            return None
+        return dict(time=latest[0], voltage=latest[1])
+
+
+def parse_snapshot_request(meta: dict) -> tuple[Optional[float], bool, str]:
+    """Window (sec), answers flag and format of a `snapshot` message.
+
+    Raises:
+        ValueError: invalid message.
+    """
+    seconds = meta.get("seconds")
+    if seconds is not None and (
+        isinstance(seconds, bool)
+        or not isinstance(seconds, (int, float))
+        or seconds <= 0
+    ):
+        raise ValueError("'seconds' must be a positive number")
+    answers = meta.get("answers", True)
+    if not isinstance(answers, bool):
+        raise ValueError("'answers' must be a boolean")
+    fmt = meta.get("format", "json")
+    if fmt not in ("json", "binary"):
+        raise ValueError("'format' must be 'json' or 'binary'")
+    return seconds, answers, fmt
+
+
+def snapshot_reply(histories: Iterable[History], meta: dict) -> tuple[dict, bytes]:
+    """Reply to a `snapshot` message: the recent history in one batch.
+
+    The history of all blocks is sent unless the message has a `block`.
+
+    In the `json` format the readings are lists `time` and `voltage` of each
+    block; in the `binary` format they are float64 little-endian columns in
+    the message data, block after block, time column first, block sizes are
+    in `count`.
+
+    Raises:
+        ValueError: invalid message.
+    """
+    seconds, with_answers, fmt = parse_snapshot_request(meta)
+    if meta.get("block") is not None:
+        histories = [
+            history for history in histories if history.block == str(meta["block"])
+        ]
+        if not histories:
+            raise ValueError(f"unknown block {meta['block']!r}")
+    since = time.time() - seconds if seconds is not None else -math.inf
+    blocks = {}
+    chunks = []
+    for history in histories:
+        times, voltages = history.samples.snapshot(since)
+        block = dict(count=len(times), latest=history.latest())
+        if fmt == "binary":
+            chunks.append(times.astype("<f8").tobytes())
+            chunks.append(voltages.astype("<f8").tobytes())
+        else:
+            block.update(time=times.tolist(), voltage=voltages.tolist())
+        if with_answers:
+            block["answers"] = [
+                answer for answer in history.answers if answer["time"] >= since
+            ]
+        blocks[history.block] = block
+    reply = dict(type="reply", reply_type="snapshot", format=fmt, blocks=blocks)
+    if fmt == "binary":
+        reply["columns"] = ["time", "voltage"]
+    if "request_id" in meta:
+        reply["request_id"] = meta["request_id"]
+    return reply, b"".join(chunks)
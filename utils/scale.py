@@ -4,6 +4,16 @@ from config import HV_SCALING_COEFFICIENT_A as A
 from config import HV_SCALING_COEFFICIENT_B as B
 
 
-def rescale_voltage(voltage: float):
+# range of the FuG 3500 input (calibrator output), V
+OUTPUT_MIN = 0.0
+OUTPUT_MAX = 10.0
+
+
+def clamp_output(output: float) -> float:
+    """Limit the calibrator output to the FuG 3500 input range."""
+    return min(OUTPUT_MAX, max(OUTPUT_MIN, output))
+
+
+def rescale_voltage(voltage: float, a: float = A, b: float = B):
     """Calculate FuG 3500 input voltage."""
-    return min(10.0, max(0.0, (voltage - B) / A))
+    return clamp_output((voltage - b) / a)
@@ -0,0 +1,129 @@
+"""Command queue for hardware managers."""
+
+import asyncio
+import heapq
+import itertools
+from typing import Awaitable, Callable
+
+from config import COMMAND_COALESCE_SET_VOLTAGE, COMMAND_QUEUE_SIZE
+from utils.commands import Command
+
+# commands which make all queued commands of these types obsolete
+SUPERSEDING_COMMANDS = ("set_voltage", "set_voltage_and_check")
+
+
+class QueueFullError(Exception):
+    """Command can't be accepted: the queue is full (or busy in legacy mode)."""
+
+
+class CommandScheduler:
+    """Bounded priority queue of commands executed one at a time.
+
+    Up to `maxsize` commands wait while another one is running. Commands
+    with higher `priority` (default 0) run first, commands with equal
+    priority run in FIFO order. With `maxsize == 0` no command can
+    wait in the queue, which reproduces the legacy SERVER_BUSY_ERROR
+    behaviour. With `coalesce` a new `set_voltage*` command replaces all
+    queued `set_voltage*` commands.
+
+    Args:
+        execute: coroutine function executing one command.
+        on_cancel: called with (command, status) for commands that will never
+            finish normally; status is "aborted" or "superseded".
+        on_error: called with (command, exception) if the command failed.
+    """
+
+    def __init__(
+        self,
+        execute: Callable[[Command], Awaitable],
+        on_cancel: Callable[[Command, str], None],
+        on_error: Callable[[Command, Exception], None],
+        maxsize: int = COMMAND_QUEUE_SIZE,
+        coalesce: bool = COMMAND_COALESCE_SET_VOLTAGE,
+    ):
+        self.__execute = execute
+        self.__on_cancel = on_cancel
+        self.__on_error = on_error
+        self.maxsize = maxsize
+        self.coalesce = coalesce
+
+        self.__queue: list[tuple[int, int, Command]] = []
+        self.__order = itertools.count()
+        self.__ready = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+        self.running: Command | None = None
+
+    def qsize(self) -> int:
+        return len(self.__queue)
+
+    def submit(self, command: Command):
+        """Put the command into the queue.
+
+        Raises:
+            QueueFullError: the command can't be accepted now.
+        """
+        if self.coalesce and command.command_type in SUPERSEDING_COMMANDS:
+            superseded = [
+                item
+                for item in self.__queue
+                if item[2].command_type in SUPERSEDING_COMMANDS
+            ]
+            if superseded:
+                self.__queue = [item for item in self.__queue if item not in superseded]
+                heapq.heapify(self.__queue)
+                for _, _, old_command in superseded:
+                    self.__on_cancel(old_command, "superseded")
+
+        idle = self.running is None and not self.__queue
+        if not idle and len(self.__queue) >= self.maxsize:
+            raise QueueFullError(
+                f"command queue is full ({self.maxsize} commands)"
+                if self.maxsize
+                else "HV server is busy"
+            )
+
+        heapq.heappush(
+            self.__queue, (-command.priority, next(self.__order), command)
+        )
+        self.__ready.set()
+
+    def abort(self) -> int:
+        """Cancel the running command and drop the queue.
+
+        Returns:
+            number of aborted commands.
+        """
+        queued = [command for _, _, command in sorted(self.__queue)]
+        self.__queue.clear()
+        for command in queued:
+            self.__on_cancel(command, "aborted")
+        aborted = len(queued)
+        if self.__task is not None and not self.__task.done():
+            self.__task.cancel()
+            aborted += 1
+        return aborted
+
+    async def run(self):
+        """Execute queued commands until cancelled."""
+        while True:
+            while not self.__queue:
+                self.__ready.clear()
+                await self.__ready.wait()
+            _, _, command = heapq.heappop(self.__queue)
+
+            self.running = command
+            self.__task = asyncio.create_task(self.__execute(command))
+            try:
+                await asyncio.shield(self.__task)
+            except asyncio.CancelledError as exc:
+                if not self.__task.cancelled():
+                    # the scheduler itself is cancelled, stop the command too
+                    self.__task.cancel()
+                    raise exc
+                self.__on_cancel(command, "aborted")
+            # pylint: disable-next=broad-except
+            except Exception as exc:
+                self.__on_error(command, exc)
+            finally:
+                self.running = None
+                self.__task = None
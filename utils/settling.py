@@ -0,0 +1,232 @@
+"""Statistical detection of the voltage settling after a setpoint change."""
+
+import math
+import statistics
+import time
+from collections import deque
+from typing import Optional
+
+from config import SETTLE_CONFIDENCE, SETTLE_MIN_SAMPLES, SETTLE_WINDOW
+from utils.measurements import Predicate
+
+
+class SettlingDetector:
+    """Rolling window of readings taken after a setpoint change.
+
+    Each :meth:`add` refits the first order approach
+    `V(t) = V_inf + (V_0 - V_inf) * exp(-t / tau)` and decides whether
+    the voltage is stable.
+
+    The fit regresses each reading on the previous one
+    (`v[k+1] = a * v[k] + b`, `a = exp(-dt / tau)`, `V_inf = b / (1 - a)`),
+    which needs no initial guess and is exact for evenly spaced readings.
+    From it the detector predicts when the error drops below `max_error`.
+
+    The voltage is stable when the last `min_samples` readings satisfy
+    `|mean - target| + confidence * std / sqrt(n) <= max_error` and their
+    linear trend is not significant at the same `confidence`, so neither
+    a single lucky sample nor a slow approach through the tolerance band
+    is accepted. `steady` is the trend test alone: the voltage stopped
+    moving, whether or not it is within `max_error` of the target. A line
+    fits the curved approach tail badly, so its slope is insignificant
+    there; the trend test therefore also requires the exponential approach
+    fitted to the last `min_samples` readings to have reached its
+    asymptote within the noise.
+
+    Args:
+        target: setpoint, V.
+        max_error: allowed deviation, V.
+        start: time of the setpoint change (`time.monotonic()` by default).
+    """
+
+    def __init__(
+        self,
+        target: float,
+        max_error: float,
+        window: int = SETTLE_WINDOW,
+        min_samples: int = SETTLE_MIN_SAMPLES,
+        confidence: float = SETTLE_CONFIDENCE,
+        start: Optional[float] = None,
+    ):
+        self.target = target
+        self.max_error = max_error
+        self.min_samples = max(2, min_samples)
+        self.confidence = confidence
+        self.start = time.monotonic() if start is None else start
+
+        self.__times: deque[float] = deque(maxlen=max(window, self.min_samples))
+        self.__values: deque[float] = deque(maxlen=max(window, self.min_samples))
+
+        self.stable = False
+        self.steady = False
+        # time from `start` to the first stable reading, sec
+        self.settle_time: Optional[float] = None
+        # fitted time constant, sec (0 - no trend), and asymptotic voltage, V
+        self.tau: Optional[float] = None
+        self.asymptote: Optional[float] = None
+        # predicted time from `start` to |V - target| <= max_error, sec
+        self.predicted_settle_time: Optional[float] = None
+
+    @property
+    def noise(self) -> Optional[float]:
+        """Noise of the last `min_samples` readings, V.
+
+        Estimated from the residuals of the exponential approach fitted to
+        them, so the approach tail is not counted as noise; the standard
+        deviation of the readings if they are only noise.
+        """
+        values = list(self.__values)[-self.min_samples :]
+        if len(values) < 2:
+            return None
+        tail = self.__tail_fit(values, self.confidence)
+        if tail is None:
+            return statistics.stdev(values)
+        return tail[1]
+
+    @property
+    def level(self) -> Optional[float]:
+        """Mean of the last `min_samples` readings, V."""
+        values = list(self.__values)[-self.min_samples :]
+        if not values:
+            return None
+        return statistics.fmean(values)
+
+    def add(self, value: float, now: Optional[float] = None) -> bool:
+        """Add a reading, returns True if the voltage is stable."""
+        self.__times.append(time.monotonic() if now is None else now)
+        self.__values.append(value)
+        self.__fit()
+        self.steady = self.__is_steady()
+        self.stable = self.steady and self.__in_tolerance()
+        if self.stable and self.settle_time is None:
+            self.settle_time = self.__times[-1] - self.start
+        return self.stable
+
+    def __fit(self):
+        values = list(self.__values)
+        if len(values) < 3:
+            return
+        times = self.__times
+        step = (times[-1] - times[0]) / (len(times) - 1)
+
+        prev, curr = values[:-1], values[1:]
+        prev_mean, curr_mean = statistics.fmean(prev), statistics.fmean(curr)
+        var = sum((x - prev_mean) ** 2 for x in prev)
+        cov = sum((x - prev_mean) * (y - curr_mean) for x, y in zip(prev, curr))
+        if var == 0 or cov / var <= 0:
+            # no correlation between readings: only noise around the asymptote
+            self.tau, self.asymptote = 0.0, statistics.fmean(values)
+        elif cov / var >= 1:
+            # linear ramp (slew rate limited), the asymptote is unknown yet
+            self.tau = self.asymptote = self.predicted_settle_time = None
+            return
+        else:
+            a = cov / var
+            self.tau = -step / math.log(a)
+            self.asymptote = (curr_mean - a * prev_mean) / (1 - a)
+
+        margin = self.max_error - abs(self.asymptote - self.target)
+        if margin <= 0:
+            self.predicted_settle_time = None  # never gets into the tolerance
+            return
+        deviation = abs(values[-1] - self.asymptote)
+        remaining = 0.0
+        if deviation > margin and self.tau > 0:
+            remaining = self.tau * math.log(deviation / margin)
+        self.predicted_settle_time = times[-1] - self.start + remaining
+
+    def __in_tolerance(self) -> bool:
+        values = list(self.__values)[-self.min_samples :]
+        mean = statistics.fmean(values)
+        std = statistics.stdev(values)
+        return (
+            abs(mean - self.target) + self.confidence * std / math.sqrt(len(values))
+            <= self.max_error
+        )
+
+    def __is_steady(self) -> bool:
+        if len(self.__values) < self.min_samples:
+            return False
+        times = list(self.__times)[-self.min_samples :]
+        values = list(self.__values)[-self.min_samples :]
+        mean = statistics.fmean(values)
+
+        time_mean = statistics.fmean(times)
+        sxx = sum((t - time_mean) ** 2 for t in times)
+        if sxx == 0:
+            return True
+        slope = sum((t - time_mean) * (v - mean) for t, v in zip(times, values)) / sxx
+        # standard error of the slope from the residuals of the linear fit
+        # (the spread of the values themselves includes the trend)
+        residuals = sum(
+            (v - mean - slope * (t - time_mean)) ** 2 for t, v in zip(times, values)
+        )
+        stderr = math.sqrt(residuals / (len(values) - 2) / sxx) if len(values) > 2 else 0
+        if abs(slope) > self.confidence * stderr:
+            return False
+        # the residuals of a line are large on the curved approach tail, so the
+        # slope test alone passes there; the transient is over only when an
+        # exponential approach fitted to the same readings reached its
+        # asymptote within the noise
+        tail = self.__tail_fit(values, self.confidence)
+        if tail is None:
+            return True
+        asymptote, noise = tail
+        return abs(mean - asymptote) <= self.confidence * noise / math.sqrt(len(values))
+
+    @staticmethod
+    def __tail_fit(
+        values: list[float], confidence: float
+    ) -> Optional[tuple[float, float]]:
+        """Asymptote and noise of `v[k+1] = a * v[k] + b` fitted to `values`.
+
+        Returns:
+            `(asymptote, noise)`, asymptote is `inf` if the readings do not
+            approach a level (ramp or drift), None if there is no exponential
+            component significant at `confidence` (the readings are only noise).
+        """
+        if len(values) < 4:
+            return None
+        prev, curr = values[:-1], values[1:]
+        prev_mean, curr_mean = statistics.fmean(prev), statistics.fmean(curr)
+        var = sum((x - prev_mean) ** 2 for x in prev)
+        cov = sum((x - prev_mean) * (y - curr_mean) for x, y in zip(prev, curr))
+        if var == 0 or cov <= 0:
+            return None
+        a = cov / var
+        b = curr_mean - a * prev_mean
+        residuals = sum((y - a * x - b) ** 2 for x, y in zip(prev, curr))
+        residual_var = residuals / (len(prev) - 2)
+        if a * a * var <= confidence**2 * residual_var:
+            return None  # `a` is not significant: noise only
+        # a residual is `n[k+1] - a * n[k]` of the reading noise `n`
+        noise = math.sqrt(residual_var / (1 + a * a))
+        if a >= 1:
+            return math.inf, noise
+        return b / (1 - a), noise
+
+
+def settle_error(
+    target: float, max_error: float, max_rel_error: Optional[float] = None
+) -> float:
+    """Allowed deviation of the level meeting both `max_error` and `max_rel_error`."""
+    if max_rel_error is None:
+        return max_error
+    return min(max_error, max_rel_error * abs(target))
+
+
+class Stable(Predicate):
+    """The "statistical" criterion: `detector` is stable for `count` readings in a row.
+
+    The readings are added to the detector by the caller before the
+    predicate is called with them.
+    """
+
+    def __init__(self, detector: SettlingDetector, count: int = 1):
+        self.detector = detector
+        self.count = count
+        self.streak = 0
+
+    def __call__(self, value: float) -> bool:
+        self.streak = self.streak + 1 if self.detector.stable else 0
+        return self.streak >= self.count
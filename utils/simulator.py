@@ -0,0 +1,117 @@
+"""Simulator of the HV rack (calibrator + FuG supply + divider + voltmeter)."""
+
+import bisect
+import math
+import random
+from typing import Optional
+
+from config import (
+    VIRTUAL_CHANGE_SPEED,
+    VIRTUAL_DRIFT,
+    VIRTUAL_INTEGRATION_TIME,
+    VIRTUAL_NOISE,
+    VIRTUAL_SEED,
+    VIRTUAL_SETTLING_TAU,
+)
+from utils.clock import Clock
+
+# number of points averaged over the integration time of one reading
+INTEGRATION_POINTS = 16
+
+
+def step_response(
+    dt: float, start: float, target: float, slew_rate: float, tau: float
+) -> float:
+    """Output voltage `dt` seconds after the setpoint changed from `start` to `target`.
+
+    The output follows `dV/dt = clip((target - V) / tau, -slew_rate, slew_rate)`:
+    a linear ramp while the error is larger than `slew_rate * tau`, then
+    a first order (exponential) approach.
+    """
+    if dt <= 0:
+        return start
+    error = target - start
+    sign = 1.0 if error >= 0 else -1.0
+    if tau <= 0:
+        return start + sign * min(abs(error), slew_rate * dt)
+    knee = slew_rate * tau  # error at which the ramp turns into the exponent
+    ramp_time = max(0.0, (abs(error) - knee) / slew_rate)
+    if dt <= ramp_time:
+        return start + sign * slew_rate * dt
+    return target - sign * min(abs(error), knee) * math.exp(-(dt - ramp_time) / tau)
+
+
+class HvSimulator:
+    """Time-driven model of the rack in HV volts.
+
+    The output voltage follows :func:`step_response` after each setpoint
+    change, drifts linearly by `drift` (relative units per hour) and each
+    reading is the mean of the output over `integration_time` plus Gaussian
+    noise with `noise` standard deviation. Everything runs on `clock`, so
+    with :class:`utils.clock.ScaledClock` hours of operation take seconds.
+
+    The default parameters are fitted from `calibration-data/` by
+    `calibration/fit_simulator.py`.
+    """
+
+    def __init__(
+        self,
+        clock: Clock,
+        slew_rate: float = VIRTUAL_CHANGE_SPEED,
+        tau: float = VIRTUAL_SETTLING_TAU,
+        noise: float = VIRTUAL_NOISE,
+        drift: float = VIRTUAL_DRIFT,
+        integration_time: float = VIRTUAL_INTEGRATION_TIME,
+        seed: Optional[int] = VIRTUAL_SEED,
+    ):
+        self.clock = clock
+        self.slew_rate = slew_rate
+        self.tau = tau
+        self.noise = noise
+        self.drift = drift
+        self.integration_time = integration_time
+        self.__random = random.Random(seed)
+        self.__start = clock.time()
+        # setpoint changes: times and (voltage at the change, target)
+        self.__times: list[float] = [self.__start]
+        self.__segments: list[tuple[float, float]] = [(0.0, 0.0)]
+
+    @property
+    def setpoint(self) -> float:
+        return self.__segments[-1][1]
+
+    def set_voltage(self, voltage: float):
+        now = self.clock.time()
+        start = self.__output(now)
+        self.__times.append(now)
+        self.__segments.append((start, voltage))
+        # keep only the history needed to average one reading
+        while len(self.__times) > 2 and self.__times[1] < now - self.integration_time:
+            del self.__times[0], self.__segments[0]
+
+    def voltage(self, at: Optional[float] = None) -> float:
+        """Noise free output voltage at clock time `at` (now by default)."""
+        at = self.clock.time() if at is None else at
+        return self.__output(at) * (1 + self.drift * (at - self.__start) / 3600)
+
+    def __output(self, at: float) -> float:
+        index = max(0, bisect.bisect_right(self.__times, at) - 1)
+        start, target = self.__segments[index]
+        return step_response(
+            at - self.__times[index], start, target, self.slew_rate, self.tau
+        )
+
+    async def read(self) -> float:
+        """Take one reading (lasts `integration_time` clock seconds)."""
+        begin = self.clock.time()
+        await self.clock.sleep(self.integration_time)
+        end = self.clock.time()
+        step = (end - begin) / INTEGRATION_POINTS
+        mean = (
+            sum(
+                self.voltage(begin + (i + 0.5) * step)
+                for i in range(INTEGRATION_POINTS)
+            )
+            / INTEGRATION_POINTS
+        )
+        return mean + self.__random.gauss(0.0, self.noise)
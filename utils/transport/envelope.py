@@ -0,0 +1,127 @@
+"""Incremental DataForge Envelope stream decoder."""
+
+import struct
+from logging import getLogger
+
+import dfparser
+
+from config import DF_MAX_MESSAGE_SIZE, LOGGER_NAME
+
+_logger = getLogger(LOGGER_NAME)
+
+# (tag, header length, meta length offset, data length offset, end tag offset, end tag)
+LEGACY_HEADER = (b"#!", 30, 14, 22, 26, b"!#\r\n")
+DF02_HEADER = (b"#~DF02", 20, 8, 12, 16, b"~#\r\n")
+_UINT = struct.Struct(">I")
+
+
+class EnvelopeTooLargeError(ValueError):
+    """Envelope declared in the stream exceeds the allowed size."""
+
+
+class EnvelopeDecoder:
+    """Incremental decoder of a DataForge Envelope byte stream.
+
+    Incoming chunks are appended to a single `bytearray`. The machine header
+    of each envelope is parsed once, after that the decoder only waits until
+    the whole envelope arrives, so the cost is linear in the stream length
+    (unlike re-scanning the whole buffer after each read). Garbage between
+    envelopes is skipped.
+
+    Example:
+    ```python
+    decoder = EnvelopeDecoder()
+    for message in decoder.feed(await reader.read(65536)):
+        ...  # {'header': dict, 'meta': dict, 'data': bytes}
+    ```
+    """
+
+    def __init__(self, max_message_size: int = DF_MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self.__buffer = bytearray()
+        # length of the envelope at the buffer start (None - header not parsed yet)
+        self.__frame_len: int | None = None
+
+    def __len__(self) -> int:
+        """Number of buffered bytes."""
+        return len(self.__buffer)
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        """Add received bytes and return all envelopes completed by them.
+
+        Raises:
+            EnvelopeTooLargeError: envelope is larger than `max_message_size`.
+                The decoder can't resynchronize after it, the connection
+                should be closed.
+        """
+        buffer = self.__buffer
+        buffer.extend(chunk)
+        messages = []
+        pos = 0
+
+        while True:
+            if self.__frame_len is None:
+                pos = self.__find_header(pos)
+                if pos < 0:
+                    pos = len(buffer)  # no header start, drop the garbage
+                    break
+                header = self.__parse_header(pos)
+                if header is None:
+                    break  # header is not complete yet
+                if header == 0:
+                    pos += 1  # not a header, resynchronize
+                    continue
+                self.__frame_len = header
+                if self.__frame_len > self.max_message_size:
+                    raise EnvelopeTooLargeError(
+                        f"envelope of {self.__frame_len} bytes exceeds "
+                        f"{self.max_message_size} bytes limit"
+                    )
+
+            end = pos + self.__frame_len
+            if end > len(buffer):
+                break
+            with memoryview(buffer) as view:
+                frame = bytes(view[pos:end])
+            pos = end
+            self.__frame_len = None
+            try:
+                header, meta, data = dfparser.parse_message(frame)
+            # pylint: disable-next=broad-except
+            except Exception as exc:
+                _logger.warning("skip broken envelope: %r", exc)
+                continue
+            messages.append({"header": header, "meta": meta, "data": data})
+
+        # deleting from the bytearray start is O(1) amortized in CPython
+        del buffer[:pos]
+        return messages
+
+    def __find_header(self, pos: int) -> int:
+        """Position of the next possible header start ('#!' or '#~'), -1 if none."""
+        buffer = self.__buffer
+        while True:
+            pos = buffer.find(b"#", pos)
+            if pos < 0 or pos + 1 == len(buffer) or buffer[pos + 1] in b"!~":
+                return pos
+            pos += 1
+
+    def __parse_header(self, pos: int) -> int | None:
+        """Envelope length, 0 if there is no valid header at `pos`, None if incomplete."""
+        buffer = self.__buffer
+        for tag, header_len, meta_offset, data_offset, end_offset, end_tag in (
+            DF02_HEADER,
+            LEGACY_HEADER,
+        ):
+            if len(buffer) - pos < header_len:
+                if tag.startswith(bytes(buffer[pos : pos + len(tag)])):
+                    return None
+                continue
+            if not buffer.startswith(tag, pos):
+                continue
+            if buffer[pos + end_offset : pos + header_len] != end_tag:
+                return 0
+            meta_len = _UINT.unpack_from(buffer, pos + meta_offset)[0]
+            data_len = _UINT.unpack_from(buffer, pos + data_offset)[0]
+            return header_len + meta_len + data_len
+        return 0
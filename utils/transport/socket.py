@@ -3,10 +3,27 @@
 import asyncio
 from logging import getLogger
 
-import dfparser
-
-from config import LOGGER_NAME
+from config import DF_READ_CHUNK_SIZE, LOGGER_NAME
+from utils.hub import Message, SlowConsumerError
 from utils.manager import HardwareManager
+from utils.ringbuffer import snapshot_reply
+from utils.transport.envelope import EnvelopeDecoder, EnvelopeTooLargeError
+
+
+def __snapshot(mgr: HardwareManager, meta: dict) -> Message:
+    try:
+        return Message(*snapshot_reply(mgr.histories(), meta))
+    except ValueError as exc:
+        reply = dict(
+            type="reply",
+            reply_type="error",
+            error_code=9,
+            error_text_code="INCORRECT_MESSAGE_PARAMS",
+            description=str(exc),
+        )
+        if "request_id" in meta:
+            reply["request_id"] = meta["request_id"]
+        return Message(reply)
 
 
 async def socket_handler(
@@ -22,6 +39,9 @@ async def socket_handler(
     Функция транслирует без изменений сообщения в обе стороны
     (TCP/IP -> HardwareManager.input, HardwareManager.output -> TCP/IP)
     Для сериализации/парсинга используется формат DataForge Envelope.
+    Исключение - запрос `{"type": "snapshot"}`: история из памяти менеджера
+    (см. :func:`utils.ringbuffer.snapshot_reply`) отправляется только
+    этому клиенту.
 
     Args:
         reader (asyncio.StreamReader): стандартный аргумент для `asyncio.start_server`
@@ -33,28 +53,42 @@ async def socket_handler(
     peername = writer.get_extra_info("peername")
     log.debug("Connection from %s", peername)
 
-    subcription = asyncio.Queue()
+    subcription = mgr.output.subscribe()
 
     async def process_output():
         while True:
-            message = await subcription.get()
-            meta = message["meta"]
-            data = message["data"]
-
-            writer.write(dfparser.create_message(meta, data))
+            try:
+                message = await subcription.get()
+            except SlowConsumerError as exc:
+                log.warning("Disconnect %s: %s", peername, exc)
+                writer.close()
+                return
+            writer.write(message.dataforge())
             await writer.drain()
 
-    mgr.output.subscriptions.add(subcription)
     output_coro = asyncio.create_task(process_output())
 
-    buffer = b""
+    decoder = EnvelopeDecoder()
 
     while not writer.is_closing() and not reader.at_eof():
-        buffer += await reader.read(1024)
-        messages, buffer = dfparser.get_messages_from_stream(buffer)
+        try:
+            messages = decoder.feed(await reader.read(DF_READ_CHUNK_SIZE))
+        except EnvelopeTooLargeError as exc:
+            log.warning("Disconnect %s: %s", peername, exc)
+            writer.close()
+            break
         for message in messages:
+            meta = message["meta"]
+            if isinstance(meta, dict) and meta.get("type") == "snapshot":
+                writer.write(__snapshot(mgr, meta).dataforge())
+                continue
             await mgr.input.put(message)
 
-    log.debug("Connection from %s closed", peername)
+    log.debug(
+        "Connection from %s closed (dropped %d messages, queue high-water %d)",
+        peername,
+        subcription.dropped,
+        subcription.high_water,
+    )
     output_coro.cancel()
-    mgr.output.subscriptions.remove(subcription)
+    mgr.output.unsubscribe(subcription)
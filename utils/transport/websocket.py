@@ -1,32 +1,117 @@
 """Websocket protocol handling."""
 
 import asyncio
+import datetime
 import json
+import re
+import time
 from functools import partial
 from logging import getLogger
+from typing import Optional
 
+import numpy as np
 from aiohttp import web
 
-from config import LOGGER_NAME, WEB_INTERFACE_HOST, WEB_INTERFACE_PORT
+from config import (
+    DB_ROLLUP_TIERS,
+    HISTORY_MAX_POINTS,
+    LOGGER_NAME,
+    WEB_INTERFACE_HOST,
+    WEB_INTERFACE_PORT,
+)
+from db_columnar import count_range, read_range
+from db_rollup import count_rollup, read_rollup
+from utils.decimation import Decimator
+from utils.downsample import bucket, lttb
+from utils.hub import TOPICS, SlowConsumerError, topic_of
 from utils.manager import HardwareManager
+from utils.metrics import REGISTRY, LoopLagMonitor
+from utils.ringbuffer import History, snapshot_reply
 
 _logger = getLogger(LOGGER_NAME)
 
 
+def __parse_subscription(meta: dict) -> tuple[Optional[list[str]], Optional[float]]:
+    """Topics and decimation window of a `subscribe` message.
+
+    Raises:
+        ValueError: invalid message.
+    """
+    topics = meta.get("topics")
+    if topics is not None:
+        if not isinstance(topics, list) or not all(
+            topic in TOPICS for topic in topics
+        ):
+            raise ValueError(f"'topics' must be a list of {list(TOPICS)}")
+    window = meta.get("window")
+    max_rate = meta.get("max_rate")
+    for name, value in (("window", window), ("max_rate", max_rate)):
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0
+        ):
+            raise ValueError(f"'{name}' must be a non-negative number")
+    if window is None and max_rate:
+        window = 1 / max_rate
+    return topics, float(window) if window else None
+
+
+def __error_reply(exc: ValueError, meta: dict) -> dict:
+    reply = dict(
+        type="reply",
+        reply_type="error",
+        error_code=9,
+        error_text_code="INCORRECT_MESSAGE_PARAMS",
+        description=str(exc),
+    )
+    if "request_id" in meta:
+        reply["request_id"] = meta["request_id"]
+    return reply
+
+
 async def __websocket_handler(request, mgr: HardwareManager):
+    """Канал WebSocket.
+
+    Сообщения клиента передаются менеджеру, кроме подписки
+    `{"type": "subscribe", "topics": [...], "window": 5}`: она выбирает
+    темы (см. :func:`utils.hub.topic_of`) и окно прореживания измерений
+    в секундах (или `max_rate` - измерений в секунду на блок), измерения
+    за окно агрегируются :class:`utils.decimation.Decimator`; и запроса
+    истории из памяти `{"type": "snapshot", "seconds": 600}`, ответ на него
+    получает только этот клиент (в формате `binary` колонки приходят
+    следующим бинарным сообщением).
+    """
     ws_res = web.WebSocketResponse()
     await ws_res.prepare(request)
 
-    subcription = asyncio.Queue()
+    subcription = mgr.output.subscribe()
+    decimator: Optional[Decimator] = None
 
     async def process_output():
         while True:
             try:
-                message = await subcription.get()
-                meta = message["meta"]
-                await ws_res.send_str(json.dumps(meta))
+                # подписка может смениться во время ожидания, по таймауту
+                # сбрасывается окно того прореживателя, чей срок истек
+                waiting = decimator
+                timeout = None
+                if waiting is not None and waiting.deadline is not None:
+                    timeout = max(0.0, waiting.deadline - time.monotonic())
+                try:
+                    message = await asyncio.wait_for(subcription.get(), timeout)
+                except asyncio.TimeoutError:
+                    if waiting is not None:
+                        for meta in waiting.flush():
+                            await ws_res.send_str(json.dumps(meta))
+                    continue
+                if decimator is not None and topic_of(message.meta) == "get_voltage":
+                    decimator.add(message.meta)
+                    continue
+                await ws_res.send_str(message.json())
             except asyncio.CancelledError as exc:
                 raise exc
+            except SlowConsumerError as exc:
+                _logger.warning("disconnect websocket client: %s", exc)
+                await ws_res.close()
+                return
             except RuntimeError as exc:
                 if exc.args[0] == "Event loop is closed":
                     return
@@ -36,30 +121,307 @@ async def __websocket_handler(request, mgr: HardwareManager):
             except Exception as exc:
                 _logger.exception(exc)
 
-    mgr.output.subscriptions.add(subcription)
     output_coro = asyncio.create_task(process_output())
 
     async for msg in ws_res:
         if msg.type == web.WSMsgType.TEXT:
             meta = json.loads(msg.data)
             _logger.debug("ws > %s", meta)
+            if isinstance(meta, dict) and meta.get("type") == "snapshot":
+                try:
+                    reply, data = snapshot_reply(mgr.histories(), meta)
+                except ValueError as exc:
+                    await ws_res.send_json(__error_reply(exc, meta))
+                    continue
+                await ws_res.send_str(json.dumps(reply, separators=(",", ":")))
+                if data:
+                    await ws_res.send_bytes(data)
+                continue
+            if isinstance(meta, dict) and meta.get("type") == "subscribe":
+                try:
+                    topics, window = __parse_subscription(meta)
+                except ValueError as exc:
+                    await ws_res.send_json(__error_reply(exc, meta))
+                    continue
+                mgr.output.set_topics(subcription, topics)
+                previous = decimator
+                decimator = Decimator(window) if window else None
+                # агрегаты незавершенного окна прежней подписки не теряются
+                if previous is not None:
+                    for pending in previous.flush():
+                        await ws_res.send_str(json.dumps(pending))
+                await ws_res.send_json(
+                    dict(
+                        type="reply",
+                        reply_type="subscribed",
+                        topics=sorted(subcription.topics),
+                        window=window,
+                    )
+                )
+                continue
             await mgr.input.put(dict(meta=meta, data=b""))
         elif msg.type == web.WSMsgType.BINARY:
             raise NotImplementedError("binary type is not supported")
         elif msg.type == web.WSMsgType.ERROR:
             _logger.error("ws connection closed with exception %s", ws_res.exception())
 
-    _logger.info("websocket connection closed")
+    _logger.info(
+        "websocket connection closed (dropped %d messages, queue high-water %d)",
+        subcription.dropped,
+        subcription.high_water,
+    )
     output_coro.cancel()
-    mgr.output.subscriptions.remove(subcription)
+    mgr.output.unsubscribe(subcription)
 
     return ws_res
 
 
+def __parse_time(value: str) -> datetime.datetime:
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value)
+    try:
+        return datetime.datetime.fromtimestamp(timestamp)
+    except (OverflowError, OSError) as exc:
+        raise ValueError(f"timestamp {value} is out of range") from exc
+
+
+def __read_history(
+    sensor: str,
+    start: datetime.datetime,
+    stop: datetime.datetime,
+    history: Optional[History],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Интервал из буфера в памяти, если буфер его покрывает, иначе из файлов БД."""
+    oldest = history.samples.oldest if history is not None else None
+    if oldest is not None and oldest <= start.timestamp():
+        times, values = history.samples.snapshot(  # type: ignore
+            start.timestamp(), stop.timestamp()
+        )
+        # в БД значения записываются с точностью до 0.01
+        return times, np.round(values, 2)
+    return read_range(sensor, start, stop)
+
+
+def __rollup_tier(start: datetime.datetime, stop: datetime.datetime, points: int):
+    """Самый мелкий уровень агрегатов, дающий не больше `points` строк."""
+    tiers = sorted(DB_ROLLUP_TIERS)
+    span = (stop - start).total_seconds()
+    return next((tier for tier in tiers if span / tier <= points), tiers[-1])
+
+
+def __count_rows(sensor, start, stop, method, history, tier) -> int:
+    """Оценка числа строк ответа `raw`/`rollup` без чтения данных."""
+    if method == "rollup":
+        return count_rollup(sensor, tier, start, stop)
+    oldest = history.samples.oldest if history is not None else None
+    if oldest is not None and oldest <= start.timestamp():
+        # буфер в памяти ограничен, его срез проверяется после чтения
+        return 0
+    return count_range(sensor, start, stop)
+
+
+def __query_history(
+    sensor, start, stop, method, points, history, tier
+) -> dict[str, np.ndarray]:
+    if method == "rollup":
+        return read_rollup(sensor, tier, start, stop)
+    times, values = __read_history(sensor, start, stop, history)
+    if method == "raw":
+        return dict(time=times, value=values)
+    if method == "lttb":
+        return lttb(times, values, points)
+    columns = bucket(times, values, start.timestamp(), stop.timestamp(), points)
+    if method == "minmax":
+        del columns["mean"]
+    elif method == "mean":
+        del columns["min"], columns["max"]
+    return columns
+
+
+def __sensor_history(mgr: HardwareManager, sensor: str) -> Optional[History]:
+    for history in mgr.histories():
+        if history.sensor == sensor:
+            return history
+    return None
+
+
+def __too_many_rows(count: int) -> web.HTTPBadRequest:
+    return web.HTTPBadRequest(
+        text=f"{count} rows in the range, more than {HISTORY_MAX_POINTS}: "
+        f"narrow the range or use a thinning method"
+    )
+
+
+async def __history(request: web.Request, mgr: HardwareManager):
+    """Показания датчика из локальной БД за интервал с прореживанием.
+
+    Недавние интервалы, целиком попадающие в буфер менеджера
+    (:class:`utils.ringbuffer.History`), отдаются из памяти без чтения файлов.
+
+    Параметры запроса:
+    - `from`, `to` - границы интервала (ISO 8601 или UNIX time), обязательные;
+    - `sensor` - имя датчика (по умолчанию 'HV');
+    - `points` - желаемое число точек (по умолчанию 1000);
+    - `method` - `lttb`, `minmax`, `mean`, `bucket` (min/max/mean), `raw` или
+      `rollup` (строки агрегатов, см. :mod:`db_rollup`); `raw` и `rollup`
+      не прореживаются, больше `HISTORY_MAX_POINTS` строк - ошибка 400;
+    - `tier` - уровень агрегатов в секундах для `rollup` (по умолчанию
+      самый мелкий, дающий не больше `points` строк);
+    - `format` - `json` или `binary` (колонки float64 little-endian подряд,
+      порядок колонок в заголовке `X-Columns`, длина - в `X-Count`).
+    """
+    query = request.query
+    try:
+        start = __parse_time(query["from"])
+        stop = __parse_time(query["to"])
+        sensor = query.get("sensor", "HV")
+        points = int(query.get("points", 1000))
+        method = query.get("method", "lttb")
+        fmt = query.get("format", "json")
+        tier = int(query["tier"]) if "tier" in query else None
+    except (KeyError, ValueError) as exc:
+        raise web.HTTPBadRequest(text=f"bad query: {exc!r}")
+    if not re.fullmatch(r"[\w-]+", sensor):
+        raise web.HTTPBadRequest(text=f"bad sensor name '{sensor}'")
+    if stop <= start:
+        raise web.HTTPBadRequest(text="'to' must be after 'from'")
+    if not 0 < points <= HISTORY_MAX_POINTS:
+        raise web.HTTPBadRequest(text=f"'points' must be in 1..{HISTORY_MAX_POINTS}")
+    if method not in ("lttb", "minmax", "mean", "bucket", "raw", "rollup"):
+        raise web.HTTPBadRequest(text=f"unknown method '{method}'")
+    if tier is not None and tier not in DB_ROLLUP_TIERS:
+        raise web.HTTPBadRequest(text=f"'tier' must be one of {list(DB_ROLLUP_TIERS)}")
+    if fmt not in ("json", "binary"):
+        raise web.HTTPBadRequest(text=f"unknown format '{fmt}'")
+
+    if method == "rollup":
+        tier = tier or __rollup_tier(start, stop, points)
+    history = __sensor_history(mgr, sensor)
+
+    # raw и rollup не прореживаются, слишком длинный интервал - ошибка запроса;
+    # число строк оценивается до чтения, чтобы не загружать весь интервал в память
+    if method in ("raw", "rollup"):
+        count = await asyncio.to_thread(
+            __count_rows, sensor, start, stop, method, history, tier
+        )
+        if count > HISTORY_MAX_POINTS:
+            raise __too_many_rows(count)
+
+    # чтение файлов и прореживание не должны блокировать цикл событий
+    columns = await asyncio.to_thread(
+        __query_history, sensor, start, stop, method, points, history, tier
+    )
+    count = len(columns["time"])
+    if count > HISTORY_MAX_POINTS:
+        raise __too_many_rows(count)
+
+    if fmt == "binary":
+        return web.Response(
+            body=b"".join(column.astype("<f8").tobytes() for column in columns.values()),
+            content_type="application/octet-stream",
+            headers={
+                "X-Columns": ",".join(columns),
+                "X-Count": str(count),
+            },
+        )
+    return web.Response(
+        text=json.dumps(
+            {name: column.tolist() for name, column in columns.items()},
+            separators=(",", ":"),
+        ),
+        content_type="application/json",
+    )
+
+
+async def __latest(request: web.Request, mgr: HardwareManager):
+    """Последнее измерение датчика из буфера в памяти.
+
+    Параметры запроса: `sensor` (по умолчанию 'HV') или `block`.
+    """
+    block = request.query.get("block")
+    if block is not None:
+        histories = [h for h in mgr.histories() if h.block == block]
+    else:
+        histories = [__sensor_history(mgr, request.query.get("sensor", "HV"))]
+    history = histories[0] if histories else None
+    if history is None:
+        raise web.HTTPNotFound(text="unknown block or sensor")
+    latest = history.latest()
+    if latest is None:
+        raise web.HTTPNotFound(text="no readings yet")
+    return web.json_response(dict(block=history.block, sensor=history.sensor, **latest))
+
+
 async def __index(_):
     return web.FileResponse("./utils/transport/static/index.html")
 
 
+async def __metrics(request: web.Request):
+    """Метрики сервера в текстовом формате Prometheus."""
+    return web.Response(
+        text=REGISTRY.expose(), content_type="text/plain", charset="utf-8"
+    )
+
+
+def __register_gauges(mgr: HardwareManager, loop_lag: LoopLagMonitor):
+    """Датчики состояния менеджера, вычисляются только при запросе /metrics."""
+
+    def subscriptions():
+        return sorted(mgr.output.subscriptions, key=lambda s: s.id)
+
+    def input_queues():
+        yield ("",), mgr.input.qsize()
+        # очереди блоков за BlockRegistry
+        for name, block in getattr(mgr, "blocks", {}).items():
+            yield (name,), block.input.qsize()
+
+    def scaling():
+        managers = getattr(mgr, "blocks", {"": mgr})
+        for name, block in managers.items():
+            estimator = getattr(block, "scaling", None)
+            if estimator is not None:
+                for key, value in estimator.state().items():
+                    yield (name, key), value
+
+    REGISTRY.gauge(
+        "hv_hub_subscribers",
+        "Number of the output hub subscribers",
+        lambda: [((), len(mgr.output.subscriptions))],
+    )
+    REGISTRY.gauge(
+        "hv_hub_queue_depth",
+        "Pending messages of a hub subscriber",
+        lambda: [((str(s.id),), s.qsize()) for s in subscriptions()],
+        ("subscriber",),
+    )
+    REGISTRY.gauge(
+        "hv_hub_dropped_messages",
+        "Messages dropped by a hub subscriber",
+        lambda: [((str(s.id),), s.dropped) for s in subscriptions()],
+        ("subscriber",),
+    )
+    REGISTRY.gauge(
+        "hv_input_queue_length",
+        "Messages waiting in the manager input queue",
+        input_queues,
+        ("block",),
+    )
+    REGISTRY.gauge(
+        "hv_scaling",
+        "Online estimate of the scaling coefficients and their uncertainty",
+        scaling,
+        ("block", "parameter"),
+    )
+    REGISTRY.gauge(
+        "hv_event_loop_lag_seconds",
+        "Event loop wakeup delay (last and maximal)",
+        lambda: [(("last",), loop_lag.lag), (("max",), loop_lag.max_lag)],
+        ("value",),
+    )
+
+
 async def init_web(mgr: HardwareManager):
     """Aiohttp app.run alternative."""
     log = getLogger(LOGGER_NAME)
@@ -71,9 +433,16 @@ async def init_web(mgr: HardwareManager):
                 web.get("/", __index),
                 web.static("/assets", "./utils/transport/static/assets"),
                 web.get("/channel", partial(__websocket_handler, mgr=mgr)),
+                web.get("/history", partial(__history, mgr=mgr)),
+                web.get("/latest", partial(__latest, mgr=mgr)),
+                web.get("/metrics", __metrics),
             ]
         )
 
+        loop_lag = LoopLagMonitor()
+        loop_lag.start()
+        __register_gauges(mgr, loop_lag)
+
         runner = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(